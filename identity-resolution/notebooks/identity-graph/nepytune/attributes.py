@@ -0,0 +1,115 @@
+"""Synthesize user identity attributes from pools generated once."""
+
+import copy
+
+from faker import Faker
+from faker.providers.user_agent import Provider as UAProvider
+from user_agents import parse
+
+
+DEFAULT_POOL_SIZE = 10_000
+TRANSIENT_TYPES = ["cookie", "device"]
+
+
+class UserAgentProvider(UAProvider):
+    """Custom faker provider that derives user agent based on type."""
+
+    def user_agent_from_type(self, type_):
+        """Given type, generate appropriate user agent."""
+        while True:
+            user_agent = self.user_agent()
+            if type_ == "device":
+                if "Mobile" in user_agent:
+                    return user_agent
+            elif type_ == "cookie":
+                if "Mobile" not in user_agent:
+                    return user_agent
+            else:
+                raise ValueError(f"Unsupported {type_}")
+
+
+class AttributePool:
+    """
+    Pool of fake email parts and parsed user agents.
+
+    Faker and user agent parsing are expensive, so they are run only `size` times
+    per pool. Values for every transient id are then drawn from the pool.
+    """
+
+    def __init__(self, email_users, email_domains, user_agents):
+        """Create pool from already generated values."""
+        self.email_users = email_users
+        self.email_domains = email_domains
+        # user agent string, device, os, browser by transient type
+        self.user_agents = user_agents
+        self.email_serial = 0
+        self.email_serial_step = 1
+
+    @classmethod
+    def generate(cls, rng, size=DEFAULT_POOL_SIZE):
+        """Generate pool using faker seeded from the given generator."""
+        fake = Faker()
+        fake.seed_instance(int(rng.integers(2 ** 32)))
+        fake.add_provider(UserAgentProvider)
+
+        email_users, email_domains = [], []
+        for _ in range(size):
+            user, domain = fake.email().rsplit("@", 1)
+            email_users.append(user)
+            email_domains.append(domain)
+
+        user_agents = {}
+        for type_ in TRANSIENT_TYPES:
+            user_agents[type_] = []
+            for _ in range(size):
+                user_agent_str = fake.user_agent_from_type(type_)
+                user_agent = parse(user_agent_str)
+                user_agents[type_].append(
+                    (
+                        user_agent_str,
+                        user_agent.device.family,
+                        user_agent.os.family,
+                        user_agent.browser.family,
+                    )
+                )
+        return cls(email_users, email_domains, user_agents)
+
+    def emails(self, rng, count):
+        """
+        Draw `count` emails.
+
+        Each email gets a running serial number in its user part, so emails
+        never repeat, even though their parts do. Pools used by independent
+        streams should start at different serial, stepping by number of streams.
+        Without a serial, random 63-bit number is drawn instead.
+        """
+        users = rng.integers(len(self.email_users), size=count).tolist()
+        domains = rng.integers(len(self.email_domains), size=count).tolist()
+        if self.email_serial is None:
+            serials = rng.integers(2 ** 63, size=count).tolist()
+        else:
+            serial, step = self.email_serial, self.email_serial_step
+            serials = range(serial, serial + count * step, step)
+            self.email_serial += count * step
+        return [
+            f"{self.email_users[user]}{serial}@{self.email_domains[domain]}"
+            for user, domain, serial in zip(users, domains, serials)
+        ]
+
+    def for_stream(self, stream, streams):
+        """
+        Get copy of the pool drawing emails with serials unique to the stream.
+
+        Stream `None` means that serials are drawn at random.
+        """
+        pool = copy.copy(self)
+        pool.email_serial, pool.email_serial_step = stream, streams
+        return pool
+
+    def user_identities(self, rng, count):
+        """Draw `count` (type, user agent, device, os, browser) tuples."""
+        types = rng.integers(len(TRANSIENT_TYPES), size=count).tolist()
+        indexes = rng.integers(len(self.user_agents["cookie"]), size=count).tolist()
+        for type_idx, idx in zip(types, indexes):
+            type_ = TRANSIENT_TYPES[type_idx]
+            yield (type_, *self.user_agents[type_][idx])
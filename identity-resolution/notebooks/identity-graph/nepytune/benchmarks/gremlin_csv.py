@@ -0,0 +1,209 @@
+"""
+Compare throughput of writing gremlin CSV rows, per row and in batches.
+
+Node and edge generators are run on the data files given, then rows of every
+generated file are written again: one by one through csv writer with attribute
+maps, the way it was done before batching, and through `add` and `add_row`
+of batched writer. All outputs are checked to be the same.
+
+Usage:
+    python -m nepytune.benchmarks.gremlin_csv \\
+        --users path/to/users.json --facts path/to/facts.json \\
+        --urls path/to/urls.csv --titles path/to/titles.csv \\
+        --persistent-ids path/to/persistent.json --identity-groups path/to/ig.json \\
+        --website-groups path/to/website_groups.json
+"""
+
+import argparse
+import csv
+import filecmp
+import logging
+import os
+import tempfile
+import time
+
+from nepytune.edges import (
+    identity_groups as identity_group_edges,
+    ip_loc as ip_loc_edges,
+    persistent_ids,
+    user_website,
+    website_groups,
+)
+from nepytune.nodes import identity_groups, ip_loc, users, websites
+from nepytune.write_utils import GremlinEdgeCSV, GremlinNodeCSV, gremlin_writer
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def generators(args):
+    """Get generators to run, as (name, func, sources), for data files given."""
+    available = [
+        ("users", users.generate_user_nodes, (args.users,)),
+        ("persistent_nodes", users.generate_persistent_nodes, (args.persistent_ids,)),
+        (
+            "identity_group_nodes",
+            identity_groups.generate_identity_group_nodes,
+            (args.identity_groups,),
+        ),
+        ("ip_nodes", ip_loc.generate_ip_loc_nodes_from_facts, (args.facts,)),
+        ("websites", websites.generate_website_nodes, (args.urls, args.titles)),
+        (
+            "website_group_nodes",
+            websites.generate_website_group_nodes,
+            (args.website_groups,),
+        ),
+        (
+            "visited",
+            user_website.generate_user_website_edges,
+            ({"facts": args.facts, "urls": args.urls},),
+        ),
+        ("ip_edges", ip_loc_edges.generate_ip_loc_edges_from_facts, (args.facts,)),
+        (
+            "persistent_edges",
+            persistent_ids.generate_persistent_id_edges,
+            (args.persistent_ids,),
+        ),
+        (
+            "identity_group_edges",
+            identity_group_edges.generate_identity_group_edges,
+            (args.identity_groups,),
+        ),
+        (
+            "website_group_edges",
+            website_groups.generate_website_group_edges,
+            (args.website_groups,),
+        ),
+    ]
+    return [
+        (name, func, sources)
+        for name, func, sources in available
+        if all(
+            all(source.values()) if isinstance(source, dict) else source
+            for source in sources
+        )
+    ]
+
+
+def read_csv(path):
+    """Read header and rows of gremlin CSV file."""
+    with open(path, newline="") as f_h:
+        reader = csv.reader(f_h)
+        return next(reader), list(reader)
+
+
+def writer_layout(header):
+    """Get writer type, its attributes and position of attribute values in rows."""
+    attributes = [column for column in header if not column.startswith("~")]
+    if "~from" in header:
+        return GremlinEdgeCSV, attributes, slice(4, None)
+    return GremlinNodeCSV, attributes, slice(1, -1)
+
+
+def call_arguments(header, rows):
+    """Split rows into arguments of writer calls, with attribute maps or values."""
+    type_, attributes, values = writer_layout(header)
+    keys = [attribute.split(":")[0] for attribute in attributes]
+    if type_ is GremlinEdgeCSV:
+        return (
+            [(*row[:4], dict(zip(keys, row[values]))) for row in rows],
+            [(*row[:4], row[values]) for row in rows],
+        )
+    return (
+        [(row[0], dict(zip(keys, row[values])), row[-1]) for row in rows],
+        [(row[0], row[values], row[-1]) for row in rows],
+    )
+
+
+def write_per_row(path, header, arguments):
+    """Write rows one by one through csv writer, from attribute maps."""
+    type_, attributes, _ = writer_layout(header)
+    keys = [attribute.split(":")[0] for attribute in attributes]
+    with open(path, "w", 1024 * 1024) as f_h:
+        writer = csv.writer(f_h, quoting=csv.QUOTE_ALL)
+        writer.writerow(header)
+        if type_ is GremlinEdgeCSV:
+            for _id, _from, to, label, attribute_map in arguments:
+                writer.writerow(
+                    [_id, _from, to, label]
+                    + [attribute_map.get(key, "") for key in keys]
+                )
+        else:
+            for _id, attribute_map, label in arguments:
+                writer.writerow(
+                    [_id] + [attribute_map.get(key, "") for key in keys] + [label]
+                )
+
+
+def write_add(path, header, arguments):
+    """Write rows through batched writer, from attribute maps."""
+    type_, attributes, _ = writer_layout(header)
+    with gremlin_writer(type_, path, attributes) as writer:
+        for args in arguments:
+            writer.add(*args)
+
+
+def write_add_row(path, header, arguments):
+    """Write rows through batched writer, with positional attribute values."""
+    type_, attributes, _ = writer_layout(header)
+    with gremlin_writer(type_, path, attributes) as writer:
+        for args in arguments:
+            writer.add_row(*args)
+
+
+def measure(func, *args):
+    """Run function, return elapsed time."""
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    """Run gremlin CSV writers benchmark."""
+    parser = argparse.ArgumentParser(description="Benchmark gremlin CSV writers")
+    parser.add_argument("--users", type=str, default=None)
+    parser.add_argument("--facts", type=str, default=None)
+    parser.add_argument("--urls", type=str, default=None)
+    parser.add_argument("--titles", type=str, default=None)
+    parser.add_argument("--persistent-ids", type=str, default=None)
+    parser.add_argument("--identity-groups", type=str, default=None)
+    parser.add_argument("--website-groups", type=str, default=None)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, func, sources in generators(args):
+            generated = os.path.join(tmp_dir, f"{name}.csv")
+            elapsed = measure(func, *sources, generated)
+            header, rows = read_csv(generated)
+            logger.info(
+                "%-22s %-10s %10.0f rows/s", name, "generator", len(rows) / elapsed
+            )
+
+            with_maps, with_values = call_arguments(header, rows)
+            writers = [
+                ("per row", write_per_row, with_maps),
+                ("add", write_add, with_maps),
+                ("add_row", write_add_row, with_values),
+            ]
+            baseline = None
+            for writer_name, writer, arguments in writers:
+                dst = os.path.join(tmp_dir, f"{name}_{writer_name}.csv")
+                elapsed = min(
+                    measure(writer, dst, header, arguments)
+                    for _ in range(args.repeat)
+                )
+                if not filecmp.cmp(generated, dst, shallow=False):
+                    raise ValueError(f"{writer_name} output differs from {generated}")
+                baseline = baseline or elapsed
+                logger.info(
+                    "%-22s %-10s %10.0f rows/s %6.2fx",
+                    name,
+                    writer_name,
+                    len(rows) / elapsed,
+                    baseline / elapsed,
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""
+Compare id schemes: collision rate of their ids and throughput of edge generators.
+
+Collisions are counted among ids of distinct synthetic edges, both for full
+ids and for ids truncated to few bits, where the count can be compared with
+the expected one. Any collision of full ids, or count of truncated ones far
+from the expected one, fails the benchmark with non-zero exit status.
+Edge generators run on the data files given.
+
+Usage:
+    python -m nepytune.benchmarks.ids --edges 1000000
+    python -m nepytune.benchmarks.ids \\
+        --facts path/to/facts.json --urls path/to/urls.csv \\
+        --persistent-ids path/to/persistent.json --identity-groups path/to/ig.json \\
+        --website-groups path/to/website_groups.json
+"""
+
+import argparse
+import logging
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+
+from nepytune import utils
+from nepytune.compression import open_file
+from nepytune.edges import (
+    identity_groups,
+    ip_loc,
+    persistent_ids,
+    user_website,
+    website_groups,
+)
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+TRUNCATED_BITS = 24
+# collisions of truncated ids are roughly Poisson distributed
+TOLERATED_DEVIATIONS = 6
+
+
+def generate_edges(count, seed=0):
+    """Generate distinct visited-like edges, as (from, to, attributes)."""
+    rng = random.Random(seed)
+    for number in range(count):
+        uid = f"u{rng.randrange(count)}"
+        url = f"https://site{rng.randrange(10 ** 5)}.com/page{rng.randrange(100)}"
+        yield uid, url, {
+            # edge number makes every edge distinct
+            "ts": f"2017-07-{1 + number % 28:02d}T00:00:{number:08d}",
+            "visited_url": url,
+            "uid": uid,
+            "state": f"S{rng.randrange(50)}",
+            "city": f"C{rng.randrange(500)}",
+            "ip_address": ".".join(str(rng.randrange(256)) for _ in range(4)),
+        }
+
+
+def count_collisions(ids):
+    """Count ids equal to some of the ids before them."""
+    seen = set()
+    collisions = 0
+    for id_ in ids:
+        collisions += id_ in seen
+        seen.add(id_)
+    return collisions
+
+
+def expected_collisions(count, bits):
+    """Get expected number of collisions among random ids of given size."""
+    space = 2 ** bits
+    return count - space * (1 - (1 - 1 / space) ** count)
+
+
+def check_collisions(scheme, edges):
+    """Log collisions of full and truncated ids of the distinct edges, return if ok."""
+    start = time.perf_counter()
+    ids = [scheme.get_id(*edge) for edge in edges]
+    elapsed = time.perf_counter() - start
+    full_bits = len(ids[0]) * 4
+    collisions = count_collisions(ids)
+    logger.info(
+        "%-8s %10.0f ids/s, %d collisions of %d-bit ids among %d edges",
+        scheme.name,
+        len(ids) / elapsed,
+        collisions,
+        full_bits,
+        len(ids),
+    )
+    digits = TRUNCATED_BITS // 4
+    truncated = count_collisions(id_[:digits] for id_ in ids)
+    expected = expected_collisions(len(ids), TRUNCATED_BITS)
+    logger.info(
+        "%-8s %d collisions of %d-bit prefixes, %.0f expected",
+        scheme.name,
+        truncated,
+        TRUNCATED_BITS,
+        expected,
+    )
+
+    ok = True
+    if collisions:
+        logger.error("%s ids collide", scheme.name)
+        ok = False
+    if abs(truncated - expected) > TOLERATED_DEVIATIONS * math.sqrt(expected) + 1:
+        logger.error("%s ids are not uniformly distributed", scheme.name)
+        ok = False
+    return ok
+
+
+def edge_generators(args):
+    """Get edge generators to run, as (name, func, src), for data files given."""
+    generators = []
+    if args.facts and args.urls:
+        generators.append(
+            (
+                "visited",
+                user_website.generate_user_website_edges,
+                {"facts": args.facts, "urls": args.urls},
+            )
+        )
+    if args.facts:
+        generators.append(
+            ("ip_loc", ip_loc.generate_ip_loc_edges_from_facts, args.facts)
+        )
+    if args.persistent_ids:
+        generators.append(
+            (
+                "persistent_ids",
+                persistent_ids.generate_persistent_id_edges,
+                args.persistent_ids,
+            )
+        )
+    if args.identity_groups:
+        generators.append(
+            (
+                "identity_groups",
+                identity_groups.generate_identity_group_edges,
+                args.identity_groups,
+            )
+        )
+    if args.website_groups:
+        generators.append(
+            (
+                "website_groups",
+                website_groups.generate_website_group_edges,
+                args.website_groups,
+            )
+        )
+    return generators
+
+
+def count_rows(path):
+    """Count CSV rows, without header."""
+    with open_file(path, "rb") as f_h:
+        return sum(1 for _ in f_h) - 1
+
+
+def main():
+    """Run id schemes benchmark."""
+    parser = argparse.ArgumentParser(description="Benchmark id schemes")
+    parser.add_argument("--edges", type=int, default=1_000_000)
+    parser.add_argument("--facts", type=str, default=None)
+    parser.add_argument("--urls", type=str, default=None)
+    parser.add_argument("--persistent-ids", type=str, default=None)
+    parser.add_argument("--identity-groups", type=str, default=None)
+    parser.add_argument("--website-groups", type=str, default=None)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    edges = list(generate_edges(args.edges))
+    failed = [
+        scheme.name
+        for scheme in utils.ID_SCHEMES.values()
+        if not check_collisions(scheme, edges)
+    ]
+    del edges
+    if failed:
+        logger.error("Collision check failed for %s", ", ".join(failed))
+        sys.exit(1)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        dst = os.path.join(tmp_dir, "edges.csv")
+        for name, func, src in edge_generators(args):
+            for scheme in utils.ID_SCHEMES.values():
+                utils.id_scheme = scheme
+                elapsed = min(_timed(func, src, dst) for _ in range(args.repeat))
+                logger.info(
+                    "%-16s %-8s %10.0f rows/s",
+                    name,
+                    scheme.name,
+                    count_rows(dst) / elapsed,
+                )
+    utils.id_scheme = utils.get_id_scheme()
+
+
+def _timed(func, src, dst):
+    """Run edge generator, return elapsed time."""
+    start = time.perf_counter()
+    func(src, dst)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    main()
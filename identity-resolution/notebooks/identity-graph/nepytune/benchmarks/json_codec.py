@@ -0,0 +1,120 @@
+"""
+Compare throughput of json lines codecs used for reading and writing data files.
+
+Usage:
+    python -m nepytune.benchmarks.json_codec --records 200000
+    python -m nepytune.benchmarks.json_codec --json-lines path/to/facts.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+
+from nepytune.write_utils import JSON_CODECS, json_lines_file, JsonLinesWriter
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def generate_records(count, seed=0):
+    """Generate extended facts-like records."""
+    rng = random.Random(seed)
+    for uid in range(count):
+        yield {
+            "uid": f"u{uid}",
+            "facts": [
+                {
+                    "fid": rng.randrange(10 ** 9),
+                    "ts": 1500000000000 + rng.randrange(10 ** 9),
+                    "state": f"S{rng.randrange(50)}",
+                    "city": f"C{rng.randrange(500)}",
+                    "ip_address": ".".join(str(rng.randrange(256)) for _ in range(4)),
+                }
+                for _ in range(rng.randrange(1, 10))
+            ],
+            "user_agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36",
+            "email": f"user{uid}@example.com",
+            "type": rng.choice(["cookie", "device"]),
+        }
+
+
+def stdlib_text_read(path):
+    """Read records the way it was done before codecs: text lines, `json.loads`."""
+    with open(path) as f_h:
+        for line in f_h:
+            yield json.loads(line)
+
+
+def measure(func):
+    """Run function, return its result and elapsed time."""
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+
+def main():
+    """Run json codecs benchmark."""
+    parser = argparse.ArgumentParser(description="Benchmark json lines codecs")
+    parser.add_argument("--json-lines", type=str, default=None)
+    parser.add_argument("--records", type=int, default=200_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        src = args.json_lines
+        if src is None:
+            src = os.path.join(tmp_dir, "records.json")
+            logger.info("Generating %d records into %s", args.records, src)
+            with open(src, "wb") as f_h:
+                with JsonLinesWriter(f_h, codec=JSON_CODECS["json"]) as writer:
+                    for data in generate_records(args.records):
+                        writer.write(data)
+        size = os.path.getsize(src) / 2 ** 20
+        records = list(stdlib_text_read(src))
+
+        def report(name, operation, elapsed):
+            logger.info(
+                "%-22s %-6s %8.1f MB/s %10.0f records/s",
+                name,
+                operation,
+                size / elapsed,
+                len(records) / elapsed,
+            )
+
+        def best(func):
+            return min(measure(func)[1] for _ in range(args.repeat))
+
+        def read_per_line():
+            return sum(1 for _ in stdlib_text_read(src))
+
+        report("json (text, per line)", "read", best(read_per_line))
+
+        def write_per_line():
+            with open(os.path.join(tmp_dir, "out.json"), "w") as f_h:
+                for data in records:
+                    f_h.write(json.dumps(data) + "\n")
+
+        report("json (text, per line)", "write", best(write_per_line))
+
+        for name, codec in JSON_CODECS.items():
+
+            def read():
+                with open(src, "rb") as f_h:
+                    return sum(1 for _ in json_lines_file(f_h, codec=codec))
+
+            def write():
+                with open(os.path.join(tmp_dir, "out.json"), "wb") as f_h:
+                    with JsonLinesWriter(f_h, codec=codec) as writer:
+                        for data in records:
+                            writer.write(data)
+
+            report(f"{name} (batched)", "read", best(read))
+            report(f"{name} (batched)", "write", best(write))
+
+
+if __name__ == "__main__":
+    main()
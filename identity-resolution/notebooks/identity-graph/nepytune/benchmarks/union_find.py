@@ -0,0 +1,91 @@
+"""
+Compare union-find engines used by `add persistent_id`.
+
+Usage:
+    python -m nepytune.benchmarks.union_find --edges 1000000
+    python -m nepytune.benchmarks.union_find --user-to-user path/to/user_to_user.csv
+"""
+
+import argparse
+import concurrent.futures
+import csv
+import hashlib
+import logging
+import os
+import random
+import resource
+import tempfile
+import time
+
+from nepytune.cli.add import UNION_FIND_ENGINES
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def generate_user_to_user(dst, edges, nodes, seed=0):
+    """Write random user_to_user mapping csv file."""
+    rng = random.Random(seed)
+    with open(dst, "w") as f_h:
+        writer = csv.writer(f_h)
+        for _ in range(edges):
+            writer.writerow([f"u{rng.randrange(nodes)}", f"u{rng.randrange(nodes)}"])
+
+
+def run_engine(engine, user_mapping_path):
+    """Build user groups with given engine, return timings and output digest."""
+    start = time.perf_counter()
+    uf_ds = UNION_FIND_ENGINES[engine](user_mapping_path)
+    built = time.perf_counter()
+    digest = hashlib.sha1()
+    count = 0
+    for persistent_id, node_group in uf_ds.node_groups():
+        digest.update(f"{persistent_id}:{sorted(node_group)}".encode("utf-8"))
+        count += 1
+    done = time.perf_counter()
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return digest.hexdigest(), count, built - start, done - built, max_rss
+
+
+def main():
+    """Run union-find engines benchmark."""
+    parser = argparse.ArgumentParser(description="Benchmark union-find engines")
+    parser.add_argument("--user-to-user", type=str, default=None)
+    parser.add_argument("--edges", type=int, default=1_000_000)
+    parser.add_argument("--nodes", type=int, default=None)
+    parser.add_argument(
+        "--engines", nargs="+", default=list(UNION_FIND_ENGINES),
+        choices=list(UNION_FIND_ENGINES)
+    )
+    args = parser.parse_args()
+
+    path = args.user_to_user
+    if path is None:
+        fd, path = tempfile.mkstemp(suffix=".csv")
+        os.close(fd)
+        logger.info("Generating %s random edges into %s", args.edges, path)
+        generate_user_to_user(path, args.edges, args.nodes or args.edges)
+
+    try:
+        digests = {}
+        for engine in args.engines:
+            # fresh process per engine, so that peak RSS is measured separately
+            with concurrent.futures.ProcessPoolExecutor(max_workers=1) as executor:
+                digest, count, build_time, groups_time, max_rss = executor.submit(
+                    run_engine, engine, path
+                ).result()
+            digests[engine] = digest
+            print(f"{engine}: groups={count} build={build_time:.2f}s "
+                  f"node_groups={groups_time:.2f}s peak_rss={max_rss}kB")
+
+        reference = args.engines[0]
+        for engine in args.engines[1:]:
+            identical = digests[engine] == digests[reference]
+            print(f"{engine} output identical to {reference}: {identical}")
+    finally:
+        if args.user_to_user is None:
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,49 +1,41 @@
 import argparse
 import configparser
+import itertools
 import json
-import time
-import random
+import os
 import sys
 import csv
 import logging
-import ipaddress
-from collections import namedtuple
-from urllib.parse import urlparse
-
-from faker import Faker
-from faker.providers.user_agent import Provider as UAProvider
-from user_agents import parse
 
+import numpy as np
 
 from networkx.utils.union_find import UnionFind
 
-from nepytune.write_utils import json_lines_file
+from nepytune import spill, url_groups
+from nepytune.compression import compression_of, open_file
+from nepytune.attributes import AttributePool, DEFAULT_POOL_SIZE
+from nepytune.facts import build_facts_sharded, DEFAULT_SHARDS
+from nepytune.keyed_facts import append_facts
+from nepytune.rng import root_entropy, stream_rng
+from nepytune.write_utils import json_lines_file, json_lines_writer
 from nepytune.utils import hash_
+from nepytune.locations import LocationTable, random_ip_loc_from_group, unique
+from nepytune.lookup import ensure_index, JsonLinesIndex
+from nepytune.union_find import (
+    extract_array_user_groups,
+    extract_sharded_user_groups,
+    read_user_pairs,
+    UnionFindSnapshot,
+)
 
 
 COMPANY_MIN_SIZE = 6
+CHUNK_SIZE = 100_000
 
 logger = logging.getLogger("add")
 logger.setLevel(logging.INFO)
 
 
-class UserAgentProvider(UAProvider):
-    """Custom faker provider that derives user agent based on type."""
-
-    def user_agent_from_type(self, type_):
-        """Given type, generate appropriate user agent."""
-        while True:
-            user_agent = self.user_agent()
-            if type_ == "device":
-                if "Mobile" in user_agent:
-                    return user_agent
-            elif type_ == "cookie":
-                if "Mobile" not in user_agent:
-                    return user_agent
-            else:
-                raise ValueError(f"Unsupported {type_}")
-
-
 class PersistentNodes(UnionFind):
     """networkx.UnionFind datastructure with custom iterable over node sets."""
 
@@ -55,7 +47,7 @@ class PersistentNodes(UnionFind):
 
 def extract_user_groups(user_mapping_path):
     """Generate disjoint user groups based on union find datastructure."""
-    with open(user_mapping_path) as f_h:
+    with open_file(user_mapping_path) as f_h:
         pers_reader = csv.reader(f_h, delimiter=",")
         uf_ds = PersistentNodes()
         for row in pers_reader:
@@ -63,47 +55,114 @@ def extract_user_groups(user_mapping_path):
         return uf_ds
 
 
+UNION_FIND_ENGINES = {
+    "array": extract_array_user_groups,
+    "networkx": extract_user_groups,
+}
+
+
 def generate_persistent_groups(user_groups, dst):
     """Write facts about persistent to transient nodes mapping."""
-    with open(dst, "w") as f_h:
+    with json_lines_writer(dst) as writer:
         for persistent_id, node_group in user_groups.node_groups():
-            f_h.write(
-                json.dumps({"pid": persistent_id, "transientIds": list(node_group)})
-                + "\n"
+            writer.write({"pid": persistent_id, "transientIds": list(node_group)})
+
+
+def generate_persistent_group_changes(snapshot, changes, dst):
+    """Write facts about changed persistent groups, with pids they replaced."""
+    with json_lines_writer(dst) as writer:
+        for members, replaced in changes:
+            node_group = snapshot.node_names(members)
+            replaced_ids = [hash_(snapshot.node_names(nodes)) for nodes in replaced]
+            writer.write(
+                {
+                    "pid": hash_(node_group),
+                    "transientIds": node_group,
+                    "replacedPids": replaced_ids,
+                }
             )
 
 
-def generate_identity_groups(persistent_ids_file, distribution, dst, _seed=None):
+def apply_user_mapping_delta(snapshot_dir, user_mapping_delta_path, dst):
+    """Apply new user mapping links to union find snapshot, write changed groups."""
+    snapshot = UnionFindSnapshot.load(snapshot_dir)
+    with open_file(user_mapping_delta_path) as f_h:
+        pairs = list(itertools.chain.from_iterable(read_user_pairs(f_h)))
+    snapshot, changes = snapshot.apply(pairs)
+    generate_persistent_group_changes(snapshot, changes, dst)
+    if snapshot.needs_compaction():
+        logger.info("Compact union find snapshot deltas")
+        snapshot = snapshot.compacted()
+    snapshot.save(snapshot_dir)
+    return len(changes)
+
+
+def load_persistent_ids(persistent_ids_file, chunk_size=CHUNK_SIZE):
+    """Load persistent ids into compact array of byte strings."""
+    chunks = []
+    with open_file(persistent_ids_file, "rb") as f_h:
+        pids = (data["pid"].encode("utf-8") for data in json_lines_file(f_h))
+        while True:
+            chunk = list(itertools.islice(pids, chunk_size))
+            if not chunk:
+                break
+            chunks.append(np.array(chunk, dtype=bytes))
+    if not chunks:
+        return np.array([], dtype=bytes)
+    return np.concatenate(chunks)
+
+
+def draw_identity_group_slices(rng, distribution, count):
+    """
+    Draw identity group sizes covering `count` items, return group starts and sizes.
+
+    Sizes are drawn in batches from the distribution. Group of size 0 still occupies
+    one item, meaning that this item does not belong to any identity group.
+    """
+    sizes, weights = (np.array(values) for values in zip(*distribution.items()))
+    weights = weights / weights.sum()
+    mean_step = max(np.dot(np.maximum(sizes, 1), weights), 1)
+
+    drawn, covered = [], 0
+    while covered < count:
+        batch = int((count - covered) / mean_step * 1.05) + 16
+        batch_sizes = rng.choice(sizes, size=batch, p=weights)
+        drawn.append(batch_sizes)
+        covered += int(np.maximum(batch_sizes, 1).sum())
+
+    group_sizes = np.concatenate(drawn) if drawn else np.array([], dtype=int)
+    steps = np.maximum(group_sizes, 1)
+    starts = np.cumsum(steps) - steps
+    in_range = starts < count
+    starts = starts[in_range]
+    return starts, np.minimum(group_sizes[in_range], count - starts)
+
+
+def generate_identity_groups(
+    persistent_ids_file, distribution, dst, _seed=None, chunk_size=CHUNK_SIZE
+):
     """Write facts about identity_group mapping."""
-    if _seed is not None:
-        random.seed(time.time())
-
-    with open(persistent_ids_file) as f_h:
-        pids = [data["pid"] for data in json_lines_file(f_h)]
-
-    random.shuffle(pids)
-
-    sizes, weights = zip(*[[k, v] for k, v in distribution.items()])
-    i = 0
-    with open(dst, "w") as f_h:
-        while i < len(pids):
-            size, *_ = random.choices(sizes, weights=weights)
-            size = min(size, abs(len(pids) - i))
-            persistent_ids = [pids[i + j] for j in range(size)]
-            type_ = "household" if len(persistent_ids) < COMPANY_MIN_SIZE else "company"
-            f_h.write(
-                json.dumps(
+    rng = np.random.default_rng(_seed)
+
+    pids = load_persistent_ids(persistent_ids_file)
+    pids = pids[rng.permutation(len(pids))]
+    starts, sizes = draw_identity_group_slices(rng, distribution, len(pids))
+
+    with json_lines_writer(dst) as writer:
+        for chunk_start in range(0, len(starts), chunk_size):
+            chunk = slice(chunk_start, chunk_start + chunk_size)
+            for start, size in zip(starts[chunk].tolist(), sizes[chunk].tolist()):
+                persistent_ids = [
+                    pid.decode("utf-8") for pid in pids[start:start + size].tolist()
+                ]
+                type_ = "household" if size < COMPANY_MIN_SIZE else "company"
+                writer.write(
                     {
                         "igid": hash_(persistent_ids),
                         "type": type_,
                         "persistentIds": persistent_ids,
                     }
                 )
-                + "\n"
-            )
-            # advance even if size was 0, meaning that persistent id
-            # does not belong to any identity_group
-            i += size or 1
 
 
 def parse_distribution(size, weights):
@@ -124,13 +183,28 @@ def parse_distribution(size, weights):
     return dict(zip(size, weights))
 
 
-def get_ip_addresses(cidr):
-    """Get list of hosts within given network cidr."""
-    network = ipaddress.ip_network(cidr)
-    hosts = list(network.hosts())
-    if not hosts:
-        return [network.network_address]
-    return hosts
+def transient_ids_with_persistent_ids(persistent_ids_facts_file):
+    """
+    Get container of transient ids which belong to some persistent id.
+
+    It is sidecar index of persistent ids file, `{path}.transientIds.idx`, which
+    is created next to the file unless it is up to date already. Compressed files
+    cannot be indexed, nor can files in read-only directories, so their transient
+    ids are collected into a set in memory instead.
+    """
+    if not compression_of(persistent_ids_facts_file):
+        try:
+            ensure_index(persistent_ids_facts_file, "transientIds")
+            return JsonLinesIndex(persistent_ids_facts_file, "transientIds")
+        except OSError as exc:
+            logger.info("Cannot index %s (%s)", persistent_ids_facts_file, exc)
+    logger.info("Collecting transient ids of %s in memory", persistent_ids_facts_file)
+    with open_file(persistent_ids_facts_file, "rb") as f_h:
+        return {
+            transient_id
+            for data in json_lines_file(f_h)
+            for transient_id in data["transientIds"]
+        }
 
 
 def build_iploc_knowledge(
@@ -139,6 +213,7 @@ def build_iploc_knowledge(
     identity_group_facts_file,
     transient_ids_facts_file,
     dst,
+    _seed=None,
 ):
     """
     Given some fact files, generate random locations and IP addresses in a sane way.
@@ -156,130 +231,125 @@ def build_iploc_knowledge(
 
     Probabilities makes highly probably for transient nodes to be within the same city,
     and the same state. Same goes for persistent nodes.
-    """
-    IPLoc = namedtuple("IPLoc", "state, city, ip_address")
 
-    with open(ip_facts_file) as f_h:
-        ip_cidrs_by_state_city = list(json_lines_file(f_h))
+    Sidecar index of persistent ids file is created next to it, see
+    `transient_ids_with_persistent_ids`.
+    """
+    rng = np.random.default_rng(_seed)
+    location_table = LocationTable.from_file(ip_facts_file)
 
-    knowledge = {"identity_group": {}, "persistent_id": {}, "transient_ids": {}}
+    knowledge = {"identity_group": {}, "persistent_id": {}}
 
     def random_ip_loc():
-        state_count, *_ = random.choices([1, 2], weights=[0.98, 0.02])
-        for state_data in random.choices(ip_cidrs_by_state_city, k=state_count):
-            city_count, *_ = random.choices(
-                [1, 2, 3, 4], weights=[0.85, 0.1, 0.04, 0.01]
-            )
-            for city_data in random.choices(state_data["cities"], k=city_count):
-                random_cidr = random.choice(city_data["cidr_blocks"])
-                yield IPLoc(
-                    state=state_data["state"],
-                    city=city_data["city"],
-                    ip_address=str(random.choice(get_ip_addresses(random_cidr))),
-                )
-
-    def random_ip_loc_from_group(locations):
-        # compute weights, each next item is two times less likely probably than the previous
-        weights = [1]
-        for _ in locations[:-1]:
-            weights.append(weights[-1] / 2)
+        return unique(location_table.random_ip_loc(rng))
 
-        count = len(locations)
-        random_count, *_ = random.choices(list(range(1, count + 1)), weights=weights)
-        return list(set(random.choices(locations, k=random_count)))
+    def write_transient_ip_loc(writer, transient_id, locations):
+        writer.write(
+            {
+                "transient_id": transient_id,
+                "loc": [item._asdict() for item in locations],
+            }
+        )
 
     logger.info("Creating Identity group / persistent ids IP facts")
-    with open(identity_group_facts_file) as f_h:
+    with open_file(identity_group_facts_file, "rb") as f_h:
         for data in json_lines_file(f_h):
-            locations = knowledge["identity_group"][data["igid"]] = list(
-                set(random_ip_loc())
-            )
+            locations = knowledge["identity_group"][data["igid"]] = random_ip_loc()
 
             for persistent_id in data["persistentIds"]:
                 knowledge["persistent_id"][persistent_id] = random_ip_loc_from_group(
-                    locations
+                    rng, locations
                 )
 
-    logger.info("Creating persistent / transient ids IP facts")
-    with open(persistent_ids_facts_file) as f_h:
-        for data in json_lines_file(f_h):
-            persistent_id = data["pid"]
-            # handle case where persistent id does not belong to any identity group
-            if data["pid"] not in knowledge:
-                knowledge["persistent_id"][persistent_id] = random_ip_loc_from_group(
-                    list(set(random_ip_loc()))
-                )
-            for transient_id in data["transientIds"]:
-                knowledge["transient_ids"][transient_id] = random_ip_loc_from_group(
-                    knowledge["persistent_id"][persistent_id]
-                )
+    # transient ids facts are written as soon as they are drawn; instead of
+    # remembering them all, sidecar index of persistent ids file tells which
+    # transient ids were already covered
+    persistent_index = transient_ids_with_persistent_ids(persistent_ids_facts_file)
+
+    with json_lines_writer(dst) as writer:
+        logger.info("Creating persistent / transient ids IP facts")
+        with open_file(persistent_ids_facts_file, "rb") as f_h:
+            for data in json_lines_file(f_h):
+                persistent_id = data["pid"]
+                # handle case where persistent id does not belong to any identity group
+                if persistent_id not in knowledge["persistent_id"]:
+                    locations = random_ip_loc_from_group(rng, random_ip_loc())
+                    knowledge["persistent_id"][persistent_id] = locations
+                for transient_id in data["transientIds"]:
+                    write_transient_ip_loc(
+                        writer,
+                        transient_id,
+                        random_ip_loc_from_group(
+                            rng, knowledge["persistent_id"][persistent_id]
+                        ),
+                    )
+
         # now assign random ip location for transient ids without persistent ids
         logger.info("Processing remaining transient ids facts")
-        with open(transient_ids_facts_file) as t_f_h:
+        remaining = set()
+        with open_file(transient_ids_facts_file, "rb") as t_f_h:
             for data in json_lines_file(t_f_h):
-                if data["uid"] not in knowledge["transient_ids"]:
-                    knowledge["transient_ids"][data["uid"]] = list(
-                        set(
-                            random_ip_loc_from_group(  # "transient group" level
-                                random_ip_loc_from_group(  # "persistent group" level
-                                    list(set(random_ip_loc()))  # "identity group" level
-                                )
-                            )
-                        )
-                    )
-
-    with open(dst, "w") as f_h:
-        for key, data in knowledge["transient_ids"].items():
-            f_h.write(
-                json.dumps(
-                    {"transient_id": key, "loc": [item._asdict() for item in data]}
+                if data["uid"] in remaining or data["uid"] in persistent_index:
+                    continue
+                remaining.add(data["uid"])
+                write_transient_ip_loc(
+                    writer,
+                    data["uid"],
+                    random_ip_loc_from_group(
+                        rng,  # "transient group" level
+                        random_ip_loc_from_group(  # "persistent group" level
+                            rng, random_ip_loc()  # "identity group" level
+                        ),
+                    ),
                 )
-                + "\n"
-            )
 
-def generate_website_groups(urls_file, iab_categories, dst):
-    """Generate website groups."""
-    website_groups = {}
-    with open(urls_file) as urls_f:
-        urls_reader = csv.reader(urls_f, delimiter=",")
-        for row in urls_reader:
-            url = row[1]
-            root_url = urlparse("//" + url).hostname
-            if root_url not in website_groups:
-                iab_category = random.choice(iab_categories)
-                website_groups[root_url] = {
-                    "websites": [url],
-                    "category": {
-                        "code": iab_category[0],
-                        "name": iab_category[1]
-                    }
-                }
-            else:
-                website_groups[root_url]["websites"].append(url)
-
-    with open(dst, "w") as dst_file:
-        for url, data in website_groups.items():
-            website_group = {
-                "url": url,
-                "websites": data["websites"],
-                "category": data["category"]
-            }
-            website_group_id = hash_(website_group.items())
-            website_group["id"] = website_group_id
-            dst_file.write(
-                json.dumps(website_group) + "\n"
-            )
+
+def generate_website_groups(
+    urls_file,
+    iab_categories,
+    dst,
+    _seed=None,
+    workers=1,
+    memory_budget=None,
+    spill_dir=None,
+):
+    """
+    Generate website groups.
+
+    Category of each group is drawn at random keyed by its hostname, so output
+    is deterministic under the seed, no matter how urls file was split.
+    When `memory_budget` (bytes) is given and urls file does not fit in it,
+    groups are built in external memory.
+    """
+    entropy = root_entropy(_seed)
+    shards = 1
+    if memory_budget:
+        shards = spill.shard_count([urls_file], memory_budget)
+    if shards > 1:
+        logger.info("Grouping urls in %d on-disk shards", shards)
+        url_groups.generate_website_groups_external(
+            urls_file, iab_categories, dst, entropy, workers, shards, spill_dir
+        )
+    else:
+        url_groups.generate_website_groups_in_memory(
+            urls_file, iab_categories, dst, entropy, workers
+        )
 
 
 def read_iab_categories(iab_filepath):
     """Read IAB categories tuples from JSON file."""
-    with open(iab_filepath) as iab_file:
+    with open_file(iab_filepath) as iab_file:
         categories = json.loads(iab_file.read())
         return [(code, category) for code, category in categories.items()]
 
 
 def build_user_identitity_knowledge(
-    persistent_ids_facts_file, transient_ids_facts_file, dst
+    persistent_ids_facts_file,
+    transient_ids_facts_file,
+    dst,
+    pool_size=DEFAULT_POOL_SIZE,
+    _seed=None,
+    chunk_size=CHUNK_SIZE,
 ):
     """
     Generate some facts about user identities.
@@ -295,51 +365,72 @@ def build_user_identitity_knowledge(
             * device family (if type device)
             * OS
             * browser
+
+    Emails and user agents are drawn from attribute pool of `pool_size` values.
     """
+    rng = np.random.default_rng(_seed)
+    logger.info("Generating attribute pool of size %d", pool_size)
+    pool = AttributePool.generate(rng, pool_size)
     user_emails = {}
-    fake = Faker()
-    fake.add_provider(UserAgentProvider)
 
     logger.info("Creating emails per transient ids")
     # create fake emails for devices with persistent ids
-    with open(persistent_ids_facts_file) as f_h:
-        for data in json_lines_file(f_h):
-            nemail = random.randint(1, len(data["transientIds"]))
-            emails = [fake.email() for _ in range(nemail)]
-            for transient_id in data["transientIds"]:
-                user_emails[transient_id] = random.choice(emails)
+    with open_file(persistent_ids_facts_file, "rb") as f_h:
+        data = json_lines_file(f_h)
+        while True:
+            groups = [
+                group["transientIds"] for group in itertools.islice(data, chunk_size)
+            ]
+            if not groups:
+                break
+            sizes = np.array([len(group) for group in groups])
+            # each group gets from 1 to len(group) emails
+            nemails = (rng.random(len(groups)) * sizes).astype(int) + 1
+            emails = pool.emails(rng, int(nemails.sum()))
+            email_offsets = np.repeat(np.cumsum(nemails) - nemails, sizes)
+            choices = email_offsets + (
+                rng.random(int(sizes.sum())) * np.repeat(nemails, sizes)
+            ).astype(int)
+            transient_ids = itertools.chain.from_iterable(groups)
+            for transient_id, choice in zip(transient_ids, choices.tolist()):
+                user_emails[transient_id] = emails[choice]
 
     # create fake emails for devices without persistent ids
-    with open(transient_ids_facts_file) as t_f_h:
-        for data in json_lines_file(t_f_h):
-            if data["uid"] not in user_emails:
-                user_emails[data["uid"]] = fake.email()
+    with open_file(transient_ids_facts_file, "rb") as t_f_h:
+        uids = (data["uid"] for data in json_lines_file(t_f_h))
+        while True:
+            missing = list(
+                dict.fromkeys(
+                    uid
+                    for uid in itertools.islice(uids, chunk_size)
+                    if uid not in user_emails
+                )
+            )
+            if not missing:
+                break
+            user_emails.update(zip(missing, pool.emails(rng, len(missing))))
 
     logger.info("Writing down user identity facts")
-    with open(dst, "w") as f_h:
-        for transient_id, data in user_emails.items():
-            type_ = random.choice(["cookie", "device"])
-            uset_agent_str = fake.user_agent_from_type(type_)
-
-            user_agent = parse(uset_agent_str)
-            device = user_agent.device.family
-            operating_system = user_agent.os.family
-            browser = user_agent.browser.family
-
-            f_h.write(
-                json.dumps(
+    with json_lines_writer(dst) as writer:
+        items = iter(user_emails.items())
+        while True:
+            chunk = list(itertools.islice(items, chunk_size))
+            if not chunk:
+                break
+            identities = pool.user_identities(rng, len(chunk))
+            for (transient_id, email), identity in zip(chunk, identities):
+                type_, user_agent_str, device, operating_system, browser = identity
+                writer.write(
                     {
                         "transient_id": transient_id,
-                        "user_agent": uset_agent_str,
+                        "user_agent": user_agent_str,
                         "device": device,
                         "os": operating_system,
                         "browser": browser,
-                        "email": data,
+                        "email": email,
                         "type": type_,
                     }
                 )
-                + "\n"
-            )
 
 
 def register(parser):
@@ -350,6 +441,18 @@ def register(parser):
     add_subparser = add_parser.add_subparsers()
 
     persistent_id_parser = add_subparser.add_parser("persistent_id")
+    persistent_id_parser.add_argument(
+        "--engine", choices=list(UNION_FIND_ENGINES), default="array"
+    )
+    # with more than one worker, user mapping is split into byte ranges which are
+    # processed in parallel by the array engine
+    persistent_id_parser.add_argument("--workers", type=int, default=1)
+    # union find state is saved into snapshot directory; with delta user mapping
+    # given, only its links are applied to the snapshot and groups they changed
+    # are written to changes file, next to persistent ids file by default
+    persistent_id_parser.add_argument("--snapshot", type=str, default=None)
+    persistent_id_parser.add_argument("--delta", type=str, default=None)
+    persistent_id_parser.add_argument("--changes", type=str, default=None)
     persistent_id_parser.set_defaults(subparser="add", command="persistent_id")
 
     identity_group_parser = add_subparser.add_parser("identity_group")
@@ -357,24 +460,126 @@ def register(parser):
     identity_group_parser.add_argument(
         "--weights", type=float, dest="weights", action="append"
     )
+    identity_group_parser.add_argument("--seed", type=int, default=None)
     identity_group_parser.set_defaults(subparser="add", command="identity_group")
 
     fact_parser = add_subparser.add_parser("fact")
+    fact_parser.add_argument("--seed", type=int, default=None)
+    # facts are built in on-disk shards, number of which is given directly
+    # or derived from memory budget (in MB, per worker)
+    fact_parser.add_argument("--workers", type=int, default=1)
+    fact_parser.add_argument("--shards", type=int, default=None)
+    fact_parser.add_argument("--memory-budget", type=int, default=None)
+    fact_parser.add_argument("--spill-dir", type=str, default=None)
+    # keyed: draws of each entity are keyed by its id, instead of shard streams;
+    # legacy: facts are built in memory, in one process, from a single
+    # `np.random.default_rng(seed)` generator
+    fact_parser.add_argument(
+        "--rng", choices=["stream", "keyed", "legacy"], default="stream"
+    )
+    # facts file of new users, only their facts are appended (keyed mode only)
+    fact_parser.add_argument("--append", type=str, default=None)
+    fact_parser.add_argument("--pool-size", type=int, default=DEFAULT_POOL_SIZE)
     fact_parser.set_defaults(subparser="add", command="facts")
 
     website_groups_parser = add_subparser.add_parser("website_groups")
+    # with memory budget (in MB) smaller than urls file, group in external memory
+    website_groups_parser.add_argument("--seed", type=int, default=None)
+    website_groups_parser.add_argument("--workers", type=int, default=1)
+    website_groups_parser.add_argument("--memory-budget", type=int, default=None)
+    website_groups_parser.add_argument("--spill-dir", type=str, default=None)
     website_groups_parser.set_defaults(subparser="add", command="website_groups")
 
 
+def build_facts(args, config):
+    """Generate IP and user identity facts files in shards."""
+    entropy = root_entropy(args.seed)
+    if args.rng == "keyed" and args.seed is None:
+        logger.warning("Keyed generation without --seed cannot be reproduced")
+    location_table = LocationTable.from_file(config["src"]["location_to_cidr"])
+    pool = AttributePool.generate(stream_rng(entropy), args.pool_size)
+
+    if args.append:
+        logger.info(
+            "Append IP and user identity facts of new users from %s", args.append
+        )
+        append_facts(
+            new_facts_file=args.append,
+            persistent_ids_facts_file=config["dst"]["persistent"],
+            identity_group_facts_file=config["dst"]["identity_group"],
+            ip_info_dst=config["dst"]["ip_info"],
+            user_identity_dst=config["dst"]["user_identity_info"],
+            location_table=location_table,
+            pool=pool,
+            entropy=entropy,
+            workers=args.workers,
+            spill_dir=args.spill_dir,
+        )
+        return
+
+    shards = args.shards
+    if shards is None and args.memory_budget:
+        shards = spill.shard_count(
+            [config["dst"]["identity_group"], config["dst"]["persistent"]],
+            args.memory_budget * spill.MB,
+        )
+    shards = shards or DEFAULT_SHARDS
+    logger.info(
+        "Generate IP facts file to %s and user identity facts file to %s "
+        "(%d shards, %d workers)",
+        config["dst"]["ip_info"],
+        config["dst"]["user_identity_info"],
+        shards,
+        args.workers,
+    )
+    build_facts_sharded(
+        persistent_ids_facts_file=config["dst"]["persistent"],
+        identity_group_facts_file=config["dst"]["identity_group"],
+        transient_ids_facts_file=config["src"]["facts"],
+        ip_info_dst=config["dst"]["ip_info"],
+        user_identity_dst=config["dst"]["user_identity_info"],
+        location_table=location_table,
+        pool=pool,
+        entropy=entropy,
+        shards=shards,
+        workers=args.workers,
+        spill_dir=args.spill_dir,
+        keyed=args.rng == "keyed",
+    )
+
+
 def main(args):
     """Generate dataset files with information about the world."""
     config = configparser.ConfigParser()
     config.read(args.config_file.name)
 
-    if args.command == "persistent_id":
+    if args.command == "persistent_id" and args.delta:
+        if not args.snapshot:
+            print("Delta user mapping requires --snapshot")
+            sys.exit(2)
+        changes_dst = args.changes or (
+            os.path.splitext(config["dst"]["persistent"])[0] + "_changes.json"
+        )
+        logger.info("Generate changed persistent id file to %s", changes_dst)
+        changed = apply_user_mapping_delta(args.snapshot, args.delta, changes_dst)
+        logger.info("%d persistent groups changed", changed)
+
+    elif args.command == "persistent_id":
+        if args.snapshot and args.engine != "array":
+            print("Snapshot is supported by array engine only")
+            sys.exit(2)
         logger.info("Generate persistent id file to %s", config["dst"]["persistent"])
-        uf_ds = extract_user_groups(config["src"]["user_to_user"])
+        if args.workers > 1:
+            uf_ds = extract_sharded_user_groups(
+                config["src"]["user_to_user"], workers=args.workers
+            )
+        else:
+            extract = UNION_FIND_ENGINES[args.engine]
+            uf_ds = extract(config["src"]["user_to_user"])
         generate_persistent_groups(uf_ds, config["dst"]["persistent"])
+        if args.snapshot:
+            logger.info("Save union find snapshot to %s", args.snapshot)
+            UnionFindSnapshot.from_union_find(uf_ds).save(args.snapshot)
 
     if args.command == "identity_group":
         logger.info(
@@ -387,27 +592,46 @@ def main(args):
             sys.exit(2)
 
         generate_identity_groups(
-            config["dst"]["persistent"], distribution, config["dst"]["identity_group"]
+            config["dst"]["persistent"],
+            distribution,
+            config["dst"]["identity_group"],
+            _seed=args.seed,
         )
 
     if args.command == "facts":
-        logger.info("Generate IP facts file to %s", config["dst"]["ip_info"])
-        build_iploc_knowledge(
-            ip_facts_file=config["src"]["location_to_cidr"],
-            persistent_ids_facts_file=config["dst"]["persistent"],
-            identity_group_facts_file=config["dst"]["identity_group"],
-            transient_ids_facts_file=config["src"]["facts"],
-            dst=config["dst"]["ip_info"],
-        )
-        logger.info(
-            "Generate user identity facts file to %s",
-            config["dst"]["user_identity_info"],
-        )
-        build_user_identitity_knowledge(
-            persistent_ids_facts_file=config["dst"]["persistent"],
-            transient_ids_facts_file=config["src"]["facts"],
-            dst=config["dst"]["user_identity_info"],
-        )
+        if args.append and args.rng != "keyed":
+            print("Appending facts requires --rng keyed")
+            sys.exit(2)
+        if args.rng != "legacy":
+            try:
+                build_facts(args, config)
+            except ValueError as exc:
+                print(exc)
+                sys.exit(2)
+        elif args.workers > 1 or args.shards or args.memory_budget:
+            print("Legacy generation of facts runs in one process, without shards")
+            sys.exit(2)
+        else:
+            logger.info("Generate IP facts file to %s", config["dst"]["ip_info"])
+            build_iploc_knowledge(
+                ip_facts_file=config["src"]["location_to_cidr"],
+                persistent_ids_facts_file=config["dst"]["persistent"],
+                identity_group_facts_file=config["dst"]["identity_group"],
+                transient_ids_facts_file=config["src"]["facts"],
+                dst=config["dst"]["ip_info"],
+                _seed=args.seed,
+            )
+            logger.info(
+                "Generate user identity facts file to %s",
+                config["dst"]["user_identity_info"],
+            )
+            build_user_identitity_knowledge(
+                persistent_ids_facts_file=config["dst"]["persistent"],
+                transient_ids_facts_file=config["src"]["facts"],
+                dst=config["dst"]["user_identity_info"],
+                pool_size=args.pool_size,
+                _seed=args.seed,
+            )
 
     if args.command == "website_groups":
         logger.info("Generate website groups file to %s.", config["dst"]["website_groups"])
@@ -415,6 +639,14 @@ def main(args):
         dst_file = config["dst"]["website_groups"]
         iab_categories = read_iab_categories(config["src"]["iab_categories"])
 
-        generate_website_groups(urls_file, iab_categories, dst_file)
+        generate_website_groups(
+            urls_file,
+            iab_categories,
+            dst_file,
+            _seed=args.seed,
+            workers=args.workers,
+            memory_budget=args.memory_budget and args.memory_budget * spill.MB,
+            spill_dir=args.spill_dir,
+        )
 
     logger.info("Done!")
@@ -1,88 +1,378 @@
 import argparse
+from contextlib import ExitStack
 import logging
 import configparser
 import os
 import json
+import sys
 import itertools
-import random
+import shutil
+import tempfile
 
-from nepytune.write_utils import json_lines_file
+import numpy as np
+
+from nepytune.compression import compression_of, open_file, wrap_writer
+from nepytune.external_sort import sorted_records, DEFAULT_MEMORY_BUDGET
+from nepytune.facts import concatenate, run_tasks, FACT_LOCATION
+from nepytune.lookup import ensure_index, JsonLinesIndex
+from nepytune.rng import entity_rng, root_entropy
+from nepytune.spill import MB
+from nepytune.write_utils import (
+    decode_json_line,
+    json_lines_file,
+    json_lines_writer,
+    line_aligned_ranges,
+    lines_in_range,
+    JsonLinesWriter,
+    READ_BATCH_SIZE,
+)
 
 
 logger = logging.getLogger("extend")
 logger.setLevel(logging.INFO)
 
+# below that many facts of a user, sessions are found faster without numpy
+VECTORIZED_SESSIONS_MIN_FACTS = 64
+unseeded_rng = np.random.default_rng()
+CHECKPOINT_INTERVAL = 256 * MB
+
+
+def extend_facts_file(
+    fact_file_path,
+    ip_loc_file_path,
+    user_identity_file_path,
+    resume=False,
+    checkpoint_interval=CHECKPOINT_INTERVAL,
+    _seed=None,
+):
+    """
+    Extend facts file with additional information.
+
+    Every `checkpoint_interval` bytes of facts, byte offsets of facts and output
+    files are checkpointed together with state of the generator drawing
+    locations. Resumed run continues from the last checkpoint and writes the
+    same output as an uninterrupted one would.
+    """
+    dst = extended_path(fact_file_path)
+    checkpoint_file = checkpoint_path(dst)
+    checkpoint = read_checkpoint(checkpoint_file, fact_file_path) if resume else None
+    rng = np.random.default_rng(_seed)
+    if checkpoint is not None:
+        logger.info("Resume from byte %d of facts", checkpoint["input_offset"])
+        rng.bit_generator.state = checkpoint["rng_state"]
 
-def extend_facts_file(fact_file_path, ip_loc_file_path, user_identity_file_path):
-    """Extend facts file with additional information."""
-    ip_loc_cor = extend_with_iploc_information(ip_loc_file_path)
+    ip_loc_cor = extend_with_iploc_information(ip_loc_file_path, rng)
     user_identity_cor = extend_with_user_identity_information(user_identity_file_path)
 
     next(ip_loc_cor)
     next(user_identity_cor)
 
-    dst = f"{fact_file_path}.tmp"
-    with open(fact_file_path) as f_h:
-        with open(dst, "w") as f_dst:
-            for data in json_lines_file(f_h):
-                transformed_row = user_identity_cor.send(ip_loc_cor.send(data))
-                f_dst.write(json.dumps(transformed_row) + "\n")
+    with open_file(fact_file_path, "rb") as f_h:
+        with open(dst, "wb" if checkpoint is None else "r+b") as raw_out:
+            if checkpoint is not None:
+                f_h.seek(checkpoint["input_offset"])
+                raw_out.truncate(checkpoint["output_offset"])
+                raw_out.seek(checkpoint["output_offset"])
+            checkpointed = f_h.tell()
+
+            # compressed output is flushed in whole blocks at checkpoints,
+            # so it can be truncated back to any of them
+            out = wrap_writer(raw_out, compression_of(fact_file_path))
+            with out, JsonLinesWriter(out) as writer:
+                for lines in iter(lambda: f_h.readlines(READ_BATCH_SIZE), []):
+                    for data in json_lines_file(lines):
+                        transformed_row = user_identity_cor.send(ip_loc_cor.send(data))
+                        writer.write(transformed_row)
+
+                    if f_h.tell() - checkpointed >= checkpoint_interval:
+                        writer.flush()
+                        out.flush()
+                        os.fsync(out.fileno())
+                        write_checkpoint(
+                            checkpoint_file,
+                            {
+                                "source": source_state(fact_file_path),
+                                "input_offset": f_h.tell(),
+                                "output_offset": out.tell(),
+                                "rng_state": rng.bit_generator.state,
+                            },
+                        )
+                        checkpointed = f_h.tell()
 
         ip_loc_cor.close()
 
+    if os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)
+    os.rename(dst, fact_file_path)
+
+
+def extended_path(fact_file_path):
+    """Get path of facts file being extended, before it replaces the original."""
+    return f"{fact_file_path}.tmp"
+
+
+def checkpoint_path(dst):
+    """Get path of checkpoint of output file."""
+    return f"{dst}.checkpoint"
+
+
+def source_state(path):
+    """Get size and modification time of file, to tell whether it changed."""
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def read_checkpoint(path, fact_file_path):
+    """Read checkpoint of extending facts file, if there is one."""
+    if not os.path.exists(path):
+        logger.info("No checkpoint found in %s, starting from scratch", path)
+        return None
+    with open(path) as f_h:
+        checkpoint = json.load(f_h)
+    if checkpoint["source"] != source_state(fact_file_path):
+        raise ValueError(f"Facts file {fact_file_path} changed since checkpoint {path}")
+    return checkpoint
+
+
+def write_checkpoint(path, checkpoint):
+    """Write down checkpoint atomically."""
+    # generator states hold 128-bit integers, which only stdlib json encodes
+    with open(f"{path}.tmp", "w") as f_h:
+        json.dump(checkpoint, f_h)
+        f_h.flush()
+        os.fsync(f_h.fileno())
+    os.replace(f"{path}.tmp", path)
+
+
+def extend_facts_file_parallel(
+    fact_file_path, ip_loc_file_path, user_identity_file_path, workers, _seed=None
+):
+    """
+    Extend facts file with additional information, in parallel.
+
+    Facts file is split into line-aligned byte ranges extended by separate
+    processes, which share lookups through their memory mapped sidecar indexes.
+    Locations are drawn from generator keyed by transient id, so output does
+    not depend on the split.
+    """
+    entropy = root_entropy(_seed)
+    dst = f"{fact_file_path}.tmp"
+    tmp_root = os.path.dirname(os.path.abspath(fact_file_path))
+
+    with tempfile.TemporaryDirectory(dir=tmp_root) as tmp_dir:
+        ip_loc_file_path, user_identity_file_path = (
+            indexed_lookup(path, os.path.join(tmp_dir, f"lookup-{idx}.json"), workers)
+            for idx, path in enumerate([ip_loc_file_path, user_identity_file_path])
+        )
+        ranges = line_aligned_ranges(fact_file_path, workers)
+        parts = [
+            os.path.join(tmp_dir, f"facts-{part:05d}.json")
+            for part in range(len(ranges))
+        ]
+        run_tasks(
+            workers,
+            extend_facts_range,
+            itertools.repeat(fact_file_path, len(ranges)),
+            *zip(*ranges),
+            itertools.repeat(ip_loc_file_path, len(ranges)),
+            itertools.repeat(user_identity_file_path, len(ranges)),
+            parts,
+            itertools.repeat(entropy, len(ranges)),
+        )
+        concatenate(parts, dst, compression=compression_of(fact_file_path))
+
+    os.rename(dst, fact_file_path)
+
+
+def indexed_lookup(path, tmp_path, workers):
+    """
+    Get path of lookup file with up to date sidecar index.
+
+    Compressed lookup cannot be indexed, so it is decompressed into `tmp_path`
+    and that copy is indexed instead.
+    """
+    if compression_of(path):
+        logger.info("Decompress %s to index it", path)
+        with open_file(path, "rb") as f_h, open(tmp_path, "wb") as f_dst:
+            shutil.copyfileobj(f_h, f_dst)
+        path = tmp_path
+    ensure_index(path, "transient_id", workers)
+    return path
+
+
+def extend_facts_range(
+    fact_file_path,
+    start,
+    end,
+    ip_loc_file_path,
+    user_identity_file_path,
+    dst,
+    entropy,
+):
+    """Extend facts within byte range of facts file, write them to dst."""
+    loc_data = JsonLinesIndex(ip_loc_file_path, "transient_id")
+    user_id_data = JsonLinesIndex(user_identity_file_path, "transient_id")
+    with open_file(fact_file_path, "rb") as f_h:
+        with json_lines_writer(dst) as writer:
+            for line in lines_in_range(f_h, start, end):
+                data = decode_json_line(line)
+                uid = data["uid"]
+                transformed_row = extend_with_user_identity(
+                    extend_with_locations(
+                        data,
+                        loc_data[uid]["loc"],
+                        entity_rng(entropy, FACT_LOCATION, uid),
+                    ),
+                    user_id_data[uid],
+                )
+                writer.write(transformed_row)
+
+
+def extend_facts_file_merge_join(
+    fact_file_path,
+    ip_loc_file_path,
+    user_identity_file_path,
+    memory_budget=DEFAULT_MEMORY_BUDGET,
+    spill_dir=None,
+):
+    """
+    Extend facts file with additional information, in a streaming merge-join.
+
+    Facts and both lookup files are read in user id order, sorted externally
+    if they are not already, so lookups are never loaded into memory.
+    Extended facts file is written in user id order.
+    """
+    dst = f"{fact_file_path}.tmp"
+    with ExitStack() as stack:
+        facts, ip_locs, user_identities = (
+            stack.enter_context(sorted_records(path, field, memory_budget, spill_dir))
+            for path, field in [
+                (fact_file_path, "uid"),
+                (ip_loc_file_path, "transient_id"),
+                (user_identity_file_path, "transient_id"),
+            ]
+        )
+        compression = compression_of(fact_file_path)
+        with json_lines_writer(dst, compression=compression) as writer:
+            joined = join_sorted(
+                join_sorted(facts, ip_locs, key=lambda data: data["uid"]),
+                user_identities,
+                key=lambda pair: pair[0]["uid"],
+            )
+            for (data, ip_loc), user_identity in joined:
+                transformed_row = extend_with_user_identity(
+                    extend_with_locations(data, ip_loc["loc"]), user_identity
+                )
+                writer.write(transformed_row)
+
     os.rename(dst, fact_file_path)
 
 
+def join_sorted(rows, lookup, key):
+    """
+    Yield (row, lookup record) pairs, matched by transient id.
+
+    Both streams have to be sorted by transient id.
+    """
+    current = next(lookup, None)
+    for row in rows:
+        transient_id = key(row)
+        while current is not None and current["transient_id"] < transient_id:
+            current = next(lookup, None)
+        if current is None or current["transient_id"] != transient_id:
+            raise KeyError(transient_id)
+        yield row, current
+
+
+def extend_with_user_identity(data, user_identity):
+    """Extend fact with user identity information."""
+    transformed = {**data.copy(), **user_identity}
+    del transformed["transient_id"]
+    return transformed
+
+
+def extend_with_locations(data, locations, rng=None):
+    """Extend fact with ip location information."""
+    transformed = data.copy()
+    transformed["facts"] = get_sane_ip_locaction(locations, data["facts"], rng=rng)
+    return transformed
+
+
+def timestamp_sessions(timestamps, max_ts_difference):
+    """
+    Get order of timestamps and session number of each of them in that order.
+
+    New session starts wherever gap to the previous timestamp is larger than
+    `max_ts_difference`: gaps of sorted timestamps are compared at once and
+    their cumulative sum numbers the sessions.
+    """
+    if len(timestamps) < VECTORIZED_SESSIONS_MIN_FACTS:
+        order = sorted(range(len(timestamps)), key=timestamps.__getitem__)
+        sessions, session, previous = [], 0, None
+        for idx in order:
+            if previous is not None and timestamps[idx] - previous > max_ts_difference:
+                session += 1
+            sessions.append(session)
+            previous = timestamps[idx]
+        return order, sessions
+
+    values = np.array(timestamps, dtype=np.float64)
+    order = np.argsort(values, kind="stable")
+    gaps = np.diff(values[order]) > max_ts_difference
+    sessions = np.concatenate([[0], np.cumsum(gaps)])
+    return order.tolist(), sessions.tolist()
+
+
+def get_sane_ip_locaction(locations, facts, max_ts_difference=3600, rng=None):
+    """
+    Given transient id locations and its facts add information about ip/location.
+
+    Process is semi-deterministic.
+        1. Choose the location at random from the given list of locations
+        2. Repeat returning this location as long as the timestamp difference
+           lies within the `max_ts_difference`
+        3. Otherwise, start from 1)
+
+    Locations of all sessions are drawn in a single call. Facts are returned
+    sorted by timestamp and are extended in place.
+    """
+    if not facts:
+        return []
+    order, sessions = timestamp_sessions(
+        [fact["ts"] for fact in facts], max_ts_difference
+    )
+    # scaling uniform draws is several times faster than `integers` for few draws
+    draws = (rng or unseeded_rng).random(sessions[-1] + 1).tolist()
+    drawn = [int(draw * len(locations)) for draw in draws]
+
+    sane = []
+    for idx, session in zip(order, sessions):
+        fact = facts[idx]
+        fact.update(locations[drawn[session]])
+        sane.append(fact)
+    return sane
+
+
 def extend_with_user_identity_information(user_identity_file_path):
     """Coroutine which generates user identity facts based on transient id."""
-    with open(user_identity_file_path) as f_h:
+    with open_file(user_identity_file_path, "rb") as f_h:
         user_id_data = {data["transient_id"]: data for data in json_lines_file(f_h)}
 
     data = yield
 
     while data is not None:
-        transformed = {**data.copy(), **user_id_data[data["uid"]]}
-        del transformed["transient_id"]
-        data = yield transformed
+        data = yield extend_with_user_identity(data, user_id_data[data["uid"]])
 
 
-def extend_with_iploc_information(ip_loc_file_path):
+def extend_with_iploc_information(ip_loc_file_path, rng=None):
     """Coroutine which generates ip location facts based on transient id."""
-    with open(ip_loc_file_path) as f_h:
+    with open_file(ip_loc_file_path, "rb") as f_h:
         loc_data = {data["transient_id"]: data["loc"] for data in json_lines_file(f_h)}
 
     data = yield
 
-    def get_sane_ip_locaction(uid, facts, max_ts_difference=3600):
-        """
-        Given transient id and its facts add information about ip/location.
-
-        Process is semi-deterministic.
-            1. Choose the location at random from the given list of locations
-            2. Repeat returning this location as long as the timestamp difference
-               lies within the `max_ts_difference`
-            3. Otherwise, start from 1)
-        """
-        facts = [None] + sorted(facts, key=lambda x: x["ts"])
-        ptr1, ptr2 = itertools.tee(facts, 2)
-        next(ptr2, None)
-
-        loc_fact = random.choice(loc_data[uid])
-
-        for previous_item, current in zip(ptr1, ptr2):
-            if (
-                previous_item is None
-                or current["ts"] - previous_item["ts"] > max_ts_difference
-            ):
-                loc_fact = random.choice(loc_data[uid])
-            yield {**current, **loc_fact}
-
     while data is not None:
-        transformed = data.copy()
-        transformed["facts"] = list(
-            get_sane_ip_locaction(uid=data["uid"], facts=data["facts"])
-        )
-        data = yield transformed
+        data = yield extend_with_locations(data, loc_data[data["uid"]], rng)
 
 
 def register(parser):
@@ -94,7 +384,20 @@ def register(parser):
     )
 
     extend_subparser = extend_parser.add_subparsers()
-    _ = extend_subparser.add_parser("facts")
+    facts_parser = extend_subparser.add_parser("facts")
+    # with merge join, facts and lookups are streamed in user id order, sorted
+    # externally within memory budget (in MB) when needed
+    facts_parser.add_argument("--merge-join", action="store_true", default=False)
+    facts_parser.add_argument("--memory-budget", type=int, default=None)
+    facts_parser.add_argument("--spill-dir", type=str, default=None)
+    # with more than one worker (or seed) given, facts are extended in parallel
+    # byte ranges, drawing locations at random keyed by transient id
+    facts_parser.add_argument("--workers", type=int, default=1)
+    facts_parser.add_argument("--seed", type=int, default=None)
+    # otherwise progress is checkpointed every interval (in MB) of facts, and
+    # resumed run continues from the last checkpoint
+    facts_parser.add_argument("--resume", action="store_true", default=False)
+    facts_parser.add_argument("--checkpoint-interval", type=int, default=None)
     extend_parser.set_defaults(command="facts")
 
 
@@ -104,11 +407,50 @@ def main(args):
     config.read(args.config_file.name)
 
     if args.command == "facts":
+        if args.resume:
+            if args.merge_join or args.workers > 1 or args.seed is not None:
+                print("Only sequential extend of facts without --seed can be resumed")
+                sys.exit(2)
+            fact_file_path = config["src"]["facts"]
+            try:
+                read_checkpoint(
+                    checkpoint_path(extended_path(fact_file_path)), fact_file_path
+                )
+            except ValueError as exc:
+                print(exc)
+                sys.exit(2)
         logger.info("Extend facts file to %s", config["src"]["facts"])
-        extend_facts_file(
-            fact_file_path=config["src"]["facts"],
-            ip_loc_file_path=config["dst"]["ip_info"],
-            user_identity_file_path=config["dst"]["user_identity_info"],
-        )
+        if args.merge_join:
+            memory_budget = (
+                args.memory_budget * MB if args.memory_budget else DEFAULT_MEMORY_BUDGET
+            )
+            extend_facts_file_merge_join(
+                fact_file_path=config["src"]["facts"],
+                ip_loc_file_path=config["dst"]["ip_info"],
+                user_identity_file_path=config["dst"]["user_identity_info"],
+                memory_budget=memory_budget,
+                spill_dir=args.spill_dir,
+            )
+        elif args.workers > 1 or args.seed is not None:
+            extend_facts_file_parallel(
+                fact_file_path=config["src"]["facts"],
+                ip_loc_file_path=config["dst"]["ip_info"],
+                user_identity_file_path=config["dst"]["user_identity_info"],
+                workers=args.workers,
+                _seed=args.seed,
+            )
+        else:
+            checkpoint_interval = (
+                args.checkpoint_interval * MB
+                if args.checkpoint_interval
+                else CHECKPOINT_INTERVAL
+            )
+            extend_facts_file(
+                fact_file_path=config["src"]["facts"],
+                ip_loc_file_path=config["dst"]["ip_info"],
+                user_identity_file_path=config["dst"]["user_identity_info"],
+                resume=args.resume,
+                checkpoint_interval=checkpoint_interval,
+            )
 
     logger.info("Done!")
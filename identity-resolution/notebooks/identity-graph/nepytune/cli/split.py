@@ -1,51 +1,153 @@
-import json
 import csv
 import argparse
+from contextlib import ExitStack
+import itertools
+import re
+import sys
+import tempfile
+
+from nepytune.compression import compression_of, open_file
+from nepytune.facts import concatenate, run_tasks
+from nepytune.spill import part_name, shard_part_paths, ShardWriter
+from nepytune.url_table import attached_url_table, ensure_url_table, open_url_table
+from nepytune.write_utils import (
+    decode_json_line,
+    line_aligned_ranges,
+    lines_in_range,
+    READ_BATCH_SIZE,
+)
+
+
+# fact ids are plain integers, so they can be picked out of raw lines
+# without parsing them
+FID_PATTERN = re.compile(rb'"fid": ?(-?\d+)')
+UID_PATTERN = re.compile(rb'"uid": ?"([^"\\]*)"')
+
+
+def batch_lines(opened_file, size):
+    """
+    Yield (batch number, lines) pieces of file opened in binary mode.
 
+    Each batch consists of exactly `size` lines (except for the last one),
+    possibly spread over several consecutive pieces.
+    """
+    batch, left = 0, size
+    for lines in iter(lambda: opened_file.readlines(READ_BATCH_SIZE), []):
+        start = 0
+        while start < len(lines):
+            if not left:
+                batch, left = batch + 1, size
+            piece = lines[start : start + left]
+            start += len(piece)
+            left -= len(piece)
+            yield batch, piece
+
+
+def split_facts(src, size, urls, location):
+    """
+    Copy raw lines of facts file into batches of `size` facts, with their urls.
 
-def batch_facts(src, size):
-    """Split facts into batches of provided size."""
-    with open(src) as f_h:
-        json_lines = []
-        i = 0
-
-        for line in f_h:
-            if i > size:
-                yield json_lines
-                i = 0
-                json_lines = []
-
-            json_lines.append(json.loads(line))
-            i = i + 1
-
-        yield json_lines
-
+    Lines are not parsed, only fact ids needed to look up urls are extracted.
+    Batches are compressed the same way as the facts file.
+    """
+    suffix = compression_of(src) or ""
+    with open_file(src, "rb") as f_h, ExitStack() as stack:
+        current = None
+        for batch, lines in batch_lines(f_h, size):
+            if batch != current:
+                stack.close()
+                file_prefix = f"{batch * size}_{(batch + 1) * size}"
+                facts_file = stack.enter_context(
+                    open_file(f"{location}/{file_prefix}_facts.json{suffix}", "wb")
+                )
+                urls_file = stack.enter_context(
+                    open_file(f"{location}/{file_prefix}_urls.csv{suffix}", "w")
+                )
+                current = batch
+
+            if not lines[-1].endswith(b"\n"):
+                lines[-1] += b"\n"
+            facts_file.writelines(lines)
+            write_urls(FID_PATTERN.findall(b"".join(lines)), urls, urls_file)
+
+
+def line_uid(line):
+    """Get uid of raw json line, parsing it only if uid is not a plain string."""
+    match = UID_PATTERN.search(line)
+    if match:
+        return match.group(1).decode("utf-8")
+    return decode_json_line(line)["uid"]
+
+
+def partition_facts(src, urls_src, shards, location, workers=1):
+    """
+    Partition facts into shards by stable hash of uid, with urls of each shard.
 
-def write_json_facts(json_lines, dst):
-    """Write down jsonline facts into dst."""
-    with open(dst, "w") as f_h:
-        for data in json_lines:
-            f_h.write(json.dumps(data) + "\n")
+    Facts file is routed in line-aligned byte ranges, in parallel, into shard
+    files of each range, which are then concatenated in order. Raw lines are
+    copied as they are, so shard keeps relative order of its facts. Shards are
+    compressed the same way as the facts file.
+    """
+    # url table is built once here, and mapped once by each shard worker
+    ensure_url_table(urls_src)
+    with tempfile.TemporaryDirectory(dir=location) as tmp_dir:
+        ranges = line_aligned_ranges(src, workers)
+        run_tasks(
+            workers,
+            partition_facts_range,
+            itertools.repeat(src, len(ranges)),
+            *zip(*ranges),
+            itertools.repeat(shards, len(ranges)),
+            itertools.repeat(tmp_dir, len(ranges)),
+            range(len(ranges)),
+        )
+        run_tasks(
+            workers,
+            write_shard,
+            itertools.repeat(tmp_dir, shards),
+            range(shards),
+            itertools.repeat(urls_src, shards),
+            itertools.repeat(location, shards),
+            itertools.repeat(compression_of(src) or "", shards),
+        )
+
+
+def partition_facts_range(src, start, end, shards, directory, part):
+    """Route raw lines of facts within byte range into shard files by uid."""
+    with open_file(src, "rb") as f_h:
+        with ShardWriter(directory, part_name("facts", part), shards) as writer:
+            for line in lines_in_range(f_h, start, end):
+                writer.write_line(
+                    line_uid(line), line if line.endswith(b"\n") else line + b"\n"
+                )
+
+
+def write_shard(directory, shard, urls_src, location, suffix=""):
+    """Write down facts of the shard, from all the parts, and urls they use."""
+    file_prefix = f"shard_{shard:05d}"
+    facts_dst = f"{location}/{file_prefix}_facts.json{suffix}"
+    concatenate(shard_part_paths(directory, "facts", shard), facts_dst)
+
+    urls = attached_url_table(urls_src)
+    urls_dst = f"{location}/{file_prefix}_urls.csv{suffix}"
+    with open_file(facts_dst, "rb") as f_h, open_file(urls_dst, "w") as urls_file:
+        for lines in iter(lambda: f_h.readlines(READ_BATCH_SIZE), []):
+            write_urls(FID_PATTERN.findall(b"".join(lines)), urls, urls_file)
 
 
 def load_urls(src):
     """
-    Load given url file csv into memory.
+    Load given url file csv as memory mapped fid to url table.
 
     It assumes that only two columns are present. One is key, other is value.
     """
-    with open(src) as f_h:
-        data = csv.reader(f_h, delimiter=",")
-        return dict((int(row[0]), row[1]) for row in data)
+    return open_url_table(src)
 
 
-def write_urls(json_facts, urls, dst):
-    """Write down urls batch based on batch of json facts."""
-    with open(dst, "w") as f_h:
-        writer = csv.writer(f_h, delimiter=",")
-        for data in json_facts:
-            for fact in data["facts"]:
-                writer.writerow([fact["fid"], urls[fact["fid"]]])
+def write_urls(fids, urls, opened_file):
+    """Write down urls of facts given by their (utf-8 encoded) ids."""
+    writer = csv.writer(opened_file, delimiter=",")
+    writer.writerows([int(fid), urls[int(fid)]] for fid in fids)
 
 
 def register(parser):
@@ -53,7 +155,14 @@ def register(parser):
     split_parser = parser.add_parser("split")
     split_parser.set_defaults(subparser="split")
 
-    split_parser.add_argument("--size", type=int, required=True)
+    # facts are split either into batches of consecutive lines of given size,
+    # or into shards by stable hash of uid, so that each uid is in one shard
+    split_parser.add_argument(
+        "--partition-by", choices=["lines", "uid"], default="lines"
+    )
+    split_parser.add_argument("--size", type=int, default=None)
+    split_parser.add_argument("--shards", type=int, default=None)
+    split_parser.add_argument("--workers", type=int, default=1)
     split_parser.add_argument(
         "--facts-file", type=argparse.FileType("r"), required=True
     )
@@ -63,12 +172,20 @@ def register(parser):
 
 def main(args):
     """'Split' command logic."""
-    location, size = args.dst_folder, args.size
-    urls = load_urls(args.urls_file.name)
-    i = 0
-    file_prefix = f"{i * size}_{(i + 1) * size}"
-    for json_lines in batch_facts(args.facts_file.name, size):
-        i = i + 1
-        write_json_facts(json_lines, dst=f"{location}/{file_prefix}_facts.json")
-        write_urls(json_lines, urls, dst=f"{location}/{file_prefix}_urls.csv")
-        file_prefix = f"{i * size}_{(i + 1)* size}"
+    if args.partition_by == "uid":
+        if not args.shards:
+            print("Number of shards is required to partition by uid")
+            sys.exit(2)
+        partition_facts(
+            args.facts_file.name,
+            args.urls_file.name,
+            args.shards,
+            location=args.dst_folder,
+            workers=args.workers,
+        )
+    else:
+        if not args.size:
+            print("Batch size is required to split by lines")
+            sys.exit(2)
+        urls = load_urls(args.urls_file.name)
+        split_facts(args.facts_file.name, args.size, urls, location=args.dst_folder)
@@ -2,10 +2,12 @@ import argparse
 import logging
 import configparser
 import glob
+import sys
 from pathlib import PurePath
-import concurrent.futures
 from string import Template
 
+from nepytune.scheduler import run_dag, task, validate
+from nepytune.url_table import ensure_url_table, table_path
 from nepytune.nodes import websites, users, identity_groups, ip_loc
 from nepytune.edges import (
     user_website,
@@ -20,11 +22,22 @@ logger = logging.getLogger("transform")
 logger.setLevel(logging.INFO)
 
 
+# destinations written once per batch of facts, by the flag generating them
+BATCH_DESTINATIONS = {
+    "transientIds": ["transient_nodes", "transient_edges"],
+    "ips": ["ip_edges"],
+}
+
+
+def batch_id(src):
+    """Extract batch information from path of split facts or urls file."""
+    stem = PurePath(src).stem
+    return f"{'_'.join(stem.split('_')[:2])}_"
+
+
 def build_destination_path(src, dst):
     """Given src path, extract batch information and build new destination path."""
-    stem = PurePath(src).stem
-    batch_id = f"{'_'.join(stem.split('_')[:2])}_"
-    return Template(dst).substitute(batch_id=batch_id)
+    return Template(dst).substitute(batch_id=batch_id(src))
 
 
 def register(parser):
@@ -43,8 +56,13 @@ def register(parser):
         "--identityGroupIds", action="store_true", default=False
     )
     transform_parser.add_argument("--ips", action="store_true", default=False)
-    # workers param affect only processing transient entities;
-    # other types of entities are processed fast enough
+    # transient id nodes and edges, and IP edges, are generated per facts file
+    # of facts_glob, with urls file of urls_glob of the same batch; their
+    # destinations have to include ${batch_id}. IP nodes are deduplicated
+    # over all the facts, so they are always generated from src facts
+    transform_parser.add_argument("--batches", action="store_true", default=False)
+    # with more than one worker, all the node and edge files are generated
+    # concurrently
     transform_parser.add_argument("--workers", type=int, default=1)
 
 
@@ -53,120 +71,212 @@ def main(args):
     config = configparser.ConfigParser()
     config.read(args.config_file.name)
 
+    if args.batches:
+        for flag, names in BATCH_DESTINATIONS.items():
+            for name in names:
+                if getattr(args, flag) and not has_batch_id(config["dst"][name]):
+                    print(f"Destination {name} has to include ${{batch_id}}")
+                    sys.exit(2)
+    try:
+        tasks = transform_tasks(args, config)
+        validate(tasks)
+    except ValueError as exc:
+        print(exc)
+        sys.exit(2)
+    run_dag(tasks, workers=args.workers)
+    logger.info("Done!")
+
+
+def has_batch_id(dst):
+    """Check whether destination template depends on batch id."""
+    template = Template(dst)
+    return template.substitute(batch_id="a") != template.substitute(batch_id="b")
+
+
+def per_batch(args, config):
+    """Get (facts file, urls file, destination) of batches to process separately."""
+    if not args.batches:
+        return [
+            (
+                config["src"]["facts"],
+                config["src"]["urls"],
+                lambda dst: Template(dst).substitute(batch_id=""),
+            )
+        ]
+    facts_files = sorted(glob.glob(config["src"]["facts_glob"]))
+    if not facts_files:
+        raise ValueError(f"No facts files match {config['src']['facts_glob']}")
+    urls_files = {batch_id(path): path for path in glob.glob(config["src"]["urls_glob"])}
+    batches = []
+    for fact_file in facts_files:
+        if batch_id(fact_file) not in urls_files:
+            raise ValueError(f"No urls file of urls_glob matches batch of {fact_file}")
+        batches.append(
+            (
+                fact_file,
+                urls_files[batch_id(fact_file)],
+                lambda dst, src=fact_file: build_destination_path(src, dst),
+            )
+        )
+    return batches
+
+
+def transform_tasks(args, config):
+    """Build tasks generating node and edge files of the requested entities."""
     files = {
         "facts": config["src"]["facts"],
         "urls": config["src"]["urls"],
         "titles": config["src"]["titles"],
     }
+    tasks = []
 
     if args.websites:
-        logger.info("Generating website nodes to %s", config["dst"]["websites"])
-        websites.generate_website_nodes(
-            files["urls"], files["titles"], config["dst"]["websites"]
-        )
+        dst = config["dst"]["websites"]
+        titles_table = table_path(files["titles"])
+        tasks += [
+            task(
+                "titles table",
+                ensure_url_table,
+                files["titles"],
+                inputs=[files["titles"]],
+                outputs=[titles_table],
+            ),
+            task(
+                "website nodes",
+                websites.generate_website_nodes,
+                files["urls"],
+                files["titles"],
+                dst,
+                inputs=[files["urls"], titles_table],
+                outputs=[dst],
+            ),
+        ]
 
     if args.website_groups:
         groups_json = config["src"]["website_groups"]
-
         nodes_dst = config["dst"]["website_group_nodes"]
-        logger.info("Generating website group nodes to %s", nodes_dst)
-        websites.generate_website_group_nodes(groups_json, nodes_dst)
-
         edges_dst = config["dst"]["website_group_edges"]
-        logger.info("Generating website group edges to %s", edges_dst)
-        website_groups.generate_website_group_edges(groups_json, edges_dst)
+        tasks += [
+            task(
+                "website group nodes",
+                websites.generate_website_group_nodes,
+                groups_json,
+                nodes_dst,
+                inputs=[groups_json],
+                outputs=[nodes_dst],
+            ),
+            task(
+                "website group edges",
+                website_groups.generate_website_group_edges,
+                groups_json,
+                edges_dst,
+                inputs=[groups_json],
+                outputs=[edges_dst],
+            ),
+        ]
 
     if args.transientIds:
-        if args.workers > 1:
-            fact_files = sorted(glob.glob(config["src"]["facts_glob"]))
-            url_files = sorted(glob.glob(config["src"]["urls_glob"]))
-
-            with concurrent.futures.ProcessPoolExecutor(
-                max_workers=args.workers
-            ) as executor:
-                futures = []
-                logger.info("Scheduling...")
-                for fact_file, url_file in zip(fact_files, url_files):
-                    futures.append(
-                        executor.submit(
-                            users.generate_user_nodes,
-                            fact_file,
-                            build_destination_path(
-                                fact_file, config["dst"]["transient_nodes"]
-                            ),
-                        )
-                    )
-                    futures.append(
-                        executor.submit(
-                            user_website.generate_user_website_edges,
-                            {
-                                "titles": files["titles"],
-                                "urls": url_file,
-                                "facts": fact_file,
-                            },
-                            build_destination_path(
-                                fact_file, config["dst"]["transient_edges"]
-                            ),
-                        )
-                    )
-                logger.info("Processing of transient nodes started.")
-
-                for future in concurrent.futures.as_completed(futures):
-                    logger.info(
-                        "Succesfully written transient entity file into %s",
-                        future.result(),
-                    )
-        else:
-            nodes_dst = Template(config["dst"]["transient_nodes"]).substitute(
-                batch_id=""
-            )
-            logger.info("Generating transient id nodes to %s", nodes_dst)
-            users.generate_user_nodes(config["src"]["facts"], nodes_dst)
-
-            edges_dst = Template(config["dst"]["transient_edges"]).substitute(
-                batch_id=""
-            )
-            logger.info("Generating transient id edges to %s", edges_dst)
-            user_website.generate_user_website_edges(files, edges_dst)
+        for fact_file, urls_file, destination in per_batch(args, config):
+            nodes_dst = destination(config["dst"]["transient_nodes"])
+            edges_dst = destination(config["dst"]["transient_edges"])
+            # url table is built once per urls file, before the edges which
+            # share it through memory mapping
+            url_table = table_path(urls_file)
+            tasks += [
+                task(
+                    f"url table {url_table}",
+                    ensure_url_table,
+                    urls_file,
+                    inputs=[urls_file],
+                    outputs=[url_table],
+                ),
+                task(
+                    f"transient id nodes {nodes_dst}",
+                    users.generate_user_nodes,
+                    fact_file,
+                    nodes_dst,
+                    inputs=[fact_file],
+                    outputs=[nodes_dst],
+                ),
+                task(
+                    f"transient id edges {edges_dst}",
+                    user_website.generate_user_website_edges,
+                    {**files, "facts": fact_file, "urls": urls_file},
+                    edges_dst,
+                    inputs=[fact_file, url_table],
+                    outputs=[edges_dst],
+                ),
+            ]
 
     if args.persistentIds:
-        logger.info(
-            "Generating persistent id nodes to %s", config["dst"]["persistent_nodes"]
-        )
-        users.generate_persistent_nodes(
-            config["src"]["persistent"], config["dst"]["persistent_nodes"]
-        )
-        logger.info(
-            "Generating persistent id edges to %s", config["dst"]["persistent_edges"]
-        )
-        persistent_ids.generate_persistent_id_edges(
-            config["src"]["persistent"], config["dst"]["persistent_edges"]
-        )
+        persistent = config["src"]["persistent"]
+        nodes_dst = config["dst"]["persistent_nodes"]
+        edges_dst = config["dst"]["persistent_edges"]
+        tasks += [
+            task(
+                "persistent id nodes",
+                users.generate_persistent_nodes,
+                persistent,
+                nodes_dst,
+                inputs=[persistent],
+                outputs=[nodes_dst],
+            ),
+            task(
+                "persistent id edges",
+                persistent_ids.generate_persistent_id_edges,
+                persistent,
+                edges_dst,
+                inputs=[persistent],
+                outputs=[edges_dst],
+            ),
+        ]
 
     if args.identityGroupIds:
-        logger.info(
-            "Generating identity group id nodes to %s",
-            config["dst"]["identity_group_nodes"],
-        )
-        identity_groups.generate_identity_group_nodes(
-            config["src"]["identity_group"], config["dst"]["identity_group_nodes"]
-        )
-        logger.info(
-            "Generating identity group id edges to %s",
-            config["dst"]["identity_group_edges"],
-        )
-        identity_group_edges.generate_identity_group_edges(
-            config["src"]["identity_group"], config["dst"]["identity_group_edges"]
-        )
+        identity_group = config["src"]["identity_group"]
+        nodes_dst = config["dst"]["identity_group_nodes"]
+        edges_dst = config["dst"]["identity_group_edges"]
+        tasks += [
+            task(
+                "identity group id nodes",
+                identity_groups.generate_identity_group_nodes,
+                identity_group,
+                nodes_dst,
+                inputs=[identity_group],
+                outputs=[nodes_dst],
+            ),
+            task(
+                "identity group id edges",
+                identity_group_edges.generate_identity_group_edges,
+                identity_group,
+                edges_dst,
+                inputs=[identity_group],
+                outputs=[edges_dst],
+            ),
+        ]
 
     if args.ips:
-        logger.info("Generating IP id nodes to %s", config["dst"]["ip_nodes"])
-        ip_loc.generate_ip_loc_nodes_from_facts(
-            config["src"]["facts"], config["dst"]["ip_nodes"]
-        )
-        logger.info("Generating IP edges to %s", config["dst"]["ip_edges"])
-        ip_loc_edges.generate_ip_loc_edges_from_facts(
-            config["src"]["facts"], config["dst"]["ip_edges"]
+        nodes_dst = Template(config["dst"]["ip_nodes"]).substitute(batch_id="")
+        tasks.append(
+            task(
+                "IP nodes",
+                ip_loc.generate_ip_loc_nodes_from_facts,
+                files["facts"],
+                nodes_dst,
+                inputs=[files["facts"]],
+                outputs=[nodes_dst],
+            )
         )
+        for fact_file, _, destination in per_batch(args, config):
+            edges_dst = destination(config["dst"]["ip_edges"])
+            tasks.append(
+                task(
+                    f"IP edges {edges_dst}",
+                    ip_loc_edges.generate_ip_loc_edges_from_facts,
+                    fact_file,
+                    edges_dst,
+                    inputs=[fact_file],
+                    outputs=[edges_dst],
+                )
+            )
 
-    logger.info("Done!")
+    return tasks
@@ -1,9 +1,9 @@
-import csv
-import json
+import itertools
 import logging
 
-from datetime import datetime
-
+from nepytune.compression import open_file
+from nepytune.timestamps import TimestampFormatter
+from nepytune.url_table import attached_url_table
 from nepytune.write_utils import gremlin_writer, json_lines_file, GremlinEdgeCSV
 from nepytune.utils import get_id
 
@@ -11,25 +11,25 @@ from nepytune.utils import get_id
 logger = logging.getLogger("user_edges")
 logger.setLevel(logging.INFO)
 
+# users whose facts timestamps are formatted at once
+TS_BATCH_USERS = 4096
+
 
-def _parse_ts(timestamp):
-    """Parse timestamp."""
-    for div in (1_000, 1_000_000):
-        try:
-            return datetime.fromtimestamp(timestamp / div).strftime("%Y-%m-%dT%H:%M:%S")
-        except:
-            logger.info("Could not parse timestamp: %d with %d", timestamp, div)
-    return ""
+def batches(iterable, size):
+    """Yield lists of at most `size` consecutive items."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
 
 
 def generate_user_website_edges(src_map, dst):
     """Generate edges between user nodes and website nodes."""
-    with open(src_map["urls"]) as url_file:
-        fact_to_website = {}
-        for row in csv.reader(url_file, delimiter=","):
-            fact_to_website[int(row[0])] = row[1]
+    fact_to_website = attached_url_table(src_map["urls"])
 
-    with open(src_map["facts"]) as facts_file:
+    with open_file(src_map["facts"], "rb") as facts_file:
         attrs = [
             "ts:Date",
             "visited_url:String",
@@ -39,32 +39,33 @@ def generate_user_website_edges(src_map, dst):
             "ip_address:String",
         ]
         with gremlin_writer(GremlinEdgeCSV, dst, attributes=attrs) as writer:
-            for data in json_lines_file(facts_file):
-                for fact in data["facts"]:
-                    timestamp = _parse_ts(fact["ts"])
-                    website_id = fact_to_website[fact["fid"]]
-                    loc_attrs = {
-                        "state": fact["state"],
-                        "city": fact["city"],
-                        "ip_address": fact["ip_address"],
-                    }
-                    attr_map = {
-                        "ts": timestamp,
-                        "visited_url": website_id,
-                        "uid": data["uid"],
-                        **loc_attrs,
-                    }
-                    user_to_website = {
-                        "_id": get_id(data["uid"], website_id, attr_map),
-                        "_from": data["uid"],
-                        "to": website_id,
-                        "label": "visited",
-                        "attribute_map": attr_map,
-                    }
-                    try:
-                        writer.add(**user_to_website)
-                    except Exception:
-                        logger.exception("Something went wrong while creating an edge")
-                        logger.info(json.dumps({"uid": data["uid"], **fact}))
+            formatter = TimestampFormatter()
+            for users in batches(json_lines_file(facts_file), TS_BATCH_USERS):
+                timestamps = iter(
+                    formatter.format(
+                        [fact["ts"] for data in users for fact in data["facts"]]
+                    )
+                )
+                for data in users:
+                    for fact in data["facts"]:
+                        timestamp = next(timestamps)
+                        website_id = fact_to_website[fact["fid"]]
+                        # in order of attributes, which is also hashed into id
+                        attr_map = {
+                            "ts": timestamp,
+                            "visited_url": website_id,
+                            "uid": data["uid"],
+                            "state": fact["state"],
+                            "city": fact["city"],
+                            "ip_address": fact["ip_address"],
+                        }
+                        writer.add_row(
+                            get_id(data["uid"], website_id, attr_map),
+                            data["uid"],
+                            website_id,
+                            "visited",
+                            attr_map.values(),
+                        )
+            formatter.log_summary()
 
     return dst
@@ -0,0 +1,116 @@
+"""Stream json lines records sorted by a field, sorting files larger than memory."""
+
+from contextlib import contextmanager, ExitStack
+import heapq
+import operator
+import os
+import tempfile
+
+from nepytune.compression import open_file
+from nepytune.spill import MB, MEMORY_EXPANSION
+from nepytune.write_utils import decode_json_line, json_lines_file
+
+
+DEFAULT_MEMORY_BUDGET = 512 * MB
+MERGE_FAN_IN = 256
+
+
+def is_sorted(path, field):
+    """Check whether json lines records of a file are sorted by field."""
+    with open_file(path, "rb") as f_h:
+        previous = None
+        for data in json_lines_file(f_h):
+            if previous is not None and data[field] < previous:
+                return False
+            previous = data[field]
+    return True
+
+
+def keyed_records(opened_file, field):
+    """Yield (field value, record) pairs of json lines file."""
+    for data in json_lines_file(opened_file):
+        yield data[field], data
+
+
+def keyed_lines(opened_file, field):
+    """Yield (field value, raw line) pairs of json lines file."""
+    for line in opened_file:
+        yield decode_json_line(line)[field], line
+
+
+def write_sorted_runs(path, field, run_dir, run_size):
+    """Split file into runs of about `run_size` bytes sorted by field."""
+    runs = []
+    with open_file(path, "rb") as f_h:
+        while True:
+            lines = f_h.readlines(run_size)
+            if not lines:
+                return runs
+            keys = [data[field] for data in json_lines_file(lines)]
+            order = sorted(range(len(lines)), key=keys.__getitem__)
+            runs.append(write_run(run_dir, len(runs), (lines[idx] for idx in order)))
+
+
+def write_run(run_dir, number, lines):
+    """Write lines into run file, return its path."""
+    path = os.path.join(run_dir, f"run-{number:06d}.json")
+    with open(path, "wb") as f_h:
+        for line in lines:
+            f_h.write(line if line.endswith(b"\n") else line + b"\n")
+    return path
+
+
+def merged_records(opened_files, field):
+    """Merge records of files sorted by field, stable with respect to file order."""
+    streams = [keyed_records(f_h, field) for f_h in opened_files]
+    for _, data in heapq.merge(*streams, key=operator.itemgetter(0)):
+        yield data
+
+
+def merged_lines(opened_files, field):
+    """Merge lines of files sorted by field, stable with respect to file order."""
+    streams = [keyed_lines(f_h, field) for f_h in opened_files]
+    for _, line in heapq.merge(*streams, key=operator.itemgetter(0)):
+        yield line
+
+
+def merge_runs(runs, field, run_dir, fan_in=MERGE_FAN_IN):
+    """Merge runs in passes until there are at most `fan_in` of them."""
+    number = len(runs)
+    while len(runs) > fan_in:
+        merged = []
+        for start in range(0, len(runs), fan_in):
+            with ExitStack() as stack:
+                opened = [
+                    stack.enter_context(open(path, "rb"))
+                    for path in runs[start : start + fan_in]
+                ]
+                merged.append(write_run(run_dir, number, merged_lines(opened, field)))
+                number += 1
+            for path in runs[start : start + fan_in]:
+                os.remove(path)
+        runs = merged
+    return runs
+
+
+@contextmanager
+def sorted_records(path, field, memory_budget=DEFAULT_MEMORY_BUDGET, tmp_dir=None):
+    """
+    Iterate over json lines records of a file in order of the field.
+
+    File already in order is streamed as is. Otherwise it is sorted externally:
+    runs which fit in the memory budget are sorted and spilled to disk, then
+    merged back lazily, so only one record per run is held in memory.
+    """
+    if is_sorted(path, field):
+        with open_file(path, "rb") as f_h:
+            yield json_lines_file(f_h)
+        return
+
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as run_dir:
+        run_size = max(1, memory_budget // MEMORY_EXPANSION)
+        runs = write_sorted_runs(path, field, run_dir, run_size)
+        runs = merge_runs(runs, field, run_dir)
+        with ExitStack() as stack:
+            opened = [stack.enter_context(open(run, "rb")) for run in runs]
+            yield merged_records(opened, field)
@@ -0,0 +1,342 @@
+"""
+Sharded generation of ip location and user identity facts.
+
+Knowledge about the world is partitioned into on-disk shards by hash of identity
+group, persistent or transient id, and every shard is processed as a separate task.
+Each task draws from its own random stream spawned from one root seed, hence
+the output depends only on the seed and number of shards, not on the number
+of worker processes running the tasks.
+
+In keyed mode, draws of every entity come from counter-based generator keyed
+by its id (igid, pid or uid) instead, so they do not depend on sharding nor
+on the order of records, and facts of new transient ids can be appended to
+already generated files (see `nepytune.keyed_facts`).
+"""
+
+import collections
+import concurrent.futures
+import itertools
+import logging
+import shutil
+import tempfile
+
+from nepytune import spill
+from nepytune.compression import open_file
+from nepytune.locations import random_ip_loc_from_group, unique
+from nepytune.nodes.ip_loc import IPLoc
+from nepytune.rng import entity_rng, stream_rng
+from nepytune.write_utils import (
+    decode_json_line,
+    encode_json_line,
+    json_lines_writer,
+    line_aligned_ranges,
+    lines_in_range,
+)
+
+
+logger = logging.getLogger("add")
+
+DEFAULT_SHARDS = 64
+
+# random stream phases, first element of the stream path
+IP_IDENTITY_GROUP, IP_PERSISTENT, IP_TRANSIENT = 0, 1, 2
+IDENTITY_PERSISTENT, IDENTITY_TRANSIENT = 3, 4
+FACT_LOCATION = 5
+
+ShardContext = collections.namedtuple(
+    "ShardContext",
+    ["tmp_dir", "shards", "entropy", "location_table", "pool", "keyed"],
+)
+
+
+def run_tasks(workers, func, *iterables):
+    """Run tasks in process pool (or in this process, if there is one worker)."""
+    if workers > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(func, *iterables))
+    return list(map(func, *iterables))
+
+
+def entity_or_stream_rng(ctx, rng, phase, key):
+    """Get generator for the entity in keyed mode, otherwise the shard stream."""
+    if ctx.keyed:
+        return entity_rng(ctx.entropy, phase, key)
+    return rng
+
+
+def random_ip_loc(ctx, rng):
+    """Get few random unique ip locations."""
+    return unique(ctx.location_table.random_ip_loc(rng))
+
+
+def ip_loc_line(transient_id, locations):
+    """Encode ip location facts of transient id."""
+    locations = [loc._asdict() for loc in locations]
+    return encode_json_line({"transient_id": transient_id, "loc": locations})
+
+
+def ungrouped_persistent_locations(ctx, rng):
+    """Draw locations of persistent id which does not belong to any identity group."""
+    return random_ip_loc_from_group(rng, random_ip_loc(ctx, rng))
+
+
+def unlinked_transient_locations(ctx, rng):
+    """Draw locations of transient id without persistent id, level by level."""
+    return random_ip_loc_from_group(rng, ungrouped_persistent_locations(ctx, rng))
+
+
+def transient_emails(pool, rng, transient_ids):
+    """Draw emails of persistent id, return one of them per its transient id."""
+    nemail = int(rng.integers(1, len(transient_ids) + 1))
+    emails = pool.emails(rng, nemail)
+    choices = rng.integers(nemail, size=len(transient_ids)).tolist()
+    return [emails[choice] for choice in choices]
+
+
+def keyed_user_identity(ctx, pool, transient_id, email=None):
+    """Draw user identity of transient id, and its email unless it has one."""
+    rng = entity_rng(ctx.entropy, IDENTITY_TRANSIENT, transient_id)
+    if email is None:
+        email, = pool.emails(rng, 1)
+    identity, = pool.user_identities(rng, 1)
+    return email, identity
+
+
+def user_identity_record(transient_id, email, identity):
+    """Get user identity facts record of transient id."""
+    type_, user_agent_str, device, operating_system, browser = identity
+    return {
+        "transient_id": transient_id,
+        "user_agent": user_agent_str,
+        "device": device,
+        "os": operating_system,
+        "browser": browser,
+        "email": email,
+        "type": type_,
+    }
+
+
+def partition_file(ctx, src, name, field, keep_line, part, start, end):
+    """Spill records from byte range of json lines file into shards by `field`."""
+    name = spill.part_name(name, part)
+    with open_file(src, "rb") as f_h:
+        with spill.ShardWriter(ctx.tmp_dir, name, ctx.shards) as writer:
+            for line in lines_in_range(f_h, start, end):
+                key = decode_json_line(line)[field]
+                if keep_line:
+                    writer.write_line(key, line)
+                else:
+                    writer.write(key, key)
+
+
+def spill_identity_group_locations(ctx, shard):
+    """Spill locations of persistent ids, derived from their identity groups."""
+    rng = stream_rng(ctx.entropy, IP_IDENTITY_GROUP, shard)
+    name = spill.part_name("persistent_loc", shard)
+    with spill.ShardWriter(ctx.tmp_dir, name, ctx.shards) as writer:
+        for data in spill.read_shard_parts(ctx.tmp_dir, "identity_group", shard):
+            group_rng = entity_or_stream_rng(ctx, rng, IP_IDENTITY_GROUP, data["igid"])
+            locations = random_ip_loc(ctx, group_rng)
+            for persistent_id in data["persistentIds"]:
+                persistent_rng = entity_or_stream_rng(
+                    ctx, rng, IP_PERSISTENT, persistent_id
+                )
+                persistent_locations = random_ip_loc_from_group(
+                    persistent_rng, locations
+                )
+                writer.write(persistent_id, [persistent_id, persistent_locations])
+
+
+def spill_transient_locations(ctx, shard):
+    """Spill locations of transient ids, derived from their persistent ids."""
+    rng = stream_rng(ctx.entropy, IP_PERSISTENT, shard)
+    persistent_locations = {
+        persistent_id: [IPLoc(*loc) for loc in locations]
+        for persistent_id, locations in spill.read_shard_parts(
+            ctx.tmp_dir, "persistent_loc", shard
+        )
+    }
+    name = spill.part_name("transient_loc", shard)
+    with spill.ShardWriter(ctx.tmp_dir, name, ctx.shards) as writer:
+        for data in spill.read_shard_parts(ctx.tmp_dir, "persistent", shard):
+            locations = persistent_locations.get(data["pid"])
+            # persistent id does not belong to any identity group
+            if locations is None:
+                persistent_rng = entity_or_stream_rng(
+                    ctx, rng, IP_PERSISTENT, data["pid"]
+                )
+                locations = ungrouped_persistent_locations(ctx, persistent_rng)
+            for transient_id in data["transientIds"]:
+                transient_rng = entity_or_stream_rng(
+                    ctx, rng, IP_TRANSIENT, transient_id
+                )
+                transient_locations = random_ip_loc_from_group(transient_rng, locations)
+                writer.write_line(
+                    transient_id, ip_loc_line(transient_id, transient_locations)
+                )
+
+
+def write_ip_facts(ctx, shard):
+    """Write ip location facts of transient ids in shard."""
+    rng = stream_rng(ctx.entropy, IP_TRANSIENT, shard)
+    dst = spill.shard_path(ctx.tmp_dir, "ip_info", shard)
+    known = set()
+    with open(dst, "wb") as f_dst:
+        for path in spill.shard_part_paths(ctx.tmp_dir, "transient_loc", shard):
+            with open(path, "rb") as f_h:
+                for line in f_h:
+                    transient_id = decode_json_line(line)["transient_id"]
+                    known.add(transient_id)
+                    f_dst.write(line)
+        # now assign random ip location for transient ids without persistent ids
+        for transient_id in spill.read_shard_parts(ctx.tmp_dir, "transient", shard):
+            if transient_id not in known:
+                known.add(transient_id)
+                transient_rng = entity_or_stream_rng(
+                    ctx, rng, IP_TRANSIENT, transient_id
+                )
+                locations = unlinked_transient_locations(ctx, transient_rng)
+                f_dst.write(ip_loc_line(transient_id, locations))
+    return dst
+
+
+def pool_for_stream(ctx, stream):
+    """Get attribute pool drawing emails unique to the stream (or entity)."""
+    if ctx.keyed:
+        return ctx.pool.for_stream(None, None)
+    return ctx.pool.for_stream(stream, 2 * ctx.shards)
+
+
+def spill_transient_emails(ctx, shard):
+    """Spill emails of transient ids, drawn from emails of their persistent ids."""
+    rng = stream_rng(ctx.entropy, IDENTITY_PERSISTENT, shard)
+    pool = pool_for_stream(ctx, shard)
+    name = spill.part_name("email", shard)
+    with spill.ShardWriter(ctx.tmp_dir, name, ctx.shards) as writer:
+        for data in spill.read_shard_parts(ctx.tmp_dir, "persistent", shard):
+            persistent_rng = entity_or_stream_rng(
+                ctx, rng, IDENTITY_PERSISTENT, data["pid"]
+            )
+            transient_ids = data["transientIds"]
+            emails = transient_emails(pool, persistent_rng, transient_ids)
+            for transient_id, email in zip(transient_ids, emails):
+                writer.write(transient_id, [transient_id, email])
+
+
+def write_user_identity_facts(ctx, shard):
+    """Write user identity facts of transient ids in shard."""
+    rng = stream_rng(ctx.entropy, IDENTITY_TRANSIENT, shard)
+    pool = pool_for_stream(ctx, ctx.shards + shard)
+    user_emails = dict(spill.read_shard_parts(ctx.tmp_dir, "email", shard))
+    # create fake emails for devices without persistent ids
+    missing = list(
+        dict.fromkeys(
+            transient_id
+            for transient_id in spill.read_shard_parts(
+                ctx.tmp_dir, "transient", shard
+            )
+            if transient_id not in user_emails
+        )
+    )
+
+    def user_identities():
+        if not ctx.keyed:
+            emails = pool.emails(rng, len(missing))
+            identities = pool.user_identities(rng, len(user_emails) + len(missing))
+            yield from zip(
+                itertools.chain(user_emails.items(), zip(missing, emails)), identities
+            )
+            return
+        for transient_id, email in itertools.chain(
+            user_emails.items(), zip(missing, itertools.repeat(None))
+        ):
+            email, identity = keyed_user_identity(ctx, pool, transient_id, email)
+            yield (transient_id, email), identity
+
+    dst = spill.shard_path(ctx.tmp_dir, "user_identity_info", shard)
+    with json_lines_writer(dst) as writer:
+        for (transient_id, email), identity in user_identities():
+            writer.write(user_identity_record(transient_id, email, identity))
+    return dst
+
+
+def concatenate(paths, dst, mode="wb", compression=None):
+    """Concatenate files into dst, compressing it if its name says so."""
+    with open_file(dst, mode, compression=compression) as f_dst:
+        for path in paths:
+            with open(path, "rb") as f_h:
+                shutil.copyfileobj(f_h, f_dst)
+
+
+def build_facts_sharded(
+    persistent_ids_facts_file,
+    identity_group_facts_file,
+    transient_ids_facts_file,
+    ip_info_dst,
+    user_identity_dst,
+    location_table,
+    pool,
+    entropy,
+    shards=DEFAULT_SHARDS,
+    workers=1,
+    spill_dir=None,
+    keyed=False,
+):
+    """
+    Generate ip location and user identity facts in shards.
+
+    Steps (each one run as tasks in a process pool):
+        1. identity groups, persistent id facts and transient ids from facts file
+           are read in parts, and spilled into identity group, persistent id and
+           transient id shards
+        2. per identity group shard, locations of their persistent ids are drawn
+           and spilled into persistent id shards
+        3. per persistent id shard, transient id locations and emails are derived
+           from persistent id ones, and spilled into transient id shards
+        4. per transient id shard, facts are written down, missing ones are generated
+        5. shard outputs are concatenated in shard order
+
+    Only one shard per worker is held in memory at a time.
+    """
+    with tempfile.TemporaryDirectory(dir=spill_dir) as tmp_dir:
+        ctx = ShardContext(tmp_dir, shards, entropy, location_table, pool, keyed)
+
+        # input is split by workers only, as it is routed into shards as it is,
+        # each part writing (at most) a file per shard
+        def run_in_parts(func, src, *args):
+            ranges = line_aligned_ranges(src, workers)
+            parts = [[part, start, end] for part, (start, end) in enumerate(ranges)]
+            run_tasks(
+                workers,
+                func,
+                itertools.repeat(ctx, len(parts)),
+                itertools.repeat(src, len(parts)),
+                *[itertools.repeat(arg, len(parts)) for arg in args],
+                *zip(*parts),
+            )
+
+        def run_in_shards(func):
+            return run_tasks(
+                workers, func, itertools.repeat(ctx, shards), range(shards)
+            )
+
+        logger.info("Spilling identity group / persistent ids facts")
+        run_in_parts(
+            partition_file, identity_group_facts_file, "identity_group", "igid", True
+        )
+        run_in_shards(spill_identity_group_locations)
+        run_in_parts(
+            partition_file, persistent_ids_facts_file, "persistent", "pid", True
+        )
+        run_in_parts(
+            partition_file, transient_ids_facts_file, "transient", "uid", False
+        )
+
+        logger.info("Spilling persistent / transient ids facts")
+        run_in_shards(spill_transient_locations)
+        run_in_shards(spill_transient_emails)
+
+        logger.info("Writing down IP facts to %s", ip_info_dst)
+        concatenate(run_in_shards(write_ip_facts), ip_info_dst)
+        logger.info("Writing down user identity facts to %s", user_identity_dst)
+        concatenate(run_in_shards(write_user_identity_facts), user_identity_dst)
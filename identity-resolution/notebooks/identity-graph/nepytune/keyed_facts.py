@@ -0,0 +1,200 @@
+"""
+Append facts of new transient ids to facts files generated in keyed mode.
+
+In keyed mode draws of every entity depend only on the root seed and its id, so
+facts of a transient id follow from the records of its persistent id and
+identity group alone. These are looked up in sidecar indexes, as are transient
+ids already present in the outputs, hence appending costs work proportional to
+the number of new transient ids, not to the size of the generated files.
+"""
+
+import collections
+import itertools
+import logging
+import os
+import tempfile
+
+from nepytune.compression import compression_of
+from nepytune.facts import (
+    concatenate,
+    IDENTITY_PERSISTENT,
+    IP_IDENTITY_GROUP,
+    IP_PERSISTENT,
+    IP_TRANSIENT,
+    ip_loc_line,
+    keyed_user_identity,
+    random_ip_loc,
+    run_tasks,
+    transient_emails,
+    ungrouped_persistent_locations,
+    unlinked_transient_locations,
+    user_identity_record,
+)
+from nepytune.locations import random_ip_loc_from_group
+from nepytune.lookup import ensure_index, extend_index, JsonLinesIndex
+from nepytune.rng import entity_rng
+from nepytune.write_utils import json_lines_file, json_lines_writer
+
+
+logger = logging.getLogger("add")
+
+AppendContext = collections.namedtuple(
+    "AppendContext",
+    [
+        "tmp_dir",
+        "entropy",
+        "location_table",
+        "pool",
+        "persistent_ids_facts_file",
+        "identity_group_facts_file",
+    ],
+)
+
+
+def persistent_records(ctx):
+    """Open persistent id records by their transient ids."""
+    return JsonLinesIndex(ctx.persistent_ids_facts_file, "transientIds")
+
+
+def persistent_locations(ctx, groups, persistent_id):
+    """Draw locations of persistent id, from its identity group if it has one."""
+    persistent_rng = entity_rng(ctx.entropy, IP_PERSISTENT, persistent_id)
+    try:
+        group = groups[persistent_id]
+    except KeyError:
+        return ungrouped_persistent_locations(ctx, persistent_rng)
+    group_rng = entity_rng(ctx.entropy, IP_IDENTITY_GROUP, group["igid"])
+    return random_ip_loc_from_group(persistent_rng, random_ip_loc(ctx, group_rng))
+
+
+def write_ip_facts(ctx, part, transient_ids):
+    """Write ip location facts of transient ids into part file."""
+    dst = os.path.join(ctx.tmp_dir, f"ip_info_{part}.json")
+    persistents = persistent_records(ctx)
+    groups = JsonLinesIndex(ctx.identity_group_facts_file, "persistentIds")
+    with open(dst, "wb") as f_dst:
+        for transient_id in transient_ids:
+            transient_rng = entity_rng(ctx.entropy, IP_TRANSIENT, transient_id)
+            if transient_id in persistents:
+                persistent_id = persistents[transient_id]["pid"]
+                locations = random_ip_loc_from_group(
+                    transient_rng, persistent_locations(ctx, groups, persistent_id)
+                )
+            else:
+                locations = unlinked_transient_locations(ctx, transient_rng)
+            f_dst.write(ip_loc_line(transient_id, locations))
+    return dst
+
+
+def write_user_identity_facts(ctx, part, transient_ids):
+    """Write user identity facts of transient ids into part file."""
+    dst = os.path.join(ctx.tmp_dir, f"user_identity_info_{part}.json")
+    pool = ctx.pool.for_stream(None, None)
+    persistents = persistent_records(ctx)
+    with json_lines_writer(dst) as writer:
+        for transient_id in transient_ids:
+            email = None
+            if transient_id in persistents:
+                data = persistents[transient_id]
+                rng = entity_rng(ctx.entropy, IDENTITY_PERSISTENT, data["pid"])
+                emails = transient_emails(pool, rng, data["transientIds"])
+                # like a dict, the last occurrence of transient id wins
+                email = dict(zip(data["transientIds"], emails))[transient_id]
+            email, identity = keyed_user_identity(ctx, pool, transient_id, email)
+            writer.write(user_identity_record(transient_id, email, identity))
+    return dst
+
+
+def read_transient_ids(src):
+    """Read unique transient ids of facts file, in order."""
+    with open(src, "rb") as f_h:
+        return list(dict.fromkeys(data["uid"] for data in json_lines_file(f_h)))
+
+
+def split(items, parts):
+    """Split list into at most `parts` contiguous, non-empty chunks."""
+    step = max(1, -(-len(items) // max(1, parts)))
+    return [items[start : start + step] for start in range(0, len(items), step)]
+
+
+def append_new_facts(ctx, func, transient_ids, dst, workers):
+    """
+    Append facts of transient ids which are not in dst yet, keep its index current.
+
+    Returns number of appended facts.
+    """
+    if os.path.exists(dst):
+        ensure_index(dst, "transient_id", workers)
+        known = JsonLinesIndex(dst, "transient_id")
+        transient_ids = [
+            transient_id for transient_id in transient_ids if transient_id not in known
+        ]
+    chunks = split(transient_ids, workers)
+    paths = run_tasks(
+        workers,
+        func,
+        itertools.repeat(ctx, len(chunks)),
+        range(len(chunks)),
+        chunks,
+    )
+    indexed_size = os.path.getsize(dst) if os.path.exists(dst) else None
+    concatenate(paths, dst, "ab")
+    if indexed_size is None:
+        ensure_index(dst, "transient_id", workers)
+    else:
+        extend_index(dst, "transient_id", indexed_size)
+    return len(transient_ids)
+
+
+def append_facts(
+    new_facts_file,
+    persistent_ids_facts_file,
+    identity_group_facts_file,
+    ip_info_dst,
+    user_identity_dst,
+    location_table,
+    pool,
+    entropy,
+    workers=1,
+    spill_dir=None,
+):
+    """
+    Append ip location and user identity facts of transient ids from new facts file.
+
+    Facts are the same as keyed generation from all facts at once would give,
+    for the same seed and attribute pool. Transient ids already present in the
+    destination files are skipped. Persistent ids and identity group files, as
+    well as the destinations, are indexed on first use, later appends only
+    update indexes of the destinations.
+    """
+    for path in (
+        persistent_ids_facts_file,
+        identity_group_facts_file,
+        ip_info_dst,
+        user_identity_dst,
+    ):
+        if compression_of(path):
+            raise ValueError(f"Facts cannot be appended using compressed file {path}")
+    ensure_index(persistent_ids_facts_file, "transientIds", workers)
+    ensure_index(identity_group_facts_file, "persistentIds", workers)
+    transient_ids = read_transient_ids(new_facts_file)
+
+    with tempfile.TemporaryDirectory(dir=spill_dir) as tmp_dir:
+        ctx = AppendContext(
+            tmp_dir,
+            entropy,
+            location_table,
+            pool,
+            persistent_ids_facts_file,
+            identity_group_facts_file,
+        )
+        logger.info("Appending IP facts to %s", ip_info_dst)
+        appended = append_new_facts(
+            ctx, write_ip_facts, transient_ids, ip_info_dst, workers
+        )
+        logger.info("Appended IP facts of %d transient ids", appended)
+        logger.info("Appending user identity facts to %s", user_identity_dst)
+        appended = append_new_facts(
+            ctx, write_user_identity_facts, transient_ids, user_identity_dst, workers
+        )
+        logger.info("Appended user identity facts of %d transient ids", appended)
@@ -0,0 +1,111 @@
+import functools
+import ipaddress
+
+import numpy as np
+
+from nepytune.compression import open_file
+from nepytune.nodes.ip_loc import IPLoc
+from nepytune.write_utils import json_lines_file
+
+
+# number of states per identity group, and number of cities per state
+STATE_COUNTS, STATE_COUNT_WEIGHTS = [1, 2], [0.98, 0.02]
+CITY_COUNTS, CITY_COUNT_WEIGHTS = [1, 2, 3, 4], [0.85, 0.1, 0.04, 0.01]
+
+
+def cumulative(weights):
+    """Get normalized cumulative weights array."""
+    cum_weights = np.cumsum(weights, dtype=float)
+    return cum_weights / cum_weights[-1]
+
+
+def weighted_choice(rng, values, cum_weights):
+    """Choose a value given its cumulative weights."""
+    return values[int(np.searchsorted(cum_weights, rng.random(), side="right"))]
+
+
+@functools.lru_cache(maxsize=None)
+def host_range(cidr):
+    """
+    Get (address class, first host integer, hosts count) of given network cidr.
+
+    Hosts are the same as `ipaddress.ip_network(cidr).hosts()` would yield,
+    falling back to network address when network has no hosts.
+    """
+    network = ipaddress.ip_network(cidr)
+    first, count = int(network.network_address), network.num_addresses
+    if network.max_prefixlen - network.prefixlen > 1:
+        if network.version == 4:
+            # skip network and broadcast addresses
+            first, count = first + 1, count - 2
+        else:
+            # skip Subnet-Router anycast address
+            first, count = first + 1, count - 1
+    return type(network.network_address), first, count
+
+
+def random_offset(rng, count):
+    """Draw random integer from [0, count)."""
+    if count <= np.iinfo(np.int64).max:
+        return int(rng.integers(count))
+    return int.from_bytes(rng.bytes(16), "little") % count
+
+
+@functools.lru_cache(maxsize=64)
+def halving_weights(count):
+    """Get cumulative weights, each next item is two times less probable."""
+    return cumulative(0.5 ** np.arange(count))
+
+
+def unique(items):
+    """Remove duplicates preserving order of first occurrence."""
+    return list(dict.fromkeys(items))
+
+
+class LocationTable:
+    """Pre-parsed states, cities and cidr blocks, ready for random sampling."""
+
+    def __init__(self, ip_cidrs_by_state_city):
+        """Parse location to cidr records."""
+        self.states = []
+        for state_data in ip_cidrs_by_state_city:
+            cities = [
+                (
+                    city_data["city"],
+                    [host_range(cidr) for cidr in city_data["cidr_blocks"]],
+                )
+                for city_data in state_data["cities"]
+            ]
+            self.states.append((state_data["state"], cities))
+        self.state_count_weights = cumulative(STATE_COUNT_WEIGHTS)
+        self.city_count_weights = cumulative(CITY_COUNT_WEIGHTS)
+
+    @classmethod
+    def from_file(cls, ip_facts_file):
+        """Load location table from location_to_cidr json lines file."""
+        with open_file(ip_facts_file, "rb") as f_h:
+            return cls(json_lines_file(f_h))
+
+    def random_ip_loc(self, rng):
+        """Yield random ip locations, mostly within one state and city."""
+        state_count = weighted_choice(rng, STATE_COUNTS, self.state_count_weights)
+        for state_idx in rng.integers(len(self.states), size=state_count).tolist():
+            state, cities = self.states[state_idx]
+            city_count = weighted_choice(rng, CITY_COUNTS, self.city_count_weights)
+            for city_idx in rng.integers(len(cities), size=city_count).tolist():
+                city, cidr_blocks = cities[city_idx]
+                address_cls, first, count = cidr_blocks[
+                    int(rng.integers(len(cidr_blocks)))
+                ]
+                yield IPLoc(
+                    state=state,
+                    city=city,
+                    ip_address=str(address_cls(first + random_offset(rng, count))),
+                )
+
+
+def random_ip_loc_from_group(rng, locations):
+    """Select few locations from the group, first ones being more probable."""
+    count = len(locations)
+    random_count = weighted_choice(rng, range(1, count + 1), halving_weights(count))
+    return unique(locations[idx] for idx in rng.integers(count, size=random_count))
@@ -0,0 +1,224 @@
+"""
+Sidecar key index of json lines files.
+
+Index of a file by a field is kept next to it, in `{path}.{field}.idx`: a header
+followed by table of (key hash, byte offset of the key in the file) sorted by
+the hash. Readers memory map the table and binary search it, so a single record
+is loaded without scanning the file and processes opening the same index share
+its pages. Pointing at the key itself lets readers check that the key is there
+without parsing its record, which may be a long one.
+"""
+
+import hashlib
+import itertools
+import json
+import mmap
+import os
+import re
+import struct
+
+import numpy as np
+
+from nepytune.compression import compression_of
+from nepytune.facts import run_tasks
+from nepytune.write_utils import decode_json_line, line_aligned_ranges, lines_in_range
+
+
+INDEX_MAGIC = b"NPTIDX01"
+# magic, size and modification time (ns) of the indexed file
+INDEX_HEADER = struct.Struct("<8sqq")
+INDEX_ENTRY = np.dtype([("hash", "<u8"), ("offset", "<i8")])
+
+
+def index_path(path, field):
+    """Get path of the sidecar index of file by field."""
+    return f"{path}.{field}.idx"
+
+
+def key_hash(key):
+    """Get 64-bit hash of utf-8 encoded key."""
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little")
+
+
+def leading_key_pattern(field):
+    """Get pattern matching plain string value of field, when it comes first."""
+    return re.compile(rb'\{%s: ?"([^"\\]*)"' % re.escape(json.dumps(field).encode()))
+
+
+def record_keys(line, field, leading_key):
+    """
+    Get utf-8 encoded keys of the record (its field value or list items).
+
+    Keys come together with their offset within the line, or 0 if they are not
+    serialized the way `json.dumps` would do it.
+    """
+    match = leading_key.match(line)
+    if match:
+        return [(match.group(1), match.start(1) - 1)]
+    value = decode_json_line(line)[field]
+    keys = []
+    position = max(line.find(json.dumps(field).encode("utf-8")), 0)
+    for value in value if isinstance(value, list) else [value]:
+        quoted = json.dumps(value).encode("utf-8")
+        found = line.find(quoted, position)
+        if found >= 0:
+            position = found + len(quoted)
+        keys.append((value.encode("utf-8"), max(found, 0)))
+    return keys
+
+
+def index_range(path, field, start, end):
+    """Get hashes and byte offsets of json lines records keys within byte range."""
+    hashes, offsets = [], []
+    position = start
+    # records written by this package start with their key, so full parse of
+    # the line is needed only for the others
+    leading_key = leading_key_pattern(field)
+    with open(path, "rb") as f_h:
+        for line in lines_in_range(f_h, start, end):
+            for key, key_offset in record_keys(line, field, leading_key):
+                hashes.append(key_hash(key))
+                offsets.append(position + key_offset)
+            position += len(line)
+    return np.array(hashes, dtype=np.uint64), np.array(offsets, dtype=np.int64)
+
+
+def source_header(path):
+    """Get index header describing current state of the indexed file."""
+    stat = os.stat(path)
+    return INDEX_HEADER.pack(INDEX_MAGIC, stat.st_size, stat.st_mtime_ns)
+
+
+def build_index(path, field, workers=1):
+    """
+    Write sidecar index of json lines file by field.
+
+    Field may hold a list, then record is indexed by each of its items.
+    File is indexed in line-aligned byte ranges, in parallel.
+    """
+    if compression_of(path):
+        raise ValueError(f"Compressed file {path} cannot be indexed")
+    header = source_header(path)
+    ranges = line_aligned_ranges(path, workers)
+    parts = run_tasks(
+        workers,
+        index_range,
+        itertools.repeat(path, len(ranges)),
+        itertools.repeat(field, len(ranges)),
+        *zip(*ranges),
+    )
+    entries = np.empty(sum(len(hashes) for hashes, _ in parts), dtype=INDEX_ENTRY)
+    entries["hash"] = np.concatenate([hashes for hashes, _ in parts])
+    entries["offset"] = np.concatenate([offsets for _, offsets in parts])
+    entries = entries[np.argsort(entries["hash"], kind="stable")]
+
+    dst = index_path(path, field)
+    with open(f"{dst}.tmp", "wb") as f_h:
+        f_h.write(header)
+        f_h.write(entries.tobytes())
+    os.replace(f"{dst}.tmp", dst)
+    return dst
+
+
+def extend_index(path, field, indexed_size):
+    """
+    Add records appended to json lines file to its index, built up to given size.
+
+    Only the appended bytes are read, and their entries are merged into the
+    sorted table instead of sorting it again.
+    """
+    dst = index_path(path, field)
+    with open(dst, "rb") as f_h:
+        magic, size, _ = INDEX_HEADER.unpack(f_h.read(INDEX_HEADER.size))
+    if magic != INDEX_MAGIC or size != indexed_size:
+        return build_index(path, field)
+    header = source_header(path)
+    hashes, offsets = index_range(path, field, indexed_size, os.path.getsize(path))
+    order = np.argsort(hashes, kind="stable")
+    added = np.empty(len(hashes), dtype=INDEX_ENTRY)
+    added["hash"] = hashes[order]
+    added["offset"] = offsets[order]
+    entries = np.fromfile(dst, dtype=INDEX_ENTRY, offset=INDEX_HEADER.size)
+    # appended keys go after existing ones of the same hash, keeping file order
+    positions = np.searchsorted(entries["hash"], added["hash"], side="right")
+    entries = np.insert(entries, positions, added)
+
+    with open(f"{dst}.tmp", "wb") as f_h:
+        f_h.write(header)
+        f_h.write(entries.tobytes())
+    os.replace(f"{dst}.tmp", dst)
+    return dst
+
+
+def ensure_index(path, field, workers=1):
+    """Build sidecar index of json lines file, unless up to date one exists."""
+    dst = index_path(path, field)
+    if os.path.exists(dst):
+        with open(dst, "rb") as f_h:
+            if f_h.read(INDEX_HEADER.size) == source_header(path):
+                return dst
+    return build_index(path, field, workers)
+
+
+class JsonLinesIndex:
+    """
+    Read-only mapping from key to json lines record, backed by sidecar index.
+
+    Like a dict built from the file, the last record of a repeated key wins.
+    """
+
+    def __init__(self, path, field):
+        """Open index of json lines file by field, which has to be up to date."""
+        self.field = field
+        dst = index_path(path, field)
+        with open(dst, "rb") as f_h:
+            if f_h.read(INDEX_HEADER.size) != source_header(path):
+                raise ValueError(f"Index {dst} is out of date")
+        self.entries = np.empty(0, dtype=INDEX_ENTRY)
+        self.data = b""
+        if os.path.getsize(dst) > INDEX_HEADER.size:
+            self.entries = np.memmap(
+                dst, dtype=INDEX_ENTRY, mode="r", offset=INDEX_HEADER.size
+            )
+            with open(path, "rb") as f_h:
+                self.data = mmap.mmap(f_h.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        """Get number of indexed keys."""
+        return len(self.entries)
+
+    def key_offsets(self, key):
+        """Get byte offsets of keys hashing the same as the key, in file order."""
+        hashes = self.entries["hash"]
+        hashed = np.uint64(key_hash(key.encode("utf-8")))
+        start = np.searchsorted(hashes, hashed, side="left")
+        end = np.searchsorted(hashes, hashed, side="right")
+        return self.entries["offset"][start:end].tolist()
+
+    def records(self, key):
+        """Yield records of the key, in file order."""
+        for offset in self.key_offsets(key):
+            start = self.data.rfind(b"\n", 0, offset) + 1
+            end = self.data.find(b"\n", offset)
+            line = self.data[start : end if end >= 0 else len(self.data)]
+            data = decode_json_line(line)
+            value = data[self.field]
+            if value == key or (isinstance(value, list) and key in value):
+                yield data
+
+    def __getitem__(self, key):
+        """Get record of the key."""
+        data = None
+        for data in self.records(key):
+            pass
+        if data is None:
+            raise KeyError(key)
+        return data
+
+    def __contains__(self, key):
+        """Check whether there is record of the key, without parsing it if possible."""
+        quoted = json.dumps(key).encode("utf-8")
+        for offset in self.key_offsets(key):
+            if self.data[offset : offset + len(quoted)] == quoted:
+                return True
+        return any(True for _ in self.records(key))
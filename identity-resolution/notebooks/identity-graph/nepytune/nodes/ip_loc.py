@@ -1,5 +1,6 @@
 from collections import namedtuple
 
+from nepytune.compression import open_file
 from nepytune.write_utils import gremlin_writer, GremlinNodeCSV, json_lines_file
 from nepytune.utils import hash_
 
@@ -15,7 +16,7 @@ def get_id(ip_loc):
 def generate_ip_loc_nodes_from_facts(src, dst):
     """Generate ip location csv file with nodes."""
     attrs = ["state:String", "city:String", "ip_address:String"]
-    with open(src) as f_h:
+    with open_file(src, "rb") as f_h:
         with gremlin_writer(GremlinNodeCSV, dst, attributes=attrs) as writer:
             locations = set()
             for data in json_lines_file(f_h):
@@ -25,12 +26,4 @@ def generate_ip_loc_nodes_from_facts(src, dst):
                     )
 
             for location in locations:
-                writer.add(
-                    _id=get_id(location),
-                    attribute_map={
-                        "state": location.state,
-                        "city": location.city,
-                        "ip_address": location.ip_address,
-                    },
-                    label="IP",
-                )
+                writer.add_row(get_id(location), location, "IP")
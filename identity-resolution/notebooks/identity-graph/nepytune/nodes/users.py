@@ -1,3 +1,4 @@
+from nepytune.compression import open_file
 from nepytune.write_utils import gremlin_writer, json_lines_file, GremlinNodeCSV
 
 
@@ -12,32 +13,28 @@ def generate_user_nodes(src, dst):
         "email:String",
         "type:String",
     ]
-    with open(src) as src_data:
+    with open_file(src, "rb") as src_data:
         with gremlin_writer(GremlinNodeCSV, dst, attributes=attributes) as writer:
             for data in json_lines_file(src_data):
-                writer.add(
-                    _id=data["uid"],
-                    attribute_map={
-                        "uid": data["uid"],
-                        "user_agent": data["user_agent"],
-                        "device": data["device"],
-                        "os": data["os"],
-                        "browser": data["browser"],
-                        "email": data["email"],
-                        "type": data["type"],
-                    },
-                    label="transientId",
+                writer.add_row(
+                    data["uid"],
+                    (
+                        data["uid"],
+                        data["user_agent"],
+                        data["device"],
+                        data["os"],
+                        data["browser"],
+                        data["email"],
+                        data["type"],
+                    ),
+                    "transientId",
                 )
         return dst
 
 
 def generate_persistent_nodes(src, dst):
     """Generate persistent node csv file."""
-    with open(src) as f_h:
+    with open_file(src, "rb") as f_h:
         with gremlin_writer(GremlinNodeCSV, dst, attributes=["pid:String"]) as writer:
             for data in json_lines_file(f_h):
-                writer.add(
-                    _id=data["pid"],
-                    attribute_map={"pid": data["pid"]},
-                    label="persistentId",
-                )
+                writer.add_row(data["pid"], (data["pid"],), "persistentId")
@@ -1,6 +1,8 @@
 import csv
 import collections
 
+from nepytune.compression import open_file
+from nepytune.url_table import attached_url_table
 from nepytune.utils import hash_
 from nepytune.write_utils import gremlin_writer, GremlinNodeCSV, json_lines_file
 
@@ -36,24 +38,20 @@ def generate_website_group_nodes(website_group_json, dst):
         "category:String",
         "categoryCode:String"
     ]
-    with open(website_group_json) as f_h:
+    with open_file(website_group_json, "rb") as f_h:
         with gremlin_writer(GremlinNodeCSV, dst, attributes=attributes) as writer:
             for data in json_lines_file(f_h):
-                writer.add(
-                    _id=data["id"],
-                    attribute_map={
-                        "url": data["url"],
-                        "category": data["category"]["name"],
-                        "categoryCode": data["category"]["code"]
-                    },
-                    label=WEBSITE_GROUP_LABEL
+                writer.add_row(
+                    data["id"],
+                    (data["url"], data["category"]["name"], data["category"]["code"]),
+                    WEBSITE_GROUP_LABEL,
                 )
 
 
 def read_urls_from_csv(path):
     """Return dict with urls and fact ids corresponding to them."""
     urls = collections.defaultdict(list)
-    with open(path) as csv_file:
+    with open_file(path) as csv_file:
         csv_reader = csv.reader(csv_file, delimiter=",")
         for row in csv_reader:
             fid = row[0]
@@ -63,15 +61,8 @@ def read_urls_from_csv(path):
 
 
 def read_titles_from_csv(path):
-    """Read titles from csv."""
-    titles = {}
-    with open(path) as csv_file:
-        csv_reader = csv.reader(csv_file, delimiter=",")
-        for row in csv_reader:
-            fid = row[0]
-            title = row[1]
-            titles[fid] = title
-    return titles
+    """Read titles from csv, as memory mapped fid to title table."""
+    return attached_url_table(path)
 
 
 def generate_websites(urls, titles):
@@ -84,7 +75,7 @@ def generate_websites(urls, titles):
 def get_website_title(fids, titles):
     """Get website title."""
     for fid in fids:
-        title = titles.get(fid)
+        title = titles.get(int(fid))
         if title:
             return title
     return None
@@ -95,7 +86,4 @@ def generate_website_csv(urls, titles, dst):
     attributes = ["url:String", "title:String"]
     with gremlin_writer(GremlinNodeCSV, dst, attributes=attributes) as writer:
         for website in generate_websites(urls, titles):
-            attribute_map = {"url": website.url, "title": website.title}
-            writer.add(
-                _id=website.url, attribute_map=attribute_map, label=WEBSITE_LABEL
-            )
+            writer.add_row(website.url, website, WEBSITE_LABEL)
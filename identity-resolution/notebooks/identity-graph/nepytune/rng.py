@@ -0,0 +1,58 @@
+"""Reproducible random number generator streams."""
+
+import hashlib
+
+import numpy as np
+
+
+# building Philox with `key` argument draws fresh OS entropy it does not use;
+# seeding it from fixed sequence and then setting the key is several times faster
+KEYING_SEED_SEQUENCE = np.random.SeedSequence(0)
+UINT64_MASK = 2 ** 64 - 1
+
+
+def root_entropy(seed=None):
+    """Get entropy of the root seed; fresh one if seed is not given."""
+    return np.random.SeedSequence(seed).entropy
+
+
+def stream_rng(entropy, *stream):
+    """
+    Get generator of an independent stream spawned from the root entropy.
+
+    Stream is identified by a path of integers (e.g. phase and shard number),
+    so the same stream gets the same draws no matter which process runs it.
+    """
+    return np.random.default_rng(np.random.SeedSequence(entropy, spawn_key=stream))
+
+
+def entity_rng(entropy, phase, key):
+    """
+    Get counter-based generator keyed by the entity id and root entropy.
+
+    Draws for an entity depend only on its id, so any entity can be
+    (re)generated on its own, in any order.
+    """
+    digest = hashlib.blake2b(
+        f"{phase}:{key}".encode("utf-8"),
+        digest_size=16,
+        key=entropy.to_bytes(-(-entropy.bit_length() // 8) or 1, "little")[:64],
+    ).digest()
+    return np.random.Generator(keyed_philox(int.from_bytes(digest, "little")))
+
+
+def keyed_philox(key):
+    """Get Philox bit generator with 128-bit key, same as `Philox(key=key)`."""
+    bit_generator = np.random.Philox(KEYING_SEED_SEQUENCE)
+    bit_generator.state = {
+        "bit_generator": "Philox",
+        "state": {
+            "counter": np.zeros(4, dtype=np.uint64),
+            "key": np.array([key & UINT64_MASK, key >> 64], dtype=np.uint64),
+        },
+        "buffer": np.zeros(4, dtype=np.uint64),
+        "buffer_pos": 4,
+        "has_uint32": 0,
+        "uinteger": 0,
+    }
+    return bit_generator
@@ -0,0 +1,163 @@
+"""
+Run tasks with declared input and output files, as soon as their inputs are ready.
+
+Task depends on the tasks producing any of its inputs. Independent tasks run
+concurrently in a process pool, and time spent in every task is reported.
+"""
+
+from collections import namedtuple
+import concurrent.futures
+import logging
+import multiprocessing
+import os
+import time
+
+
+logger = logging.getLogger("scheduler")
+logger.setLevel(logging.INFO)
+
+Task = namedtuple("Task", "name, func, args, inputs, outputs")
+
+
+def task(name, func, *args, inputs=(), outputs=()):
+    """Build task calling `func(*args)`, which reads inputs and writes outputs."""
+    return Task(name, func, args, tuple(inputs), tuple(outputs))
+
+
+def dependencies(tasks):
+    """Get names of tasks every task depends on, through its inputs."""
+    producers, names = {}, set()
+    for current in tasks:
+        if current.name in names:
+            raise ValueError(f"Duplicate task name {current.name}")
+        names.add(current.name)
+        for path in current.outputs:
+            if path in producers:
+                raise ValueError(
+                    f"Tasks {producers[path]} and {current.name} both write {path}"
+                )
+            producers[path] = current.name
+    return {
+        current.name: {
+            producers[path]
+            for path in current.inputs
+            if path in producers and producers[path] != current.name
+        }
+        for current in tasks
+    }
+
+
+def validate(tasks):
+    """
+    Check that tasks can run, get names of tasks every task depends on.
+
+    Every input has to be written by a task or exist already, and no task may
+    depend on itself through others, so that a broken graph fails before any
+    task runs.
+    """
+    waiting, done = dependencies(tasks), set()
+    produced = {path for current in tasks for path in current.outputs}
+    for current in tasks:
+        for path in current.inputs:
+            if path not in produced and not os.path.exists(path):
+                raise ValueError(f"Task {current.name} reads missing {path}")
+    while len(done) < len(waiting):
+        ready = {
+            name
+            for name, needed in waiting.items()
+            if name not in done and needed <= done
+        }
+        if not ready:
+            raise ValueError(
+                f"Tasks with cyclic dependencies: {sorted(waiting.keys() - done)}"
+            )
+        done |= ready
+    return waiting
+
+
+def timed_call(func, args):
+    """Call function, return its result and elapsed time."""
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def process_pool(workers, preload=()):
+    """
+    Create process pool whose workers start with given modules already imported.
+
+    Where possible, workers are forked from a server process which imports
+    the modules once, instead of each worker importing them on its own.
+    """
+    context = None
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(list(preload))
+    return concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers, mp_context=context
+    )
+
+
+def ready_tasks(waiting, done):
+    """Get names of waiting tasks whose dependencies are all done, in order."""
+    return [name for name, needed in waiting.items() if needed <= done.keys()]
+
+
+def run_dag(tasks, workers=1):
+    """
+    Run tasks respecting their dependencies, return (result, seconds) by task name.
+
+    With more than one worker, every task whose dependencies are done is
+    submitted to the process pool right away, in order of the task list.
+    """
+    by_name = {current.name: current for current in tasks}
+    waiting = validate(tasks)
+    done = {}
+    start = time.perf_counter()
+
+    if workers <= 1:
+        while waiting:
+            ready = ready_tasks(waiting, done)
+            if not ready:
+                raise ValueError(f"Tasks with cyclic dependencies: {list(waiting)}")
+            for name in ready:
+                del waiting[name]
+                logger.info("Running %s", name)
+                done[name] = timed_call(by_name[name].func, by_name[name].args)
+    else:
+        preload = sorted({current.func.__module__ for current in tasks})
+        with process_pool(workers, preload) as executor:
+            running = {}
+            while waiting or running:
+                for name in ready_tasks(waiting, done):
+                    del waiting[name]
+                    logger.info("Scheduling %s", name)
+                    future = executor.submit(
+                        timed_call, by_name[name].func, by_name[name].args
+                    )
+                    running[future] = name
+                if not running:
+                    raise ValueError(f"Tasks with cyclic dependencies: {list(waiting)}")
+                finished, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in finished:
+                    name = running.pop(future)
+                    done[name] = future.result()
+                    logger.info("Finished %s in %.2fs", name, done[name][1])
+
+    log_summary(done, time.perf_counter() - start)
+    return done
+
+
+def log_summary(done, elapsed):
+    """Log time spent in every task, from the slowest one."""
+    if not done:
+        return
+    logger.info("%-60s %10s", "Task", "Seconds")
+    for name, (_, seconds) in sorted(done.items(), key=lambda item: -item[1][1]):
+        logger.info("%-60s %10.2f", name, seconds)
+    total = sum(seconds for _, seconds in done.values())
+    logger.info(
+        "%d tasks took %.2fs in total, %.2fs of wall time", len(done), total, elapsed
+    )
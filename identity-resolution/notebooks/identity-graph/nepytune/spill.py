@@ -0,0 +1,105 @@
+"""Spill records into on-disk shards, to process them one shard at a time."""
+
+import glob
+import math
+import os
+import zlib
+
+from nepytune.write_utils import encode_json_line, json_lines_file
+
+
+MB = 1024 * 1024
+# rough ratio between size of json lines on disk and python objects built from them
+MEMORY_EXPANSION = 6
+# per writer, lines of all its shards together
+SHARD_WRITER_BUFFER_SIZE = 8 * MB
+
+
+def shard_of(key, shards):
+    """Get stable shard number of given string key."""
+    return zlib.crc32(key.encode("utf-8")) % shards
+
+
+def shard_count(paths, memory_budget, expansion=MEMORY_EXPANSION):
+    """Estimate number of shards so that one shard loaded in memory fits the budget."""
+    total = sum(os.path.getsize(path) for path in paths)
+    return max(1, math.ceil(total * expansion / memory_budget))
+
+
+class ShardWriter:
+    """
+    Write json lines records into one of shard files, chosen by record key.
+
+    Lines are buffered per shard and appended to shard files in batches, one
+    file open at a time, so that number of open files does not grow with
+    number of shards. Shard files are created once they get their first line.
+    """
+
+    def __init__(self, directory, name, shards, buffer_size=SHARD_WRITER_BUFFER_SIZE):
+        """Create writer with empty buffers."""
+        self.directory, self.name, self.shards = directory, name, shards
+        self.buffer_size = buffer_size
+        self.buffers = [[] for _ in range(shards)]
+        self.buffered = 0
+        self.created = set()
+
+    def write(self, key, data):
+        """Write record into shard of the given key."""
+        self.write_line(key, encode_json_line(data))
+
+    def write_line(self, key, line):
+        """Write already encoded line (bytes) into shard of the given key."""
+        self.buffers[shard_of(key, self.shards)].append(line)
+        self.buffered += len(line)
+        if self.buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """Append buffered lines to shard files."""
+        for shard, lines in enumerate(self.buffers):
+            if lines:
+                mode = "ab" if shard in self.created else "wb"
+                with open(shard_path(self.directory, self.name, shard), mode) as f_h:
+                    f_h.writelines(lines)
+                self.created.add(shard)
+                lines.clear()
+        self.buffered = 0
+
+    def close(self):
+        """Write down all buffered lines."""
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def shard_path(directory, name, shard):
+    """Get path of a shard file."""
+    return os.path.join(directory, f"{name}-{shard:05d}.json")
+
+
+def read_shard(directory, name, shard):
+    """Yield json lines records of a shard file."""
+    with open(shard_path(directory, name, shard), "rb") as f_h:
+        yield from json_lines_file(f_h)
+
+
+def part_name(name, part):
+    """Get name of shard files written from one part of the input."""
+    return f"{name}.{part:05d}"
+
+
+def shard_part_paths(directory, name, shard):
+    """Get paths of a shard files, from all the parts in order."""
+    pattern = f"{name}.{'[0-9]' * 5}-{shard:05d}.json"
+    return sorted(glob.glob(os.path.join(directory, pattern)))
+
+
+def read_shard_parts(directory, name, shard):
+    """Yield json lines records of a shard, from all the parts in order."""
+    for path in shard_part_paths(directory, name, shard):
+        with open(path, "rb") as f_h:
+            yield from json_lines_file(f_h)
@@ -0,0 +1,145 @@
+"""Format raw fact timestamps as local ISO dates, a whole column at a time."""
+
+from datetime import datetime
+import logging
+import math
+
+import numpy as np
+
+
+logger = logging.getLogger("timestamps")
+logger.setLevel(logging.INFO)
+
+TS_FORMAT = "%Y-%m-%dT%H:%M:%S"
+# timestamps are in milliseconds, or in microseconds if that is out of range
+TS_DIVISORS = (1_000, 1_000_000)
+# seconds surely supported by `datetime.fromtimestamp` (up to year 3000),
+# other ones are converted one by one, the way it was always done
+SAFE_SECONDS = (0, 32_503_680_000)
+# seconds surely not supported by it (after year 9999, in any time zone),
+# only timestamps beyond that in milliseconds are taken as microseconds
+UNSUPPORTED_SECONDS = 253_402_387_200
+SECOND_NAMES = [f"{second:02d}" for second in range(60)]
+MAX_EXAMPLES = 5
+
+
+def parse_ts(timestamp):
+    """Format single timestamp, return it together with divisor which worked."""
+    for div in TS_DIVISORS:
+        try:
+            return datetime.fromtimestamp(timestamp / div).strftime(TS_FORMAT), div
+        except Exception:
+            pass
+    return "", None
+
+
+def whole_seconds(seconds):
+    """Round seconds down the way `datetime.fromtimestamp` does it."""
+    whole = np.trunc(seconds)
+    # fromtimestamp rounds fraction to microseconds (half to even) first
+    whole += np.round((seconds - whole) * 1e6) >= 1e6
+    return whole.astype(np.int64)
+
+
+def as_number(timestamp):
+    """Convert numeric timestamp to float, anything else to NaN."""
+    if type(timestamp) in (int, float, bool):
+        try:
+            return float(timestamp)
+        except OverflowError:
+            pass
+    return math.nan
+
+
+class TimestampFormatter:
+    """
+    Format columns of raw timestamps as local ISO dates.
+
+    Units are detected with vectorized range checks, and dates are formatted
+    from per-minute cache of their prefixes. Timestamps which cannot be
+    converted become empty strings and are counted, to be summarized at once.
+    """
+
+    def __init__(self):
+        """Create formatter with empty cache and counters."""
+        self.minutes = {}
+        self.converted = 0
+        self.microseconds = 0
+        self.bad = 0
+        self.examples = []
+
+    def minute_prefix(self, minute):
+        """Get formatted local date of the minute, without its seconds."""
+        prefix = self.minutes.get(minute)
+        if prefix is None:
+            date = datetime.fromtimestamp(minute * 60)
+            # zones with offsets of seconds do not start local minutes here
+            prefix = date.strftime(TS_FORMAT)[:-2] if date.second == 0 else False
+            self.minutes[minute] = prefix
+        return prefix
+
+    def format(self, timestamps):
+        """Format timestamps, return list of strings."""
+        values = np.array(timestamps)
+        if values.dtype.kind not in "biuf":
+            # e.g. numeric strings, which are not converted one by one either
+            values = [as_number(timestamp) for timestamp in timestamps]
+        values = np.asarray(values, dtype=np.float64)
+
+        formatted = [None] * len(values)
+        seconds = values / TS_DIVISORS[0]
+        safe = (seconds >= SAFE_SECONDS[0]) & (seconds < SAFE_SECONDS[1])
+        self.format_seconds(formatted, np.flatnonzero(safe), seconds)
+
+        seconds = values / TS_DIVISORS[1]
+        safe_microseconds = (
+            (values / TS_DIVISORS[0] >= UNSUPPORTED_SECONDS)
+            & (seconds >= SAFE_SECONDS[0])
+            & (seconds < SAFE_SECONDS[1])
+        )
+        indices = np.flatnonzero(safe_microseconds)
+        self.format_seconds(formatted, indices, seconds)
+        self.microseconds += len(indices)
+
+        for idx in np.flatnonzero(~(safe | safe_microseconds)).tolist():
+            formatted[idx] = self.format_one(timestamps[idx])
+        return formatted
+
+    def format_seconds(self, formatted, indices, seconds):
+        """Format safe seconds at given indices into the list of strings."""
+        whole = whole_seconds(seconds[indices])
+        for idx, minute, second in zip(
+            indices.tolist(), (whole // 60).tolist(), (whole % 60).tolist()
+        ):
+            prefix = self.minute_prefix(minute)
+            if prefix:
+                formatted[idx] = prefix + SECOND_NAMES[second]
+            else:
+                formatted[idx] = datetime.fromtimestamp(minute * 60 + second).strftime(
+                    TS_FORMAT
+                )
+        self.converted += len(indices)
+
+    def format_one(self, timestamp):
+        """Format single timestamp, counting it in."""
+        formatted, div = parse_ts(timestamp)
+        if div is None:
+            self.bad += 1
+            if len(self.examples) < MAX_EXAMPLES:
+                self.examples.append(timestamp)
+        else:
+            self.converted += 1
+            self.microseconds += div != TS_DIVISORS[0]
+        return formatted
+
+    def log_summary(self):
+        """Log how many timestamps were in microseconds, and which were bad."""
+        if self.microseconds:
+            logger.info("Parsed %d timestamps as microseconds", self.microseconds)
+        if self.bad:
+            logger.info(
+                "Could not parse %d of %d timestamps, e.g. %s",
+                self.bad,
+                self.bad + self.converted,
+                ", ".join(map(repr, self.examples)),
+            )
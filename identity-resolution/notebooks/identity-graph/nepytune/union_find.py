@@ -0,0 +1,602 @@
+import concurrent.futures
+import csv
+import itertools
+import json
+import os
+import shutil
+
+import numpy as np
+
+from nepytune.compression import open_file
+from nepytune.utils import hash_
+from nepytune.write_utils import line_aligned_ranges, lines_in_range
+
+
+DEFAULT_BATCH_SIZE = 100_000
+INT32_MAX = np.iinfo(np.int32).max
+
+
+def index_dtype(size):
+    """Get the smallest integer dtype able to index `size` elements."""
+    return np.int32 if size <= INT32_MAX else np.int64
+
+
+def compress(parents):
+    """Get fully compressed array of root indexes of the parents forest."""
+    while True:
+        grandparents = parents[parents]
+        if np.array_equal(grandparents, parents):
+            return parents
+        parents = grandparents
+
+
+def label_groups(labels):
+    """Iterate over arrays of indexes sharing the same label, in order of labels."""
+    if not len(labels):
+        return
+    order = np.argsort(labels, kind="stable")
+    bounds = np.flatnonzero(np.diff(labels[order])) + 1
+    starts = itertools.chain([0], bounds.tolist())
+    ends = itertools.chain(bounds.tolist(), [len(order)])
+    for start, end in zip(starts, ends):
+        yield order[start:end]
+
+
+class ArrayUnionFind:
+    """
+    Union-find datastructure over integer-interned node names.
+
+    Every node name is mapped once to a dense integer index, given in order of
+    first appearance. Parents are kept in a NumPy array and unions are applied
+    in vectorized batches: roots of both ends of each link are found, and the root
+    with higher index is hooked under the lower one. This way the root of each set
+    is always its member which appeared first, so sets come out in the same order
+    as `networkx.utils.union_find.UnionFind.to_sets` yields them.
+    """
+
+    def __init__(self, capacity=1024):
+        """Create empty union-find datastructure."""
+        self.index = {}
+        self.names = []
+        self.parents = np.arange(capacity, dtype=index_dtype(capacity))
+
+    def __len__(self):
+        """Get number of nodes."""
+        return len(self.names)
+
+    def intern(self, names):
+        """Map node names to their integer indexes, registering unknown ones."""
+        index, known = self.index, self.names
+        for name in names:
+            idx = index.get(name)
+            if idx is None:
+                idx = index[name] = len(known)
+                known.append(name)
+            yield idx
+
+    def _reserve(self, size):
+        """Make sure parents array can hold `size` nodes."""
+        capacity = len(self.parents)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        parents = np.arange(capacity, dtype=index_dtype(capacity))
+        parents[: len(self.parents)] = self.parents
+        self.parents = parents
+
+    def union_pairs(self, pairs):
+        """Merge sets of each pair of node names."""
+        nodes = np.fromiter(
+            self.intern(itertools.chain.from_iterable(pairs)),
+            dtype=np.int64,
+            count=2 * len(pairs),
+        )
+        self._reserve(len(self.names))
+        self.union_indexes(nodes[0::2], nodes[1::2])
+
+    def merge_forest(self, names, labels):
+        """Merge sets of other forest, given as node names and their root indexes."""
+        nodes = np.fromiter(self.intern(names), dtype=np.int64, count=len(names))
+        self._reserve(len(self.names))
+        linked = labels != np.arange(len(labels))
+        self.union_indexes(nodes[linked], nodes[labels[linked]])
+
+    def union_indexes(self, left, right):
+        """Merge sets of each pair of node indexes (vectorized)."""
+        parents = self.parents
+        left = np.asarray(left, dtype=parents.dtype)
+        right = np.asarray(right, dtype=parents.dtype)
+        while len(left):
+            left_roots = self._find(left)
+            right_roots = self._find(right)
+            pending = left_roots != right_roots
+            left, right = left[pending], right[pending]
+            left_roots, right_roots = left_roots[pending], right_roots[pending]
+            # several links may hook the same root; minimum.at keeps the lowest one
+            # and remaining links are resolved in the next round
+            np.minimum.at(
+                parents,
+                np.maximum(left_roots, right_roots),
+                np.minimum(left_roots, right_roots),
+            )
+
+    def _find(self, nodes):
+        """Find roots of given node indexes, halving paths on the way."""
+        parents = self.parents
+        roots = parents[nodes]
+        while True:
+            grandparents = parents[roots]
+            unresolved = grandparents != roots
+            if not unresolved.any():
+                break
+            parents[roots[unresolved]] = parents[grandparents[unresolved]]
+            roots = grandparents
+        parents[nodes] = roots
+        return roots
+
+    def labels(self):
+        """Get fully compressed array of root indexes for every node."""
+        return compress(self.parents[: len(self.names)])
+
+    def index_groups(self):
+        """Iterate over arrays of member indexes, one per set."""
+        return label_groups(self.labels())
+
+    def node_groups(self):
+        """Iterate over node groups yield parent hash and node members."""
+        names = self.names
+        for members in self.index_groups():
+            node_set = [names[idx] for idx in members.tolist()]
+            yield hash_(node_set), node_set
+
+
+def read_user_pairs(opened_file, batch_size=DEFAULT_BATCH_SIZE):
+    """Yield batches of (transient id, transient id) pairs from user mapping csv."""
+    rows = csv.reader(opened_file, delimiter=",")
+    while True:
+        batch = [(row[0], row[1]) for row in itertools.islice(rows, batch_size)]
+        if not batch:
+            return
+        yield batch
+
+
+def extract_array_user_groups(user_mapping_path, batch_size=DEFAULT_BATCH_SIZE):
+    """Generate disjoint user groups based on array-backed union find."""
+    uf_ds = ArrayUnionFind()
+    with open_file(user_mapping_path) as f_h:
+        for pairs in read_user_pairs(f_h, batch_size):
+            uf_ds.union_pairs(pairs)
+    return uf_ds
+
+
+def extract_local_forest(user_mapping_path, start, end, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Build union find over the lines of user mapping csv within the byte range.
+
+    Return local node names in order of first appearance, together with
+    the local root index of every node.
+    """
+    uf_ds = ArrayUnionFind()
+    with open_file(user_mapping_path, "rb") as f_h:
+        lines = (line.decode("utf-8") for line in lines_in_range(f_h, start, end))
+        for pairs in read_user_pairs(lines, batch_size):
+            uf_ds.union_pairs(pairs)
+    return uf_ds.names, uf_ds.labels()
+
+
+def extract_sharded_user_groups(
+    user_mapping_path, workers, batch_size=DEFAULT_BATCH_SIZE
+):
+    """
+    Generate disjoint user groups, building local forests in parallel.
+
+    Each worker reads a line-aligned byte range of the user mapping file.
+    Local forests are merged in file order, by linking every node to its local
+    root. Interning shards in order gives each node the same global index as
+    a serial run would, hence the result is identical to it.
+    """
+    uf_ds = ArrayUnionFind()
+    ranges = line_aligned_ranges(user_mapping_path, workers)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        forests = executor.map(
+            extract_local_forest,
+            itertools.repeat(user_mapping_path),
+            *zip(*ranges),
+            itertools.repeat(batch_size),
+        )
+        for names, labels in forests:
+            uf_ds.merge_forest(names, labels)
+    return uf_ds
+
+
+SNAPSHOT_ARRAYS = (
+    "names",
+    "labels",
+    "keys",
+    "key_nodes",
+    "members",
+    "roots",
+    "offsets",
+)
+DELTA_ARRAYS = (
+    "names",
+    "keys",
+    "key_nodes",
+    "parts",
+    "roots",
+    "offsets",
+    "sources",
+    "targets",
+)
+SNAPSHOT_MANIFEST = "snapshot.json"
+# deltas are compacted into new base once there are this many of them,
+# or once their sets hold this fraction of base nodes
+MAX_DELTA_SEGMENTS = 16
+MAX_DELTA_FRACTION = 0.25
+
+
+def encode_names(names):
+    """Encode node names into array of utf-8 byte strings."""
+    return np.array([name.encode("utf-8") for name in names], dtype=bytes)
+
+
+def sorted_positions(sorted_values, values):
+    """Get mask of values found in sorted array, and their positions in it."""
+    if not len(sorted_values):
+        return np.zeros(len(values), dtype=bool), np.zeros(len(values), dtype=np.int64)
+    positions = np.searchsorted(sorted_values, values)
+    positions = np.minimum(positions, len(sorted_values) - 1)
+    return sorted_values[positions] == values, positions
+
+
+def lookup_keys(keys, key_nodes, names):
+    """Get indexes of encoded node names in id dictionary, -1 for unknown ones."""
+    if not len(keys):
+        return np.full(len(names), -1, dtype=np.int64)
+    found, positions = sorted_positions(keys, names)
+    return np.where(found, key_nodes[positions], -1).astype(np.int64)
+
+
+def read_manifest(directory):
+    """Read snapshot manifest, listing its base and delta directories."""
+    path = os.path.join(directory, SNAPSHOT_MANIFEST)
+    if not os.path.exists(path):
+        return {"sequence": 0, "base": None, "deltas": []}
+    with open(path) as f_h:
+        return json.load(f_h)
+
+
+def read_arrays(directory, names):
+    """Load memory mapped arrays from directory."""
+    return [
+        np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+        for name in names
+    ]
+
+
+def write_arrays(directory, obj, names):
+    """Write arrays (attributes of the object) into new directory."""
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+    for name in names:
+        np.save(os.path.join(directory, f"{name}.npy"), getattr(obj, name))
+
+
+class SnapshotDelta:
+    """
+    Append-only segment of union-find snapshot, written by applying delta links.
+
+    Segment records merges only, not members of the merged sets, so its size
+    is proportional to the delta. Segment directory holds .npy arrays:
+    - names: utf-8 encoded names of nodes added by the segment, which indexes
+      follow the nodes of base and earlier segments,
+    - keys, key_nodes: their sorted names and indexes,
+    - parts, roots, offsets: roots of sets merged by the segment (added nodes
+      being sets of their own), grouped by sorted roots of the merged sets,
+      and offsets of every group in `parts`,
+    - sources, targets: sorted roots of merged sets and roots they merged into.
+    """
+
+    def __init__(self, names, keys, key_nodes, parts, roots, offsets, sources, targets):
+        """Create delta segment from its arrays."""
+        self.names, self.keys, self.key_nodes = names, keys, key_nodes
+        self.parts, self.roots, self.offsets = parts, roots, offsets
+        self.sources, self.targets = sources, targets
+        self.name = None
+
+    @classmethod
+    def from_merges(cls, start, added_names, merges):
+        """Create segment of nodes added from index `start`, and merged roots."""
+        dtype = index_dtype(start + len(added_names))
+        added_nodes = np.arange(start, start + len(added_names), dtype=dtype)
+        order = np.argsort(added_names, kind="stable")
+        merges = sorted(merges, key=lambda parts: parts[0])
+        # the lowest root of merged sets stays the root
+        roots = np.array([parts[0] for parts in merges], dtype=dtype)
+        sizes = np.array([len(parts) for parts in merges], dtype=np.int64)
+        parts = np.concatenate(merges or [[]]).astype(dtype)
+        offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+        source_order = np.argsort(parts, kind="stable")
+        return cls(
+            added_names,
+            added_names[order],
+            added_nodes[order],
+            parts,
+            roots,
+            offsets,
+            parts[source_order],
+            np.repeat(roots, sizes)[source_order],
+        )
+
+    def merged_parts(self, root):
+        """Get roots merged into the set with given root, None if it did not change."""
+        group = int(np.searchsorted(self.roots, root))
+        if group < len(self.roots) and self.roots[group] == root:
+            return self.parts[self.offsets[group] : self.offsets[group + 1]]
+        return None
+
+
+class UnionFindSnapshot:
+    """
+    Union-find state persisted on disk as compact arrays.
+
+    Snapshot is an immutable base with append-only delta segments over it. Base
+    directory holds .npy arrays:
+    - names: utf-8 encoded node names by node index,
+    - labels: root index of every node,
+    - keys, key_nodes: sorted node names and their indexes, as id dictionary,
+    - members, roots, offsets: node indexes sorted by their root, sorted roots
+      and offsets of their members in `members`, listing nodes of every set.
+
+    Arrays are memory mapped when loaded and never rewritten. Applying delta
+    links looks up only the nodes and sets it touches, and records nodes it
+    added and sets it merged as new `SnapshotDelta`. Roots of nodes are found
+    through the merges of every later segment, members of sets by expanding
+    them. Once deltas grow large, they are compacted into a new base. Manifest
+    lists base and delta directories of the snapshot and is replaced atomically.
+
+    Nodes get the same indexes and sets the same roots as if all the links were
+    processed at once by `ArrayUnionFind`.
+    """
+
+    def __init__(
+        self, names, labels, keys, key_nodes, members, roots, offsets, deltas=()
+    ):
+        """Create snapshot from its base arrays and delta segments."""
+        self.names, self.labels = names, labels
+        self.keys, self.key_nodes = keys, key_nodes
+        self.members, self.roots, self.offsets = members, roots, offsets
+        self.deltas = list(deltas)
+        # where the base is saved, if it is
+        self.directory = self.base_name = None
+
+    def __len__(self):
+        """Get number of nodes."""
+        return len(self.names) + sum(len(delta.names) for delta in self.deltas)
+
+    @classmethod
+    def from_union_find(cls, uf_ds):
+        """Create snapshot of `ArrayUnionFind` state."""
+        return cls.from_labels(encode_names(uf_ds.names), uf_ds.labels().copy())
+
+    @classmethod
+    def from_labels(cls, names, labels):
+        """Create snapshot of encoded node names and root index of every node."""
+        key_nodes = np.argsort(names, kind="stable").astype(labels.dtype)
+        members = np.argsort(labels, kind="stable").astype(labels.dtype)
+        roots, offsets = np.unique(labels[members], return_index=True)
+        offsets = np.append(offsets, len(members)).astype(np.int64)
+        return cls(names, labels, names[key_nodes], key_nodes, members, roots, offsets)
+
+    @classmethod
+    def load(cls, directory):
+        """Load memory mapped snapshot from directory."""
+        directory = os.path.abspath(directory)
+        manifest = read_manifest(directory)
+        if manifest["base"] is None:
+            raise FileNotFoundError(f"No union find snapshot in {directory}")
+        deltas = []
+        for name in manifest["deltas"]:
+            delta = SnapshotDelta(
+                *read_arrays(os.path.join(directory, name), DELTA_ARRAYS)
+            )
+            delta.name = name
+            deltas.append(delta)
+        snapshot = cls(
+            *read_arrays(os.path.join(directory, manifest["base"]), SNAPSHOT_ARRAYS),
+            deltas=deltas,
+        )
+        snapshot.directory, snapshot.base_name = directory, manifest["base"]
+        return snapshot
+
+    def save(self, directory):
+        """
+        Save snapshot into directory.
+
+        Only base and deltas not saved there yet are written, each into a new
+        directory, then the manifest is replaced. Directories it does not list
+        any more are removed.
+        """
+        directory = os.path.abspath(directory)
+        os.makedirs(directory, exist_ok=True)
+        manifest = read_manifest(directory)
+        sequence = manifest["sequence"]
+        saved = directory == self.directory
+
+        def new_name(prefix):
+            nonlocal sequence
+            sequence += 1
+            return f"{prefix}-{sequence:06d}"
+
+        if not (saved and self.base_name):
+            self.base_name = new_name("base")
+            write_arrays(os.path.join(directory, self.base_name), self, SNAPSHOT_ARRAYS)
+        for delta in self.deltas:
+            if not (saved and delta.name):
+                delta.name = new_name("delta")
+                write_arrays(os.path.join(directory, delta.name), delta, DELTA_ARRAYS)
+        self.directory = directory
+
+        listed = [self.base_name] + [delta.name for delta in self.deltas]
+        path = os.path.join(directory, SNAPSHOT_MANIFEST)
+        with open(path + ".tmp", "w") as f_h:
+            json.dump(
+                {"sequence": sequence, "base": listed[0], "deltas": listed[1:]}, f_h
+            )
+        os.replace(path + ".tmp", path)
+        for entry in os.listdir(directory):
+            if entry.startswith(("base-", "delta-")) and entry not in listed:
+                shutil.rmtree(os.path.join(directory, entry))
+
+    def lookup(self, names):
+        """Get indexes of encoded node names, -1 for unknown ones."""
+        nodes = lookup_keys(self.keys, self.key_nodes, names)
+        for delta in self.deltas:
+            missing = nodes < 0
+            if not missing.any():
+                break
+            nodes[missing] = lookup_keys(delta.keys, delta.key_nodes, names[missing])
+        return nodes
+
+    def find_roots(self, nodes):
+        """Get root indexes of node indexes."""
+        nodes = np.asarray(nodes, dtype=np.int64)
+        roots = nodes.copy()
+        base = nodes < len(self.names)
+        roots[base] = self.labels[nodes[base]]
+        for delta in self.deltas:
+            found, positions = sorted_positions(delta.sources, roots)
+            roots[found] = delta.targets[positions[found]]
+        return roots
+
+    def set_members(self, root):
+        """Get sorted node indexes of the set with given root."""
+        if not self.deltas:
+            return self.base_members(root)
+        return np.sort(self.members_before(root, len(self.deltas)))
+
+    def base_members(self, root):
+        """Get node indexes of the base set with given root."""
+        group = np.searchsorted(self.roots, root)
+        return self.members[self.offsets[group] : self.offsets[group + 1]]
+
+    def members_before(self, root, count):
+        """Get node indexes of the set with given root, as of first `count` deltas."""
+        starts = np.cumsum(
+            [len(self.names)] + [len(delta.names) for delta in self.deltas]
+        )
+        for idx in reversed(range(count)):
+            parts = self.deltas[idx].merged_parts(root)
+            if parts is None:
+                continue
+            # nodes added by the delta were sets of their own before it
+            added = parts >= starts[idx]
+            return np.concatenate(
+                [parts[added].astype(np.int64)]
+                + [
+                    self.members_before(part, idx).astype(np.int64)
+                    for part in parts[~added].tolist()
+                ]
+            )
+        if root >= len(self.names):
+            return np.array([root], dtype=np.int64)
+        return self.base_members(root)
+
+    def node_names(self, nodes):
+        """Decode names of node indexes."""
+        if not self.deltas:
+            return [name.decode("utf-8") for name in self.names[nodes].tolist()]
+        nodes = np.asarray(nodes, dtype=np.int64)
+        names = [None] * len(nodes)
+        start = 0
+        for segment in [self.names] + [delta.names for delta in self.deltas]:
+            end = start + len(segment)
+            indexes = np.flatnonzero((nodes >= start) & (nodes < end))
+            for idx, name in zip(indexes.tolist(), segment[nodes[indexes] - start]):
+                names[idx] = name.decode("utf-8")
+            start = end
+        return names
+
+    def node_groups(self):
+        """Iterate over node groups yield parent hash and node members."""
+        snapshot = self.compacted()
+        for root in snapshot.roots.tolist():
+            node_set = snapshot.node_names(snapshot.set_members(root))
+            yield hash_(node_set), node_set
+
+    def apply(self, pairs):
+        """
+        Merge sets of each pair of node names.
+
+        Return snapshot with delta segment of the merge, together with list of
+        changed sets as (node indexes, [node indexes of every replaced set]) tuples.
+        """
+        delta_names = list(dict.fromkeys(itertools.chain.from_iterable(pairs)))
+        encoded = encode_names(delta_names)
+        nodes = self.lookup(encoded)
+        added = nodes < 0
+        size = len(self)
+        nodes[added] = np.arange(size, size + int(added.sum()))
+
+        # union touched roots only, in their global order so that the lowest
+        # root of every merged set stays its root
+        roots = nodes.copy()
+        roots[~added] = self.find_roots(nodes[~added])
+        touched = np.unique(roots)
+        name_index = {name: idx for idx, name in enumerate(delta_names)}
+        ends = np.fromiter(
+            (name_index[name] for name in itertools.chain.from_iterable(pairs)),
+            dtype=np.int64,
+            count=2 * len(pairs),
+        )
+        ends = np.searchsorted(touched, roots[ends])
+        local = ArrayUnionFind(capacity=len(touched))
+        local.union_indexes(ends[0::2], ends[1::2])
+
+        changes, merges = [], []
+        for group in label_groups(compress(local.parents)):
+            group_roots = touched[group]
+            replaced = group_roots[group_roots < size]
+            if len(group_roots) == 1 and len(replaced) == 1:
+                continue
+            replaced_members = [self.set_members(root) for root in replaced.tolist()]
+            members = np.sort(
+                np.concatenate(replaced_members + [group_roots[group_roots >= size]])
+            )
+            changes.append((members, replaced_members))
+            merges.append(group_roots)
+        if not changes:
+            return self, changes
+
+        delta = SnapshotDelta.from_merges(size, encoded[added], merges)
+        snapshot = UnionFindSnapshot(
+            self.names,
+            self.labels,
+            self.keys,
+            self.key_nodes,
+            self.members,
+            self.roots,
+            self.offsets,
+            deltas=self.deltas + [delta],
+        )
+        snapshot.directory, snapshot.base_name = self.directory, self.base_name
+        return snapshot, changes
+
+    def needs_compaction(self):
+        """Check whether deltas grew large enough to be compacted into base."""
+        overlay = sum(len(delta.parts) for delta in self.deltas)
+        return (
+            len(self.deltas) >= MAX_DELTA_SEGMENTS
+            or overlay > MAX_DELTA_FRACTION * len(self.names)
+        )
+
+    def compacted(self):
+        """Get snapshot with deltas merged into new base."""
+        if not self.deltas:
+            return self
+        names = np.concatenate([self.names] + [delta.names for delta in self.deltas])
+        labels = self.find_roots(np.arange(len(names)))
+        return UnionFindSnapshot.from_labels(
+            names, labels.astype(index_dtype(len(names)))
+        )
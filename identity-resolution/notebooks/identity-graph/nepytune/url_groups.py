@@ -0,0 +1,149 @@
+"""
+Group website urls by hostname, in parallel and in external memory.
+
+Urls file is split into line-aligned byte ranges parsed by separate workers.
+If grouping does not fit in memory, urls are spilled into on-disk shards by
+hash of hostname instead; groups of each shard are built separately and
+merged back by position of their first url in the file. Either way groups come
+out in order of first appearance of their hostname, with urls in file order.
+"""
+
+import csv
+import functools
+import heapq
+import itertools
+import re
+import tempfile
+from urllib.parse import urlparse
+
+from nepytune import spill
+from nepytune.compression import open_file
+from nepytune.facts import run_tasks
+from nepytune.rng import entity_rng
+from nepytune.utils import hash_
+from nepytune.write_utils import encode_json_line, line_aligned_ranges, lines_in_range
+
+
+NETLOC_END = re.compile(r"[/?#]")
+WEBSITE_GROUP_CATEGORY = 0
+
+
+@functools.lru_cache(maxsize=1_000_000)
+def netloc_hostname(netloc):
+    """Get hostname of url network location."""
+    return urlparse("//" + netloc).hostname
+
+
+def url_hostname(url):
+    """Get hostname of url, memoized by its network location."""
+    match = NETLOC_END.search(url)
+    return netloc_hostname(url[: match.start()] if match else url)
+
+
+def read_urls(urls_file, start, end):
+    """Yield (byte offset, url) rows from byte range of urls csv."""
+    with open_file(urls_file, "rb") as f_h:
+        position = start
+        for line in lines_in_range(f_h, start, end):
+            for row in csv.reader([line.decode("utf-8")], delimiter=","):
+                yield position, row[1]
+            position += len(line)
+
+
+def group_urls_range(urls_file, start, end):
+    """Group urls from byte range of urls csv by hostname."""
+    groups = {}
+    for _, url in read_urls(urls_file, start, end):
+        groups.setdefault(url_hostname(url), []).append(url)
+    return groups
+
+
+def spill_urls_range(tmp_dir, shards, urls_file, part, start, end):
+    """Spill (position, hostname, url) rows from byte range into hostname shards."""
+    name = spill.part_name("urls", part)
+    with spill.ShardWriter(tmp_dir, name, shards) as writer:
+        for position, url in read_urls(urls_file, start, end):
+            hostname = url_hostname(url)
+            writer.write(str(hostname), [position, hostname, url])
+
+
+def group_urls_shard(tmp_dir, iab_categories, entropy, shard):
+    """Write website groups of a shard, prefixed with their first url position."""
+    groups = {}
+    for position, hostname, url in spill.read_shard_parts(tmp_dir, "urls", shard):
+        groups.setdefault(hostname, (position, []))[1].append(url)
+
+    dst = spill.shard_path(tmp_dir, "website_groups", shard)
+    with open(dst, "wb") as f_h:
+        for hostname, (position, urls) in sorted(
+            groups.items(), key=lambda item: item[1][0]
+        ):
+            line = website_group_line(hostname, urls, iab_categories, entropy)
+            f_h.write(b"%d\t%s" % (position, line))
+    return dst
+
+
+def website_group_line(hostname, urls, iab_categories, entropy):
+    """Encode website group, its category is drawn at random keyed by hostname."""
+    rng = entity_rng(entropy, WEBSITE_GROUP_CATEGORY, str(hostname))
+    code, name = iab_categories[int(rng.integers(len(iab_categories)))]
+    website_group = {
+        "url": hostname,
+        "websites": urls,
+        "category": {"code": code, "name": name},
+    }
+    website_group["id"] = hash_(website_group.items())
+    return encode_json_line(website_group)
+
+
+def generate_website_groups_in_memory(
+    urls_file, iab_categories, dst, entropy, workers
+):
+    """Generate website groups, parsing urls file in parallel."""
+    ranges = line_aligned_ranges(urls_file, workers)
+    website_groups = {}
+    urls_files = itertools.repeat(urls_file, len(ranges))
+    for groups in run_tasks(workers, group_urls_range, urls_files, *zip(*ranges)):
+        for hostname, urls in groups.items():
+            website_groups.setdefault(hostname, []).extend(urls)
+
+    with open_file(dst, "wb") as dst_file:
+        for hostname, urls in website_groups.items():
+            dst_file.write(website_group_line(hostname, urls, iab_categories, entropy))
+
+
+def generate_website_groups_external(
+    urls_file, iab_categories, dst, entropy, workers, shards, spill_dir=None
+):
+    """Generate website groups, spilling urls into shards by hostname."""
+    with tempfile.TemporaryDirectory(dir=spill_dir) as tmp_dir:
+        ranges = line_aligned_ranges(urls_file, workers)
+        parts = len(ranges)
+        run_tasks(
+            workers,
+            spill_urls_range,
+            itertools.repeat(tmp_dir, parts),
+            itertools.repeat(shards, parts),
+            itertools.repeat(urls_file, parts),
+            range(parts),
+            *zip(*ranges),
+        )
+        shard_files = run_tasks(
+            workers,
+            group_urls_shard,
+            itertools.repeat(tmp_dir, shards),
+            itertools.repeat(iab_categories, shards),
+            itertools.repeat(entropy, shards),
+            range(shards),
+        )
+
+        opened = [open(path, "rb") for path in shard_files]
+        try:
+            with open_file(dst, "wb") as dst_file:
+                for line in heapq.merge(
+                    *opened, key=lambda line: int(line.split(b"\t", 1)[0])
+                ):
+                    dst_file.write(line.split(b"\t", 1)[1])
+        finally:
+            for f_h in opened:
+                f_h.close()
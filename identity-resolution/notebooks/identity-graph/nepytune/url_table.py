@@ -0,0 +1,162 @@
+"""
+Dense fid to url table of urls csv file (or any other csv keyed by fid).
+
+Fact ids are dense integers, so urls file is converted once into a sidecar
+`{path}.table`: a header followed by byte offsets and lengths of urls indexed
+by fid, and then the urls themselves. Readers memory map it, so looking up an
+url is an array index and processes opening the same table share its pages.
+"""
+
+import csv
+import mmap
+import os
+import struct
+
+import numpy as np
+
+from nepytune.compression import open_file
+
+
+TABLE_MAGIC = b"NPTURL01"
+# magic, size and modification time (ns) of the urls file, number of fids
+TABLE_HEADER = struct.Struct("<8sqqq")
+MISSING = -1
+INT64_SIZE = 8
+
+# tables opened by this process, shared by all the tasks it runs
+attached_tables = {}
+
+
+def table_path(path):
+    """Get path of the sidecar table of urls file."""
+    return f"{path}.table"
+
+
+def source_header(path, fids):
+    """Get table header describing current state of the urls file."""
+    stat = os.stat(path)
+    return TABLE_HEADER.pack(TABLE_MAGIC, stat.st_size, stat.st_mtime_ns, fids)
+
+
+def build_url_table(path):
+    """Write sidecar table of urls csv file, with fid and url columns."""
+    fids, urls = [], []
+    with open_file(path) as f_h:
+        for row in csv.reader(f_h, delimiter=","):
+            fids.append(int(row[0]))
+            urls.append(row[1].encode("utf-8"))
+    fids = np.array(fids, dtype=np.int64)
+    if len(fids) and fids.min() < 0:
+        raise ValueError(f"Negative fact id in {path}")
+
+    # like in a dict built from the file, the last url of a repeated fid wins
+    _, last = np.unique(fids[::-1], return_index=True)
+    kept = np.sort(len(fids) - 1 - last)
+    lengths = np.array([len(urls[idx]) for idx in kept], dtype=np.int64)
+
+    count = int(fids.max()) + 1 if len(fids) else 0
+    starts = np.full(count, MISSING, dtype=np.int64)
+    sizes = np.full(count, MISSING, dtype=np.int64)
+    starts[fids[kept]] = np.cumsum(lengths) - lengths
+    sizes[fids[kept]] = lengths
+
+    dst = table_path(path)
+    with open(f"{dst}.tmp", "wb") as f_h:
+        f_h.write(source_header(path, count))
+        f_h.write(starts.tobytes())
+        f_h.write(sizes.tobytes())
+        f_h.writelines(urls[idx] for idx in kept)
+    os.replace(f"{dst}.tmp", dst)
+    return dst
+
+
+def read_header(dst):
+    """Read header of the table, None if there is no valid one."""
+    if not os.path.exists(dst):
+        return None
+    with open(dst, "rb") as f_h:
+        header = f_h.read(TABLE_HEADER.size)
+    if len(header) != TABLE_HEADER.size or header[:8] != TABLE_MAGIC:
+        return None
+    return header
+
+
+def ensure_url_table(path):
+    """Build sidecar table of urls file, unless up to date one exists."""
+    header = read_header(table_path(path))
+    if header is not None:
+        fids = TABLE_HEADER.unpack(header)[3]
+        if header == source_header(path, fids):
+            return table_path(path)
+    return build_url_table(path)
+
+
+class UrlTable:
+    """Read-only mapping from fact id to url, backed by sidecar table."""
+
+    def __init__(self, path):
+        """Open table of urls file, which has to be up to date."""
+        dst = table_path(path)
+        header = read_header(dst)
+        self.path, self.header = path, header
+        self.count = TABLE_HEADER.unpack(header)[3] if header else 0
+        if not self.is_current():
+            raise ValueError(f"Url table {dst} is missing or out of date")
+        self.data = b""
+        self.heap = TABLE_HEADER.size + 2 * self.count * INT64_SIZE
+        if self.count:
+            with open(dst, "rb") as f_h:
+                self.data = mmap.mmap(f_h.fileno(), 0, access=mmap.ACCESS_READ)
+        # indexing memory views of the mapped arrays gives python ints directly,
+        # which is several times faster than indexing numpy arrays
+        arrays = memoryview(self.data)[TABLE_HEADER.size : self.heap].cast("q")
+        self.starts, self.sizes = arrays[: self.count], arrays[self.count :]
+
+    def is_current(self):
+        """Check whether table is up to date with its urls file."""
+        return self.header is not None and self.header == source_header(
+            self.path, self.count
+        )
+
+    def __len__(self):
+        """Get number of fact ids with url."""
+        sizes = np.frombuffer(self.sizes, dtype=np.int64)
+        return int(np.count_nonzero(sizes != MISSING))
+
+    def __getitem__(self, fid):
+        """Get url of the fact id."""
+        if not 0 <= fid < self.count or self.sizes[fid] == MISSING:
+            raise KeyError(fid)
+        start = self.heap + self.starts[fid]
+        return self.data[start : start + self.sizes[fid]].decode("utf-8")
+
+    def __contains__(self, fid):
+        """Check whether there is url of the fact id."""
+        return 0 <= fid < self.count and self.sizes[fid] != MISSING
+
+    def get(self, fid, default=None):
+        """Get url of the fact id, or default."""
+        try:
+            return self[fid]
+        except KeyError:
+            return default
+
+
+def open_url_table(path):
+    """Open table of urls file, building it first if needed."""
+    ensure_url_table(path)
+    return UrlTable(path)
+
+
+def attached_url_table(path):
+    """
+    Get table of urls file opened once by this process.
+
+    Pages of the memory mapped table are shared by all the processes, so each
+    worker process costs no extra copy of it, and tasks run by the same worker
+    do not even reopen it.
+    """
+    table = attached_tables.get(path)
+    if table is None or not table.is_current():
+        table = attached_tables[path] = open_url_table(path)
+    return table
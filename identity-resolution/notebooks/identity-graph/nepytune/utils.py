@@ -5,14 +5,99 @@ import os
 import nepytune.benchmarks.benchmarks_visualization as bench_viz
 
 
+ID_SCHEME_ENV = "NEPYTUNE_ID_SCHEME"
+ID_DIGEST_SIZE = 16
+# parts are joined with NUL, unless some of them contain it; then they are
+# length prefixed after 0xff byte, which never occurs in utf-8
+PART_SEPARATOR = "\0"
+PREFIXED_MARKER = b"\xff"
+
+
+class Sha1Ids:
+    """Original ids, sha1 of stringified sorted tuples, kept for existing graphs."""
+
+    name = "sha1"
+
+    @staticmethod
+    def hash_(list_):
+        return hashlib.sha1(
+            str(tuple(sorted(list_))).encode("utf-8")
+        ).hexdigest()
+
+    @staticmethod
+    def get_id(_from, to, attributes):
+        return Sha1Ids.hash_([_from, to, str(tuple(attributes.items()))])
+
+
+def canonical_bytes(parts):
+    """Encode strings into bytes, so that different lists get different bytes."""
+    joined = PART_SEPARATOR.join(parts)
+    if joined.count(PART_SEPARATOR) == len(parts) - 1:
+        return joined.encode("utf-8")
+    return PREFIXED_MARKER + "".join(f"{len(part)}:{part}" for part in parts).encode(
+        "utf-8"
+    )
+
+
+class Blake2bIds:
+    """
+    Compact ids, short blake2b of canonical encoding of values as text.
+
+    Same entities get the same ids as in the original scheme: hashed values
+    are sorted and edge endpoints are interchangeable, while attributes are
+    sorted by name, as they are written into CSV files as text anyway.
+    """
+
+    name = "blake2b"
+
+    @staticmethod
+    def hash_(list_):
+        return hashlib.blake2b(
+            canonical_bytes(sorted(map(str, list_))), digest_size=ID_DIGEST_SIZE
+        ).hexdigest()
+
+    @staticmethod
+    def get_id(_from, to, attributes):
+        _from, to = str(_from), str(to)
+        parts = [_from, to] if _from <= to else [to, _from]
+        for name, value in sorted(attributes.items()):
+            parts.append(name)
+            parts.append(value if type(value) is str else str(value))
+        return hashlib.blake2b(
+            canonical_bytes(parts), digest_size=ID_DIGEST_SIZE
+        ).hexdigest()
+
+
+ID_SCHEMES = {scheme.name: scheme for scheme in (Sha1Ids, Blake2bIds)}
+
+
+def get_id_scheme(name=None):
+    """
+    Get id scheme by name.
+
+    Defaults to the one set in `NEPYTUNE_ID_SCHEME` environment variable,
+    otherwise to the original one, so that ids of existing graphs do not change.
+    """
+    name = name or os.environ.get(ID_SCHEME_ENV) or Sha1Ids.name
+    try:
+        return ID_SCHEMES[name]
+    except KeyError:
+        raise ValueError(
+            f"Unsupported id scheme {name}, available: {', '.join(ID_SCHEMES)}"
+        ) from None
+
+
+id_scheme = get_id_scheme()
+
+
 def hash_(list_):
-    """Generate sha1 hash from the given list."""
-    return hashlib.sha1(str(tuple(sorted(list_))).encode("utf-8")).hexdigest()
+    """Generate hash from the given list, regardless of its order."""
+    return id_scheme.hash_(list_)
 
 
 def get_id(_from, to, attributes):
     """Get id of a given entity."""
-    return hash_([_from, to, str(tuple(attributes.items()))])
+    return id_scheme.get_id(_from, to, attributes)
 
 
 def show_query_benchmarks(benchmark_results_path, cache_path, query,
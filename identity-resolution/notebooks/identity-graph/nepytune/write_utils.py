@@ -2,22 +2,68 @@ import abc
 import csv
 from contextlib import contextmanager
 import json
+import math
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from nepytune.compression import compression_of, open_file
+
+
+JSON_CODEC_ENV = "NEPYTUNE_JSON_CODEC"
+READ_BATCH_SIZE = 4 * 1024 * 1024
+WRITE_BATCH_SIZE = 4096
 
 
 class GremlinCSV:
-    """Build CSV file in AWS-Neptune ready-to-load data format."""
+    """
+    Build CSV file in AWS-Neptune ready-to-load data format.
 
-    def __init__(self, opened_file, attributes):
+    Rows are buffered and written in batches. Batch of strings without quotes
+    is formatted at once, as quoting all values is all that csv would do with
+    it, other batches are written by csv writer.
+    """
+
+    def __init__(self, opened_file, attributes, batch_size=WRITE_BATCH_SIZE):
         """Create CSV writer."""
         self.types = dict(key.split(":") for key in attributes)
+        self.opened_file = opened_file
         self.writer = csv.writer(opened_file, quoting=csv.QUOTE_ALL)
         self.key_order = list(self.types.keys())
+        self.batch_size = batch_size
+        self.rows = []
         self.writer.writerow(self.header)
 
     def attributes(self, attribute_map):
         """Build attribute list from attribute_map with default values."""
         return [attribute_map.get(k, "") for k in self.key_order]
 
+    def append(self, row):
+        """Buffer row, writing the batch once it is full."""
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write buffered rows into file."""
+        # batch is dropped even if writing it fails, not to fail again on next one
+        rows, self.rows = self.rows, []
+        if not rows:
+            return
+        try:
+            text = "".join(['"' + '","'.join(row) + '"\r\n' for row in rows])
+        except TypeError:
+            # not all values are strings
+            text = None
+        # every row has two quotes per value, unless some value contains quotes
+        if text is not None and text.count('"') == 2 * sum(map(len, rows)):
+            self.opened_file.write(text)
+        else:
+            self.writer.writerows(rows)
+
     @property
     @abc.abstractmethod
     def header(self):
@@ -38,7 +84,14 @@ class GremlinNodeCSV(GremlinCSV):
 
     def add(self, _id, attribute_map, label):
         """Add row to CSV file."""
-        self.writer.writerow([_id] + self.attributes(attribute_map) + [label])
+        self.append([_id, *self.attributes(attribute_map), label])
+
+    def add_row(self, _id, values, label):
+        """Add row to CSV file, with attribute values in order of attributes."""
+        rows = self.rows
+        rows.append([_id, *values, label])
+        if len(rows) >= self.batch_size:
+            self.flush()
 
 
 class GremlinEdgeCSV(GremlinCSV):
@@ -53,17 +106,205 @@ class GremlinEdgeCSV(GremlinCSV):
 
     def add(self, _id, _from, to, label, attribute_map):
         """Add row to CSV file."""
-        self.writer.writerow([_id, _from, to, label] + self.attributes(attribute_map))
+        self.append([_id, _from, to, label, *self.attributes(attribute_map)])
+
+    def add_row(self, _id, _from, to, label, values=()):
+        """Add row to CSV file, with attribute values in order of attributes."""
+        rows = self.rows
+        rows.append([_id, _from, to, label, *values])
+        if len(rows) >= self.batch_size:
+            self.flush()
 
 
 @contextmanager
 def gremlin_writer(type_, file_name, attributes):
     """Factory of gremlin writer objects."""
-    with open(file_name, "w", 1024 * 1024) as f_t:
-        yield type_(f_t, attributes=attributes)
+    with open_file(file_name, "w", 1024 * 1024) as f_t:
+        writer = type_(f_t, attributes=attributes)
+        try:
+            yield writer
+        finally:
+            writer.flush()
+
+
+class StdlibJsonCodec:
+    """Json lines codec backed by standard library `json` module."""
+
+    name = "json"
+
+    @staticmethod
+    def loads(line):
+        """Decode single line."""
+        return json.loads(line)
+
+    @staticmethod
+    def decode_lines(lines):
+        """Decode batch of utf-8 encoded lines."""
+        loads = json.loads
+        return (loads(line.decode("utf-8")) for line in lines)
+
+    @staticmethod
+    def encode_line(data):
+        """Encode record into utf-8 encoded, newline terminated line."""
+        return (json.dumps(data) + "\n").encode("utf-8")
+
+
+class OrjsonCodec:
+    """Json lines codec backed by `orjson`, if it is installed."""
+
+    name = "orjson"
+
+    @staticmethod
+    def loads(line):
+        """Decode single line."""
+        return orjson.loads(line)
+
+    @staticmethod
+    def decode_lines(lines):
+        """Decode batch of utf-8 encoded lines."""
+        return map(orjson.loads, lines)
+
+    @staticmethod
+    def encode_line(data):
+        """Encode record into utf-8 encoded, newline terminated line."""
+        return orjson.dumps(
+            data, default=orjson_default, option=orjson.OPT_APPEND_NEWLINE
+        )
+
+
+def orjson_default(obj):
+    """Serialize tuple subclasses (e.g. named tuples) as lists, like `json` does."""
+    if isinstance(obj, tuple):
+        return list(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+JSON_CODECS = {"json": StdlibJsonCodec}
+if orjson is not None:
+    JSON_CODECS["orjson"] = OrjsonCodec
+
+
+def get_json_codec(name=None):
+    """
+    Get json lines codec by name.
+
+    Defaults to the one set in `NEPYTUNE_JSON_CODEC` environment variable,
+    otherwise to the fastest one installed.
+    """
+    name = name or os.environ.get(JSON_CODEC_ENV) or list(JSON_CODECS)[-1]
+    try:
+        return JSON_CODECS[name]
+    except KeyError:
+        raise ValueError(
+            f"Unsupported json codec {name}, available: {', '.join(JSON_CODECS)}"
+        ) from None
+
+
+json_codec = get_json_codec()
+
+
+def encode_json_line(data):
+    """Encode record into json line bytes with the default codec."""
+    return json_codec.encode_line(data)
+
+
+def decode_json_line(line):
+    """Decode json line (str or bytes) with the default codec."""
+    return json_codec.loads(line)
+
+
+def json_lines_file(opened_file, codec=None):
+    """
+    Yield json lines from opened file (or any other iterable of lines).
+
+    Files opened in binary mode are read and decoded in batches of lines.
+    """
+    codec = codec or json_codec
+    if "b" not in getattr(opened_file, "mode", ""):
+        for line in opened_file:
+            yield codec.loads(line)
+        return
+
+    while True:
+        lines = opened_file.readlines(READ_BATCH_SIZE)
+        if not lines:
+            return
+        yield from codec.decode_lines(line for line in lines if line.strip())
+
+
+class JsonLinesWriter:
+    """Write records as json lines into file opened in binary mode, in batches."""
+
+    def __init__(self, opened_file, codec=None, batch_size=WRITE_BATCH_SIZE):
+        """Create writer."""
+        self.opened_file = opened_file
+        self.encode_line = (codec or json_codec).encode_line
+        self.batch_size = batch_size
+        self.buffer = []
+
+    def write(self, data):
+        """Write record."""
+        self.write_line(self.encode_line(data))
+
+    def write_line(self, line):
+        """Write already encoded line."""
+        self.buffer.append(line)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write buffered lines into the file."""
+        self.opened_file.writelines(self.buffer)
+        self.buffer = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+
+@contextmanager
+def json_lines_writer(file_name, mode="wb", codec=None, compression=None):
+    """Open (possibly compressed) file for writing json lines records in batches."""
+    with open_file(file_name, mode, compression=compression) as f_h:
+        with JsonLinesWriter(f_h, codec=codec) as writer:
+            yield writer
+
+
+def line_aligned_ranges(path, parts):
+    """
+    Split file into at most `parts` byte ranges, each one starting at a new line.
+
+    Every line belongs to the range in which its first byte lies. Compressed
+    file can only be read from its start, so it makes a single, unbounded range.
+    """
+    if compression_of(path):
+        return [(0, math.inf)]
+    size = os.path.getsize(path)
+    step = max(1, -(-size // max(1, parts)))
+    offsets = [0]
+    with open(path, "rb") as f_h:
+        for guess in range(step, size, step):
+            if guess <= offsets[-1]:
+                continue
+            f_h.seek(guess - 1)
+            f_h.readline()
+            offset = f_h.tell()
+            if offset >= size:
+                break
+            offsets.append(offset)
+    offsets.append(size)
+    return list(zip(offsets[:-1], offsets[1:]))
 
 
-def json_lines_file(opened_file):
-    """Yield json lines from opened file."""
-    for line in opened_file:
-        yield json.loads(line)
+def lines_in_range(opened_file, start, end):
+    """Yield raw lines of file opened in binary mode, starting in [start, end)."""
+    opened_file.seek(start)
+    position = start
+    while position < end:
+        line = opened_file.readline()
+        if not line:
+            return
+        position += len(line)
+        yield line
@@ -0,0 +1,70 @@
+import json
+import shutil
+
+import pytest
+
+from nepytune.cli.extend import extend_facts_file_parallel
+from nepytune.compression import open_file
+
+
+def write_json_lines(path, records):
+    with open_file(path, "wb") as f_h:
+        for data in records:
+            f_h.write((json.dumps(data) + "\n").encode("utf-8"))
+
+
+def read_json_lines(path):
+    with open_file(path, "rb") as f_h:
+        return [json.loads(line) for line in f_h]
+
+
+@pytest.fixture
+def facts_data():
+    uids = [f"u{idx}" for idx in range(50)]
+    # facts two hours apart, so that every one starts a new session
+    facts = [
+        {
+            "uid": uid,
+            "facts": [
+                {"fid": idx * 3 + k, "ts": 1_500_000_000_000 + k * 7_200_000}
+                for k in range(3)
+            ],
+        }
+        for idx, uid in enumerate(uids)
+    ]
+    ip_info = [
+        {
+            "transient_id": uid,
+            "loc": [{"state": f"S{idx}", "city": f"C{idx}.{k}"} for k in range(2)],
+        }
+        for idx, uid in enumerate(uids)
+    ]
+    user_identity = [
+        {"transient_id": uid, "type": "cookie", "email": f"{uid}@example.com"}
+        for uid in uids
+    ]
+    return facts, ip_info, user_identity
+
+
+@pytest.mark.parametrize("extension", [".gz", ".bz2", ".xz"])
+def test_parallel_extend_with_compressed_lookups(tmp_path, facts_data, extension):
+    facts, ip_info, user_identity = facts_data
+    outputs = []
+    for name, lookup_extension in [("plain", ""), ("compressed", extension)]:
+        directory = tmp_path / name
+        directory.mkdir()
+        fact_file = str(directory / "facts.json")
+        ip_file = str(directory / f"ip_info.json{lookup_extension}")
+        user_file = str(directory / f"user_identity.json{lookup_extension}")
+        write_json_lines(fact_file, facts)
+        write_json_lines(ip_file, ip_info)
+        write_json_lines(user_file, user_identity)
+
+        extend_facts_file_parallel(fact_file, ip_file, user_file, workers=2, _seed=3)
+        outputs.append(read_json_lines(fact_file))
+        indexes = [path for path in directory.iterdir() if path.suffix == ".idx"]
+        # compressed lookups are indexed in temporary copies only
+        assert len(indexes) == (0 if lookup_extension else 2)
+
+    assert outputs[0] == outputs[1]
+    assert len(outputs[0]) == len(facts)
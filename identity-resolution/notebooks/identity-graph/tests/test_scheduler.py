@@ -0,0 +1,54 @@
+import pytest
+
+from nepytune.scheduler import run_dag, task, validate
+
+
+def write(dst, text):
+    with open(dst, "w") as f_h:
+        f_h.write(text)
+
+
+def test_validate_gets_dependencies(tmp_path):
+    src, dst = str(tmp_path / "src"), str(tmp_path / "dst")
+    tasks = [
+        task("second", write, dst, "b", inputs=[src], outputs=[dst]),
+        task("first", write, src, "a", outputs=[src]),
+    ]
+    assert validate(tasks) == {"second": {"first"}, "first": set()}
+
+
+@pytest.mark.parametrize(
+    "tasks, message",
+    [
+        (
+            [task("a", write, "x", ""), task("a", write, "y", "")],
+            "Duplicate task name a",
+        ),
+        (
+            [
+                task("a", write, "x", "", outputs=["x"]),
+                task("b", write, "x", "", outputs=["x"]),
+            ],
+            "Tasks a and b both write x",
+        ),
+        (
+            [task("a", write, "x", "", inputs=["missing"], outputs=["x"])],
+            "Task a reads missing missing",
+        ),
+        (
+            [
+                task("a", write, "x", "", inputs=["y"], outputs=["x"]),
+                task("b", write, "y", "", inputs=["x"], outputs=["y"]),
+            ],
+            "Tasks with cyclic dependencies",
+        ),
+    ],
+)
+def test_invalid_graph_fails_before_running(tmp_path, tasks, message):
+    tasks = [
+        current._replace(args=(str(tmp_path / current.args[0]), current.args[1]))
+        for current in tasks
+    ]
+    with pytest.raises(ValueError, match=message):
+        run_dag(tasks, workers=2)
+    assert not list(tmp_path.iterdir())
@@ -0,0 +1,143 @@
+import argparse
+import json
+import os
+
+import pytest
+
+from nepytune.cli.transform import main
+
+
+KINDS = ["ip_nodes", "ip_edges", "transient_nodes", "transient_edges"]
+
+
+def write_json_lines(path, records):
+    with open(path, "w") as f_h:
+        for data in records:
+            f_h.write(json.dumps(data) + "\n")
+
+
+def write_urls(path, fids):
+    with open(path, "w") as f_h:
+        for fid in fids:
+            f_h.write(f"{fid},site{fid % 7}.example.com/p/{fid}\n")
+
+
+def read_csv(path):
+    """Read header and sorted rows of csv file."""
+    with open(path) as f_h:
+        header, *rows = f_h.read().splitlines()
+    return header, sorted(rows)
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    facts = [
+        {
+            "uid": f"u{idx}",
+            "facts": [
+                {
+                    "fid": idx * 3 + k,
+                    "ts": 1_500_000_000_000 + k * 7_200_000,
+                    # IP locations shared by users of different batches
+                    "state": f"S{idx % 4}",
+                    "city": f"C{idx % 4}.{k}",
+                    "ip_address": f"10.0.{idx % 4}.{k}",
+                }
+                for k in range(3)
+            ],
+            "user_agent": "Mozilla/5.0",
+            "device": "Other",
+            "os": "Linux",
+            "browser": "Firefox",
+            "email": f"u{idx}@example.com",
+            "type": "cookie",
+        }
+        for idx in range(20)
+    ]
+    write_json_lines(tmp_path / "facts.json", facts)
+    write_urls(tmp_path / "urls.csv", range(60))
+    (tmp_path / "batches").mkdir()
+    for start in range(0, 20, 10):
+        prefix = tmp_path / "batches" / f"{start}_{start + 10}_"
+        batch = facts[start : start + 10]
+        write_json_lines(f"{prefix}facts.json", batch)
+        write_urls(
+            f"{prefix}urls.csv",
+            sorted(fact["fid"] for data in batch for fact in data["facts"]),
+        )
+    return tmp_path
+
+
+def run_transform(tmp_path, name, workers, batches, template="${batch_id}"):
+    out = tmp_path / name
+    out.mkdir()
+    config_file = tmp_path / f"{name}.ini"
+    dst = "\n".join(f"{kind} = {out}/{template}{kind}.csv" for kind in KINDS)
+    config_file.write_text(
+        f"[src]\n"
+        f"facts = {tmp_path}/facts.json\n"
+        f"urls = {tmp_path}/urls.csv\n"
+        f"titles = {tmp_path}/titles.csv\n"
+        f"facts_glob = {tmp_path}/batches/*_facts.json\n"
+        f"urls_glob = {tmp_path}/batches/*_urls.csv\n"
+        f"[dst]\n{dst}\n"
+    )
+    with open(config_file) as f_h:
+        args = argparse.Namespace(
+            config_file=f_h,
+            websites=False,
+            website_groups=False,
+            transientIds=True,
+            persistentIds=False,
+            identityGroupIds=False,
+            ips=True,
+            batches=batches,
+            workers=workers,
+        )
+        main(args)
+    return out
+
+
+def test_batches_merged_equal_serial(dataset):
+    serial = run_transform(dataset, "serial", workers=1, batches=False)
+    batched = run_transform(dataset, "batched", workers=2, batches=True)
+
+    assert sorted(os.listdir(batched)) == sorted(
+        [f"{prefix}{kind}.csv" for prefix in ["0_10_", "10_20_"] for kind in KINDS[1:]]
+        + ["ip_nodes.csv"]
+    )
+    for kind in KINDS:
+        header, rows = read_csv(serial / f"{kind}.csv")
+        merged = []
+        for path in sorted(batched.glob(f"*{kind}.csv")):
+            batch_header, batch_rows = read_csv(path)
+            assert batch_header == header
+            merged += batch_rows
+        assert rows
+        assert sorted(merged) == rows
+
+
+def test_batches_need_batch_id_in_destinations(dataset, capsys):
+    with pytest.raises(SystemExit) as exc_info:
+        run_transform(dataset, "unbatched", workers=2, batches=True, template="")
+    assert exc_info.value.code == 2
+    assert "batch_id" in capsys.readouterr().out
+    assert not os.listdir(dataset / "unbatched")
+
+
+def test_missing_batch_urls_fail_before_writing(dataset, capsys):
+    os.remove(dataset / "batches" / "10_20_urls.csv")
+    with pytest.raises(SystemExit) as exc_info:
+        run_transform(dataset, "batched", workers=2, batches=True)
+    assert exc_info.value.code == 2
+    assert "10_20_facts.json" in capsys.readouterr().out
+    assert not os.listdir(dataset / "batched")
+
+
+def test_missing_source_fails_before_writing(dataset, capsys):
+    os.remove(dataset / "urls.csv")
+    with pytest.raises(SystemExit) as exc_info:
+        run_transform(dataset, "serial", workers=1, batches=False)
+    assert exc_info.value.code == 2
+    assert "reads missing" in capsys.readouterr().out
+    assert not os.listdir(dataset / "serial")
@@ -0,0 +1,25 @@
+import csv
+import io
+
+from nepytune.write_utils import GremlinEdgeCSV
+
+
+def test_rows_with_quotes_are_escaped_next_to_short_rows():
+    rows = [
+        ("e0", "u0", "w0", "visited"),
+        ("e1", "u1", "w1", "visited", 'say "hi"'),
+    ]
+    opened_file = io.StringIO(newline="")
+    writer = GremlinEdgeCSV(opened_file, attributes=["title:String"])
+    for row in rows:
+        writer.add_row(*row[:4], values=row[4:])
+    writer.flush()
+
+    expected = io.StringIO(newline="")
+    csv_writer = csv.writer(expected, quoting=csv.QUOTE_ALL)
+    csv_writer.writerow(writer.header)
+    csv_writer.writerows(rows)
+    assert opened_file.getvalue() == expected.getvalue()
+    assert list(csv.reader(io.StringIO(opened_file.getvalue())))[1:] == [
+        list(row) for row in rows
+    ]